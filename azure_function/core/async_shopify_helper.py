@@ -0,0 +1,312 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+try:
+    from .campaigns import CampaignEngine
+    from .collection_index import collection_steps
+    from .records import ORDER_FIELDS, ORDER_HISTORY_FIELDS, decode_orders
+    from .recommendation_writer import (ESTIMATED_READ_COST_PER_CUSTOMER, MAX_BATCH_SIZE, READ_BATCH_SIZE,
+                                        RECOMMENDATIONS_QUERY, WriteReport, customer_gid, metafield_values,
+                                        previous_products, write_batch_steps)
+    from .shopify_helper import API_VERSION, request_steps
+    from .telemetry import ScanTelemetry, instrumented
+    from .throttle import ShopifyThrottle
+    from .token_provider import default_token_provider
+except ImportError:
+    from campaigns import CampaignEngine
+    from collection_index import collection_steps
+    from records import ORDER_FIELDS, ORDER_HISTORY_FIELDS, decode_orders
+    from recommendation_writer import (ESTIMATED_READ_COST_PER_CUSTOMER, MAX_BATCH_SIZE, READ_BATCH_SIZE,
+                                       RECOMMENDATIONS_QUERY, WriteReport, customer_gid, metafield_values,
+                                       previous_products, write_batch_steps)
+    from shopify_helper import API_VERSION, request_steps
+    from telemetry import ScanTelemetry, instrumented
+    from throttle import ShopifyThrottle
+    from token_provider import default_token_provider
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+def order_filters(date_start=None, date_end=None):
+    """Paramètres de orders.json pour les commandes créées entre date_start et date_end (YYYY-MM-DD)."""
+    filters = {'status': 'any'}
+    if date_start:
+        filters['created_at_min'] = f"{date_start}T00:00:00Z"
+    if date_end:
+        filters['created_at_max'] = f"{date_end}T23:59:59Z"
+    return filters
+
+
+class AsyncShopifyHelper:
+    """Variante asyncio de ShopifyHelper (httpx.AsyncClient) pour les points d'entrée async.
+
+    Mêmes opérations (produits des collections, clients éligibles, historiques d'achat,
+    écriture des recommandations), mais les requêtes indépendantes (collections, historiques
+    de plusieurs clients, lots d'écriture) partent ensemble. max_concurrency borne les requêtes
+    en vol ; le limiteur (ShopifyThrottle) peut être partagé avec un ShopifyHelper de la même
+    boutique, il est alors respecté par les deux.
+    """
+
+    def __init__(self, store_url, access_token=None, client_id=None, client_secret=None, throttle=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=60, token_provider=None, base_url=None,
+                 telemetry=None):
+        self.store_url = store_url
+        self.api_url = f"{base_url or f'https://{store_url}'}/admin/api/{API_VERSION}"
+        self.throttle = throttle or ShopifyThrottle()
+        self.telemetry = telemetry or ScanTelemetry(store_url)
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+        )
+        # Produits des collections, lus une fois par instance
+        self._collections = {}
+
+        self.token_provider = None
+        self._client_credentials = None
+        if not access_token and client_id and client_secret:
+            self.token_provider = token_provider or default_token_provider()
+            self._client_credentials = (client_id, client_secret)
+        self.access_token = access_token
+        self.http.headers['X-Shopify-Access-Token'] = access_token or ''
+
+    async def _ensure_token(self):
+        """Jeton courant du TokenProvider (appel bloquant, exécuté hors de la boucle d'événements)."""
+        if self.token_provider is None:
+            return
+        token = await asyncio.to_thread(self.token_provider.get_token, self.store_url, *self._client_credentials)
+        if token != self.access_token:
+            self.access_token = token
+            self.http.headers['X-Shopify-Access-Token'] = token
+
+    async def _refresh_token(self, rejected):
+        """Après un 401, remplace le jeton refusé (voir ShopifyHelper._refresh_token)."""
+        if self.token_provider is None:
+            return False
+        token = await asyncio.to_thread(self.token_provider.get_token, self.store_url, *self._client_credentials,
+                                        rejected=rejected)
+        self.access_token = token
+        self.http.headers['X-Shopify-Access-Token'] = token
+        print(f"DEBUG: 401 sur {self.store_url}, jeton renouvelé")
+        return True
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    # --- transport ---
+
+    async def _send(self, kind, steps, send):
+        """Déroule request_steps (voir ShopifyHelper._send) ; l'envoi passe par le sémaphore."""
+        await self._ensure_token()
+        sent_token = None
+        try:
+            action, value = next(steps)
+            while True:
+                if action == 'wait':
+                    if value:
+                        await asyncio.sleep(value)
+                    self.telemetry.record_throttle_wait(value, kind)
+                    result = None
+                elif action == 'send':
+                    async with self._semaphore:
+                        sent_token = self.access_token
+                        started = time.perf_counter()
+                        result = await send()
+                    self.telemetry.record_request(kind, result.status_code, time.perf_counter() - started,
+                                                  len(result.content))
+                else:
+                    result = await self._refresh_token(sent_token)
+                action, value = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def _request(self, method, url, **kwargs):
+        """Requête REST à travers le limiteur et le sémaphore, avec reprise sur 429 et un nouvel essai après un 401."""
+        if not url.startswith('http'):
+            url = f"{self.api_url}/{url}"
+        return await self._send('rest', request_steps(self.throttle, 'rest'),
+                                lambda: self.http.request(method, url, **kwargs))
+
+    async def graphql(self, query, variables=None, cost=10):
+        """Exécute une requête GraphQL Admin et renvoie le contenu de 'data' (voir ShopifyHelper.graphql)."""
+        url = f"{self.api_url}/graphql.json"
+        payload = {'query': query, 'variables': variables or {}}
+        return await self._send('graphql', request_steps(self.throttle, 'graphql', cost),
+                                lambda: self.http.post(url, json=payload))
+
+    # --- lectures ---
+
+    async def _fetch_collection(self, collection_id):
+        steps = collection_steps(collection_id)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await self.graphql(*request))
+        except StopIteration as stop:
+            return stop.value
+
+    @instrumented(items=len)
+    async def get_collection_products(self, collection_id):
+        """IDs des produits d'une collection, dans l'ordre de la collection (lus une fois par instance)."""
+        collection_id = int(collection_id)
+        task = self._collections.get(collection_id)
+        self.telemetry.record_cache('collections', hit=task is not None)
+        if task is None:
+            # Tâche mémorisée : des appels simultanés pour la même collection partagent la même lecture
+            task = self._collections[collection_id] = asyncio.ensure_future(self._fetch_collection(collection_id))
+        try:
+            return await task
+        except Exception:
+            # Lecture en échec : relancée au prochain appel
+            self._collections.pop(collection_id, None)
+            raise
+
+    async def iter_order_pages(self, page_size=250, fields=ORDER_FIELDS, **filters):
+        """Pages d'OrderRecord, en suivant les curseurs page_info (en-tête Link)."""
+        response = await self._request('GET', 'orders.json', params={'limit': page_size, 'fields': fields, **filters})
+        while True:
+            yield decode_orders(response.content)
+            next_link = response.links.get('next')
+            if not next_link:
+                break
+            response = await self._request('GET', next_link['url'])
+
+    async def iter_orders(self, date_start=None, date_end=None, page_size=250):
+        """Commandes créées entre date_start et date_end (YYYY-MM-DD) ; une borne à None n'est pas filtrée."""
+        async for page in self.iter_order_pages(page_size=page_size, **order_filters(date_start, date_end)):
+            for order in page:
+                yield order
+
+    async def iter_purchase_pages(self, history_days=None):
+        """Commandes client depuis J-history_days, par page : listes de (client, created_at, product_ids)."""
+        history_start = None
+        if history_days is not None:
+            # 0 est une fenêtre valide (commandes du jour) : seul None veut dire tout l'historique
+            history_start = (datetime.now() - timedelta(days=history_days)).strftime('%Y-%m-%d')
+        async for page in self.iter_order_pages(**order_filters(history_start)):
+            yield [(order.customer, order.created_at, order.product_ids) for order in page if order.customer]
+
+    async def iter_purchases(self, history_days=None):
+        """Commandes client depuis J-history_days : (client, created_at, product_ids)."""
+        async for page in self.iter_purchase_pages(history_days):
+            for purchase in page:
+                yield purchase
+
+    @instrumented(items=len)
+    async def get_eligible_customers(self, days_start=180, days_end=None, collection_id=None):
+        """Clients ayant commandé entre J-days_end et J-days_start (dans la collection si fournie), une fois chacun."""
+        days_end = days_start if days_end is None else days_end
+        date_start = (datetime.now() - timedelta(days=days_end)).strftime('%Y-%m-%d')
+        date_end = (datetime.now() - timedelta(days=days_start)).strftime('%Y-%m-%d')
+        targets = frozenset(await self.get_collection_products(collection_id)) if collection_id else None
+        customers = {}
+        async for order in self.iter_orders(date_start, date_end):
+            if not order.customer or order.customer.id in customers:
+                continue
+            if targets is not None and targets.isdisjoint(order.product_ids):
+                continue
+            customers[order.customer.id] = order.customer
+        return list(customers.values())
+
+    @instrumented()
+    async def get_customer_purchase_history(self, customer_id):
+        """Produits achetés par un client."""
+        purchased_ids = set()
+        async for page in self.iter_order_pages(fields=ORDER_HISTORY_FIELDS, customer_id=customer_id, status='any'):
+            for order in page:
+                purchased_ids.update(order.product_ids)
+        return purchased_ids
+
+    @instrumented(items=len)
+    async def get_customers_purchase_histories(self, customer_ids):
+        """Historiques de plusieurs clients, lus en parallèle : {client: produits}."""
+        customer_ids = list(customer_ids)
+        histories = await asyncio.gather(*(self.get_customer_purchase_history(cid) for cid in customer_ids))
+        return dict(zip(customer_ids, histories))
+
+    async def _read_previous_batch(self, customer_ids):
+        data = await self.graphql(RECOMMENDATIONS_QUERY, {'ids': [customer_gid(cid) for cid in customer_ids]},
+                                  cost=ESTIMATED_READ_COST_PER_CUSTOMER * len(customer_ids))
+        return previous_products(metafield_values(data))
+
+    @instrumented(items=len)
+    async def get_previous_recommendations(self, customer_ids):
+        """Produits déjà recommandés : {client: produits}, lots nodes(ids:) de 100 clients en parallèle."""
+        customer_ids = list(customer_ids)
+        batches = [customer_ids[i:i + READ_BATCH_SIZE] for i in range(0, len(customer_ids), READ_BATCH_SIZE)]
+        previous = {}
+        for batch_previous in await asyncio.gather(*(self._read_previous_batch(batch) for batch in batches)):
+            previous.update(batch_previous)
+        return previous
+
+    # --- écritures ---
+
+    async def _write_batch(self, batch, history):
+        """Envoie un lot (voir write_batch_steps et run_batch_steps) ; renvoie (résultats, requêtes)."""
+        steps = write_batch_steps(batch, history)
+        requests = 0
+        try:
+            mutation, variables, cost = next(steps)
+            while True:
+                requests += 1
+                try:
+                    data = await self.graphql(mutation, variables, cost=cost)
+                except Exception as e:
+                    mutation, variables, cost = steps.throw(e)
+                else:
+                    mutation, variables, cost = steps.send(data)
+        except StopIteration as stop:
+            return stop.value, requests
+
+    @instrumented(items=lambda report: len(report.results))
+    async def update_customers_recommendations(self, recommendations, history=None, on_batch=None):
+        """Écrit {client: [produits]} par lots GraphQL de 25 envoyés en parallèle (voir RecommendationWriter.write).
+
+        on_batch(results) est appelé dans l'ordre d'achèvement des lots.
+        """
+        items = [(customer_id, list(product_ids)) for customer_id, product_ids in recommendations.items() if product_ids]
+        batches = [items[i:i + MAX_BATCH_SIZE] for i in range(0, len(items), MAX_BATCH_SIZE)]
+        report = WriteReport()
+        started = time.monotonic()
+        for finished in asyncio.as_completed([self._write_batch(batch, history) for batch in batches]):
+            results, requests = await finished
+            report.requests += requests
+            report.results.extend(results)
+            if on_batch is not None:
+                on_batch(results)
+        report.elapsed = time.monotonic() - started
+        return report
+
+    async def update_customer_recommendations(self, customer_id, product_ids):
+        """Met à jour les recommandations d'un seul client ; renvoie True si l'écriture a réussi."""
+        report = await self.update_customers_recommendations({customer_id: product_ids})
+        return bool(report.results) and report.results[0].success
+
+    # --- campagnes ---
+
+    @instrumented(items=lambda results: sum(result.eligible_count for result in results))
+    async def run_campaigns(self, campaigns, history_days=None, ranking='affinity', exclude_previous=True, since=None):
+        """Même passe que ShopifyHelper.run_campaigns (source REST) : collections lues en parallèle,
+        commandes consommées au fil des pages, recommandations passées relues en parallèle.
+
+        L'éligibilité de chaque page et le classement (SciPy) tournent dans un thread :
+        la boucle d'événements reste libre pour les requêtes en vol.
+        """
+        products = await asyncio.gather(*(self.get_collection_products(c.collection_id) for c in campaigns))
+        collection_products = {campaign.collection_id: product_ids for campaign, product_ids in zip(campaigns, products)}
+        engine = CampaignEngine(campaigns, collection_products, ranking=ranking, since=since)
+        async for page in self.iter_purchase_pages(history_days):
+            await asyncio.to_thread(engine.add_orders, page)
+        previous = await self.get_previous_recommendations(engine.eligible_customer_ids()) if exclude_previous else None
+        return await asyncio.to_thread(engine.results, previous)
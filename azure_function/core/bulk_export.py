@@ -0,0 +1,256 @@
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from itertools import groupby
+
+import requests
+
+try:
+    from .purchase_index import PurchaseIndex, CustomerInfo
+    from .records import loads
+except ImportError:
+    from purchase_index import PurchaseIndex, CustomerInfo
+    from records import loads
+
+# Requête exportée par l'opération bulk : uniquement ce dont le scanner a besoin
+ORDERS_BULK_QUERY = """
+{
+  orders%s {
+    edges {
+      node {
+        id
+        createdAt
+        customer { id firstName lastName email }
+        lineItems {
+          edges {
+            node {
+              product { id }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+RUN_BULK_MUTATION = """
+mutation($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_QUERY = """
+query($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+  }
+}
+"""
+
+FINISHED_STATUSES = {'COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED'}
+# Commandes gardées en mémoire pendant la lecture du JSONL ; les plus anciennes sont rangées sur disque
+ORDER_WINDOW = 1000
+# Reprises du téléchargement (coupure réseau, délai dépassé) ; les lignes déjà lues sont sautées
+DOWNLOAD_RETRIES = 3
+
+
+class BulkOperationError(Exception):
+    """L'opération bulk n'a pas pu être lancée ou ne s'est pas terminée correctement."""
+
+
+def gid_to_id(gid):
+    """Convertit un GID GraphQL (gid://shopify/Order/123) en identifiant REST numérique."""
+    if gid is None:
+        return None
+    return int(str(gid).rsplit('/', 1)[-1])
+
+
+class BulkOrderExport:
+    """Export de l'historique de commandes via une opération bulk GraphQL (bulkOperationRunQuery).
+
+    Une seule requête lance l'export côté Shopify ; le fichier JSONL produit est ensuite
+    lu ligne par ligne, sans jamais être chargé entièrement en mémoire.
+    """
+
+    def __init__(self, helper, poll_interval=5, timeout=3600, download_timeout=60, order_window=ORDER_WINDOW):
+        self.helper = helper
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # Délai de connexion et entre deux blocs reçus : un téléchargement bloqué échoue au lieu de pendre
+        self.download_timeout = download_timeout
+        self.order_window = order_window
+
+    def start(self, created_at_min=None):
+        """Lance l'opération bulk et renvoie son GID."""
+        search = f'(query: "created_at:>={created_at_min}")' if created_at_min else ''
+        data = self.helper.graphql(RUN_BULK_MUTATION, {'query': ORDERS_BULK_QUERY % search})
+        result = data['bulkOperationRunQuery']
+        if result.get('userErrors'):
+            raise BulkOperationError(result['userErrors'])
+        return result['bulkOperation']['id']
+
+    def wait(self, operation_id):
+        """Interroge l'opération jusqu'à sa fin et renvoie l'URL du fichier JSONL (None si vide)."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            operation = self.helper.graphql(BULK_STATUS_QUERY, {'id': operation_id})['node']
+            status = operation['status']
+            if status in FINISHED_STATUSES:
+                break
+            if time.monotonic() > deadline:
+                raise BulkOperationError(f"Délai dépassé pour l'opération {operation_id} (statut {status})")
+            time.sleep(self.poll_interval)
+
+        if status != 'COMPLETED':
+            raise BulkOperationError(f"Opération {operation_id} terminée en {status} ({operation.get('errorCode')})")
+
+        print(f"DEBUG: Export bulk terminé ({operation.get('objectCount')} objets)")
+        # Aucun objet exporté : Shopify ne fournit pas de fichier
+        return operation.get('url')
+
+    def iter_lines(self, url):
+        """Télécharge le fichier JSONL en streaming et renvoie chaque ligne décodée.
+
+        Passe par la session HTTP du helper (pool de connexions), sans son jeton : l'URL signée
+        pointe vers le stockage de Shopify. Une coupure reprend le téléchargement après les lignes déjà lues.
+        """
+        if not url:
+            return
+        telemetry = getattr(self.helper, 'telemetry', None)
+        read = 0
+        attempt = 0
+        while True:
+            received = 0
+            status = 0
+            started = time.perf_counter()
+            try:
+                with self.helper.http.get(url, stream=True, timeout=self.download_timeout,
+                                          headers={'X-Shopify-Access-Token': None}) as response:
+                    status = response.status_code
+                    response.raise_for_status()
+                    for position, line in enumerate(response.iter_lines()):
+                        received += len(line) + 1
+                        if position < read:
+                            continue
+                        read += 1
+                        if line:
+                            yield loads(line)
+                return
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= DOWNLOAD_RETRIES:
+                    raise
+                attempt += 1
+                print(f"DEBUG: Téléchargement bulk interrompu ({e}), reprise {attempt}/{DOWNLOAD_RETRIES}")
+                time.sleep(min(2 ** attempt, 30))
+            finally:
+                if telemetry is not None:
+                    telemetry.record_request('bulk', status, time.perf_counter() - started, received)
+
+    def iter_orders(self, url):
+        """Regroupe les lignes JSONL en commandes : (order_id, customer, created_at, product_ids), une fois chacune.
+
+        Les lignes de commande sont liées à leur commande par __parentId, sans garantie qu'elles la
+        suivent de près. Les order_window dernières commandes restent en mémoire ; les plus anciennes
+        sont rangées dans une base SQLite temporaire, où une ligne tardive est rattachée à sa commande.
+        Aucune ligne n'est perdue et la mémoire reste bornée. Le client est un CustomerInfo (ou None).
+        """
+        with tempfile.TemporaryDirectory(prefix='bulk-orders-') as directory:
+            conn = sqlite3.connect(os.path.join(directory, 'orders.sqlite'))
+            try:
+                yield from self._group_orders(url, conn)
+            finally:
+                conn.close()
+
+    def _group_orders(self, url, conn):
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE orders (seq INTEGER PRIMARY KEY, gid TEXT, order_id INTEGER, customer_id INTEGER, "
+                     "first_name TEXT, last_name TEXT, email TEXT, created_at TEXT, product_ids TEXT)")
+        conn.execute("CREATE TABLE late_lines (seq INTEGER PRIMARY KEY, gid TEXT, product_id INTEGER)")
+
+        def spill(orders):
+            conn.executemany("INSERT INTO orders (gid, order_id, customer_id, first_name, last_name, email, created_at, "
+                             "product_ids) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(gid, order_id, *(customer or (None,) * 4), created_at, ",".join(map(str, product_ids)))
+                              for gid, (order_id, customer, created_at, product_ids) in orders])
+
+        window = OrderedDict()
+        evicted = []
+        late = []
+        for record in self.iter_lines(url):
+            parent_id = record.get('__parentId')
+            if parent_id is None:
+                customer = record.get('customer')
+                if customer:
+                    customer = (gid_to_id(customer['id']), customer.get('firstName'),
+                                customer.get('lastName'), customer.get('email'))
+                window[record['id']] = (gid_to_id(record['id']), customer, record.get('createdAt'), [])
+                if len(window) > self.order_window:
+                    evicted.append(window.popitem(last=False))
+                    if len(evicted) >= self.order_window:
+                        spill(evicted)
+                        evicted = []
+                continue
+
+            product_id = gid_to_id((record.get('product') or {}).get('id'))
+            if product_id is None:
+                # Produit supprimé depuis la commande
+                continue
+            order = window.get(parent_id)
+            if order is not None:
+                order[3].append(product_id)
+            else:
+                # Commande déjà sortie de la fenêtre (ou pas encore lue) : rattachée à la fin
+                late.append((parent_id, product_id))
+                if len(late) >= self.order_window:
+                    conn.executemany("INSERT INTO late_lines (gid, product_id) VALUES (?, ?)", late)
+                    late = []
+        spill(evicted)
+        spill(window.items())
+        window.clear()
+        conn.executemany("INSERT INTO late_lines (gid, product_id) VALUES (?, ?)", late)
+
+        late_count = conn.execute("SELECT COUNT(*) FROM late_lines").fetchone()[0]
+        if late_count:
+            conn.execute("CREATE INDEX orders_gid ON orders (gid)")
+            orphans = conn.execute("SELECT COUNT(*) FROM late_lines l WHERE NOT EXISTS "
+                                   "(SELECT 1 FROM orders o WHERE o.gid = l.gid)").fetchone()[0]
+            if orphans:
+                raise BulkOperationError(f"{orphans} ligne(s) de commande sans commande parente dans l'export")
+            print(f"DEBUG: {late_count} ligne(s) de commande hors fenêtre rattachée(s) à leur commande")
+        conn.execute("CREATE INDEX late_lines_gid ON late_lines (gid, seq)")
+
+        rows = conn.execute(
+            "SELECT o.seq, o.order_id, o.customer_id, o.first_name, o.last_name, o.email, o.created_at, o.product_ids, "
+            "l.product_id FROM orders o LEFT JOIN late_lines l ON l.gid = o.gid ORDER BY o.seq, l.seq"
+        )
+        for _, group in groupby(rows, key=lambda row: row[0]):
+            first = next(group)
+            _, order_id, customer_id, first_name, last_name, email, created_at, product_ids, late_product = first
+            product_ids = [int(pid) for pid in product_ids.split(',')] if product_ids else []
+            if late_product is not None:
+                product_ids.append(late_product)
+                product_ids.extend(row[8] for row in group)
+            customer = CustomerInfo(customer_id, first_name, last_name, email) if customer_id is not None else None
+            yield order_id, customer, created_at, product_ids
+
+    def build_purchase_index(self, url, index=None):
+        """Alimente un PurchaseIndex (historiques + éligibilité) à partir du fichier JSONL."""
+        index = index if index is not None else PurchaseIndex()
+        for _, customer, created_at, product_ids in self.iter_orders(url):
+            if customer is None:
+                continue
+            index.add_order(customer.id, created_at, product_ids, customer=customer)
+        return index.freeze()
+
+    def run(self, created_at_min=None, index=None):
+        """Lance l'export, attend sa fin et renvoie le PurchaseIndex construit."""
+        operation_id = self.start(created_at_min)
+        print(f"DEBUG: Opération bulk lancée ({operation_id})")
+        return self.build_purchase_index(self.wait(operation_id), index)
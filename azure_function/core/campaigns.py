@@ -0,0 +1,237 @@
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+try:
+    from .purchase_index import CustomerInfo, PurchaseIndex
+    from .ranking import CoPurchaseRanker, RANKING_AFFINITY, RANKING_MODES
+except ImportError:
+    from purchase_index import CustomerInfo, PurchaseIndex
+    from ranking import CoPurchaseRanker, RANKING_AFFINITY, RANKING_MODES
+
+@dataclass(frozen=True)
+class Campaign:
+    """Une relance cross-sell : une collection et sa fenêtre de délai après l'achat."""
+    name: str
+    collection_id: int
+    delay_start: int = 365
+    delay_end: int = 548
+    max_recommendations: int = 3
+
+    def window(self, today=None, since=None):
+        """Dates (début, fin) YYYY-MM-DD des commandes éligibles à cette campagne.
+
+        since : dernier jour (YYYY-MM-DD) déjà traité par un run réussi. Seule la tranche de
+        commandes entrée dans la fenêtre depuis ce jour est renvoyée (plusieurs jours après des
+        runs manqués, vide si début > fin), sans jamais dépasser la fenêtre complète.
+        """
+        today = today or datetime.now()
+        start = (today - timedelta(days=self.delay_end)).strftime('%Y-%m-%d')
+        end = (today - timedelta(days=self.delay_start)).strftime('%Y-%m-%d')
+        if since:
+            entered = datetime.strptime(since[:10], '%Y-%m-%d') - timedelta(days=self.delay_start - 1)
+            start = max(start, entered.strftime('%Y-%m-%d'))
+        return start, end
+
+
+def load_campaigns(source=None):
+    """Charge la liste des campagnes.
+
+    source (ou CROSS_SELL_CAMPAIGNS) : chemin d'un fichier JSON (voir campaigns.example.json) ou JSON en ligne.
+    À défaut, la campagne unique historique décrite par TARGET_COLLECTION_ID /
+    ORDER_DELAY_DAYS_START / ORDER_DELAY_DAYS_END. Sans l'un ni l'autre : ValueError, aucune
+    collection n'est relancée sans avoir été choisie.
+    """
+    source = source or os.environ.get("CROSS_SELL_CAMPAIGNS")
+    if source and source.lstrip().startswith('['):
+        entries = json.loads(source)
+    elif source:
+        with open(source, encoding='utf-8') as f:
+            entries = json.load(f)
+    elif os.environ.get("TARGET_COLLECTION_ID"):
+        entries = [{
+            'name': 'default',
+            'collection_id': os.environ["TARGET_COLLECTION_ID"],
+            'delay_start': os.environ.get("ORDER_DELAY_DAYS_START", 365),
+            'delay_end': os.environ.get("ORDER_DELAY_DAYS_END", 548),
+        }]
+    else:
+        raise ValueError("Aucune campagne configurée : définir CROSS_SELL_CAMPAIGNS ou TARGET_COLLECTION_ID")
+
+    return [
+        Campaign(
+            name=entry.get('name') or str(entry['collection_id']),
+            collection_id=int(entry['collection_id']),
+            delay_start=int(entry.get('delay_start', 365)),
+            delay_end=int(entry.get('delay_end', 548)),
+            max_recommendations=int(entry.get('max_recommendations', 3)),
+        )
+        for entry in entries
+    ]
+
+
+@dataclass
+class CampaignResult:
+    campaign: Campaign
+    # client -> produits recommandés, du plus pertinent au moins pertinent
+    recommendations: dict = field(default_factory=dict)
+    eligible_count: int = 0
+    # Clients éligibles sans aucun produit restant à recommander (tout possédé ou déjà recommandé)
+    complete_count: int = 0
+    # client -> produits déjà recommandés lors des runs précédents (clients de recommendations)
+    previous: dict = field(default_factory=dict)
+
+
+class CampaignEngine:
+    """Évalue toutes les campagnes en une seule passe sur les commandes.
+
+    Un index inversé produit -> campagnes permet de savoir, pour chaque ligne de commande,
+    quelles campagnes elle déclenche, sans reparcourir les commandes par collection.
+
+    ranking : 'affinity' (co-achats, voir CoPurchaseRanker) ou 'collection' (premiers
+    produits non possédés dans l'ordre de la collection).
+
+    since : {campagne: dernier jour traité} (éligibilité incrémentale, voir Campaign.window) ;
+    une campagne absente est évaluée sur toute sa fenêtre.
+    """
+
+    def __init__(self, campaigns, collection_products, today=None, ranking=RANKING_AFFINITY, since=None):
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Classement inconnu : {ranking} (attendu : {', '.join(RANKING_MODES)})")
+        self.campaigns = list(campaigns)
+        self.ranking = ranking
+        # collection -> produits, dans l'ordre renvoyé par Shopify
+        self.collection_products = {int(cid): list(pids) for cid, pids in collection_products.items()}
+        since = since or {}
+        self.windows = [campaign.window(today, since.get(campaign.name)) for campaign in self.campaigns]
+
+        self.product_campaigns = {}
+        for position, campaign in enumerate(self.campaigns):
+            for product_id in self.collection_products.get(campaign.collection_id, []):
+                self.product_campaigns.setdefault(product_id, []).append(position)
+
+        self.history = PurchaseIndex()
+        self._eligible = [dict() for _ in self.campaigns]
+
+    def add_order(self, customer, created_at, product_ids):
+        """Ajoute une commande client : historique + éligibilité pour chaque campagne concernée."""
+        if customer is None:
+            return
+        self.history.add_order(customer.id, created_at, product_ids)
+
+        day = (created_at or '')[:10]
+        for product_id in product_ids:
+            for position in self.product_campaigns.get(product_id, ()):
+                eligible = self._eligible[position]
+                if customer.id in eligible:
+                    continue
+                window_start, window_end = self.windows[position]
+                if window_start <= day <= window_end:
+                    eligible[customer.id] = customer
+
+    def export_partial(self):
+        """État de la passe (historiques + éligibles par campagne) sous forme JSON, pour merge_partial.
+
+        Permet de répartir la passe sur des plages de dates traitées séparément (activités Durable).
+        """
+        self.history.freeze()
+        product_ids = self.history.product_ids
+        return {
+            'orders': self.history.order_count,
+            'histories': [[customer_id, [product_ids[slot] for slot in slots]]
+                          for customer_id, slots in self.history.iter_histories()],
+            'eligible': [[list(customer) for customer in eligible.values()] for eligible in self._eligible],
+        }
+
+    def merge_partial(self, partial):
+        """Ajoute l'état exporté (export_partial) d'une autre passe sur les mêmes campagnes."""
+        for customer_id, product_ids in partial['histories']:
+            self.history.add_order(customer_id, None, product_ids)
+        for eligible, customers in zip(self._eligible, partial['eligible']):
+            for customer in customers:
+                eligible.setdefault(customer[0], CustomerInfo(*customer))
+
+    def add_orders(self, purchases):
+        """Ajoute un lot de (client, date, produits), par exemple une page de commandes."""
+        for customer, created_at, product_ids in purchases:
+            self.add_order(customer, created_at, product_ids)
+
+    def eligible_customer_ids(self):
+        """Clients éligibles à au moins une campagne."""
+        customer_ids = set()
+        for eligible in self._eligible:
+            customer_ids.update(eligible)
+        return customer_ids
+
+    def run(self, purchases, load_previous=None):
+        """Consomme un itérable de (client, date, produits) et renvoie un CampaignResult par campagne.
+
+        load_previous(client_ids) -> {client: produits déjà recommandés} est appelé une fois,
+        après la passe, pour les seuls clients éligibles ; ces produits ne sont pas reproposés.
+        """
+        self.add_orders(purchases)
+        previous = load_previous(self.eligible_customer_ids()) if load_previous else None
+        return self.results(previous)
+
+    def run_snapshot(self, snapshot, load_previous=None):
+        """Comme run, à partir d'un instantané colonne (OrderSnapshot) : historiques construits en bloc,
+        éligibilité de chaque campagne évaluée en NumPy (fenêtre de dates, isin sur la collection)."""
+        self.history = snapshot.purchase_index()
+        for position, campaign in enumerate(self.campaigns):
+            window_start, window_end = self.windows[position]
+            if window_start > window_end:
+                continue
+            product_ids = self.collection_products.get(campaign.collection_id, [])
+            customers = snapshot.eligible_customers(window_start, window_end, product_ids)
+            self._eligible[position] = {customer.id: customer for customer in customers}
+        previous = load_previous(self.eligible_customer_ids()) if load_previous else None
+        return self.results(previous)
+
+    def _collection_order(self, customer_ids, candidates, limit, previous):
+        recommendations = {}
+        for customer_id in customer_ids:
+            history = self.history.history(customer_id)
+            history.update(previous.get(customer_id, ()))
+            remaining = [pid for pid in candidates if pid not in history]
+            if remaining:
+                recommendations[customer_id] = remaining[:limit]
+        return recommendations
+
+    def results(self, previous=None):
+        previous = previous or {}
+        self.history.freeze()
+        # Une seule matrice de co-achats pour toutes les campagnes
+        ranker = CoPurchaseRanker(self.history) if self.ranking == RANKING_AFFINITY else None
+        results = []
+        for campaign, eligible in zip(self.campaigns, self._eligible):
+            candidates = self.collection_products.get(campaign.collection_id, [])
+            if ranker is not None:
+                recommendations = ranker.rank(list(eligible), candidates, campaign.max_recommendations,
+                                              excluded=previous)
+            else:
+                recommendations = self._collection_order(eligible, candidates, campaign.max_recommendations,
+                                                         previous)
+            results.append(CampaignResult(
+                campaign,
+                recommendations=recommendations,
+                eligible_count=len(eligible),
+                complete_count=len(eligible) - len(recommendations),
+                previous={cid: previous[cid] for cid in recommendations if cid in previous},
+            ))
+        return results
+
+
+def merge_recommendations(results):
+    """Une seule recommandation par client (le metafield est unique) : la première campagne de la liste l'emporte.
+
+    Renvoie (client -> produits, client -> nom de la campagne retenue).
+    """
+    recommendations = {}
+    origins = {}
+    for result in results:
+        for customer_id, product_ids in result.recommendations.items():
+            if customer_id not in recommendations:
+                recommendations[customer_id] = product_ids
+                origins[customer_id] = result.campaign.name
+    return recommendations, origins
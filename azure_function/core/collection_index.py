@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from .bulk_export import gid_to_id
+except ImportError:
+    from bulk_export import gid_to_id
+
+# Uniquement les IDs produits, 250 par page (maximum Shopify)
+COLLECTION_PRODUCTS_QUERY = """
+query($id: ID!, $cursor: String) {
+  collection(id: $id) {
+    products(first: 250, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id }
+    }
+  }
+}
+"""
+# Coût estimé d'une page : connexion (2) + un objet par produit
+COLLECTION_PAGE_COST = 252
+
+DEFAULT_COLLECTION_TTL = 3600
+
+# product_ids : ordre de la collection (pour les recommandations) ; members : test d'appartenance O(1)
+CollectionMembership = namedtuple('CollectionMembership', ['product_ids', 'members', 'fetched_at'])
+
+
+def collection_gid(collection_id):
+    return f"gid://shopify/Collection/{collection_id}"
+
+
+def collection_steps(collection_id):
+    """Lecture paginée d'une collection, sans E/S (partagée par CollectionIndex et AsyncShopifyHelper).
+
+    Produit (requête, variables, coût) pour chaque page et reçoit le contenu 'data' de sa réponse ;
+    renvoie les IDs produits dans l'ordre de la collection (vide si elle est introuvable).
+    """
+    product_ids = []
+    cursor = None
+    while True:
+        variables = {'id': collection_gid(collection_id), 'cursor': cursor}
+        data = yield COLLECTION_PRODUCTS_QUERY, variables, COLLECTION_PAGE_COST
+        collection = data.get('collection')
+        if collection is None:
+            print(f"DEBUG: Collection {collection_id} introuvable.")
+            break
+        products = collection['products']
+        product_ids.extend(gid_to_id(node['id']) for node in products['nodes'])
+        if not products['pageInfo']['hasNextPage']:
+            break
+        cursor = products['pageInfo']['endCursor']
+    return tuple(product_ids)
+
+
+class CollectionIndex:
+    """Appartenance collection -> produits, mémorisée pour la durée d'un run.
+
+    Chaque collection est lue entièrement (pagination GraphQL, IDs seulement) une seule
+    fois, puis servie depuis la mémoire tant que son TTL n'est pas dépassé. Un verrou par
+    collection : la lecture d'une collection ne bloque pas les accès aux autres.
+    """
+
+    def __init__(self, helper, ttl=DEFAULT_COLLECTION_TTL):
+        self.helper = helper
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+        self.fetch_count = 0
+
+    def _lock_for(self, collection_id):
+        with self._lock:
+            return self._locks.setdefault(collection_id, threading.Lock())
+
+    def _fresh(self, collection_id):
+        entry = self._entries.get(collection_id)
+        if entry is not None and time.monotonic() - entry.fetched_at <= self.ttl:
+            return entry
+        return None
+
+    def _fetch(self, collection_id):
+        steps = collection_steps(collection_id)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.helper.graphql(*request))
+        except StopIteration as stop:
+            product_ids = stop.value
+        return CollectionMembership(product_ids, frozenset(product_ids), time.monotonic())
+
+    def get(self, collection_id):
+        """Renvoie le CollectionMembership de la collection, en ne l'interrogeant qu'à expiration du TTL."""
+        collection_id = int(collection_id)
+        entry = self._fresh(collection_id)
+        hit = entry is not None
+        if not hit:
+            with self._lock_for(collection_id):
+                # Un autre thread a pu lire la collection pendant l'attente du verrou
+                entry = self._fresh(collection_id)
+                hit = entry is not None
+                if not hit:
+                    entry = self._fetch(collection_id)
+                    with self._lock:
+                        self._entries[collection_id] = entry
+                        self.fetch_count += 1
+        telemetry = getattr(self.helper, 'telemetry', None)
+        if telemetry is not None:
+            telemetry.record_cache('collections', hit=hit)
+        return entry
+
+    def product_ids(self, collection_id):
+        return self.get(collection_id).product_ids
+
+    def members(self, collection_id):
+        return self.get(collection_id).members
+
+    def invalidate(self, collection_id=None):
+        """Oublie une collection (ou toutes) : elle sera relue au prochain accès."""
+        with self._lock:
+            if collection_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(int(collection_id), None)
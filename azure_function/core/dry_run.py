@@ -0,0 +1,62 @@
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime
+
+# Colonnes de l'artefact : une ligne par client, écriture prévue ou ignorée
+ARTIFACT_FIELDS = ['customer_id', 'campaign', 'action', 'metafield', 'current_value', 'planned_value',
+                   'planned_history', 'tag']
+
+ACTION_UPDATE = 'update'
+ACTION_UNCHANGED = 'unchanged'
+
+
+def default_dry_run_path(store_url, extension='jsonl'):
+    """Artefact horodaté dans CROSS_SELL_CACHE_DIR (ou le dossier temporaire)."""
+    directory = os.environ.get("CROSS_SELL_CACHE_DIR") or tempfile.gettempdir()
+    store = re.sub(r'[^a-zA-Z0-9_-]', '_', store_url or 'default')
+    return os.path.join(directory, f"cross_sell_dry_run_{store}_{datetime.now():%Y%m%d_%H%M%S}.{extension}")
+
+
+class DryRunArtifact:
+    """Fichier des écritures prévues par un run à blanc : JSONL, ou CSV si le chemin finit par .csv.
+
+    Les lignes peuvent être ajoutées depuis plusieurs threads (un lot à la fois). append : les lignes
+    complètent un artefact existant (écritures client par client) au lieu de le remplacer.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8', newline='')
+        self._csv = None
+        if path.lower().endswith('.csv'):
+            self._csv = csv.DictWriter(self._file, fieldnames=ARTIFACT_FIELDS)
+            if self._file.tell() == 0:
+                self._csv.writeheader()
+        self._lock = threading.Lock()
+        self.rows = 0
+
+    def write(self, rows):
+        with self._lock:
+            for row in rows:
+                if self._csv is not None:
+                    self._csv.writerow(row)
+                else:
+                    self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                self.rows += 1
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
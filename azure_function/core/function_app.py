@@ -1,54 +1,273 @@
 import azure.functions as func
+import azure.durable_functions as df
+import json
 import logging
 import os
-from datetime import datetime
-from shopify_helper import ShopifyHelper
+import threading
+from order_cache import OrderCache, default_cache_path
+from run_journal import RunJournal, default_journal_path
+from telemetry import configure_telemetry
+from order_webhook import (HMAC_HEADER, ORDERS_CREATE_TOPIC, SHOP_DOMAIN_HEADER, TOPIC_HEADER, handle_order_created,
+                           verify_webhook)
+from write_queue import (POISON_QUEUE_NAME, QUEUE_NAME, WriteFailedError, decode_message, message_run, message_store,
+                         process_message)
+from scanner import ScanOptions, scan_stores, store_dry_run_path
+from shared_storage import require_shared_cache_dir
+from stores import find_store, load_store_configs
+import orchestration
 
-app = func.FunctionApp()
+# Spans et métriques OpenTelemetry vers Application Insights (APPLICATIONINSIGHTS_CONNECTION_STRING)
+configure_telemetry()
+
+# WRITE_MODE=queue : le journal du run est écrit par le scanner et confirmé par la fonction de la file, sur
+# n'importe quelle instance ; un dossier propre à l'instance ferait échouer confirm, on refuse de démarrer
+_startup_options = ScanOptions.from_env()
+if _startup_options.write_mode == "queue":
+    require_shared_cache_dir("WRITE_MODE=queue")
+# ORDER_INGESTION_MODE=webhook : le cache tenu par le webhook (toute instance) est relu par le job de nuit
+if _startup_options.ingestion_mode == "webhook":
+    require_shared_cache_dir("ORDER_INGESTION_MODE=webhook")
+
+app = df.DFApp(http_auth_level=func.AuthLevel.FUNCTION)
+
+
+def durable_mode():
+    """SCANNER_ORCHESTRATION=durable : le scan est réparti en activités Durable au lieu du timer séquentiel."""
+    return os.environ.get("SCANNER_ORCHESTRATION", "serial").lower() == "durable"
 
 @app.schedule(schedule="0 0 2 * * *", arg_name="myTimer", run_on_startup=False,
               use_monitor=False) 
 def daily_cross_sell_scanner(myTimer: func.TimerRequest) -> None:
+    if durable_mode():
+        logging.info("Scanner séquentiel ignoré : SCANNER_ORCHESTRATION=durable (voir durable_cross_sell_starter).")
+        return
     logging.info('Démarrage du scanner quotidien de cross-selling.')
 
-    # Configuration
-    store_url = os.environ.get("SHOPIFY_STORE_URL")
-    access_token = os.environ.get("SHOPIFY_ACCESS_TOKEN")
-    client_id = os.environ.get("SHOPIFY_CLIENT_ID")
-    client_secret = os.environ.get("SHOPIFY_CLIENT_SECRET")
-    collection_id = os.environ.get("TARGET_COLLECTION_ID")
-    delay_start = int(os.environ.get("ORDER_DELAY_DAYS_START", 365))
-    delay_end = int(os.environ.get("ORDER_DELAY_DAYS_END", 548))
-
-    if not all([store_url, collection_id]) or not (access_token or (client_id and client_secret)):
-        logging.error("Variables d'environnement manquantes (il faut soit le token, soit le duo ID/Secret).")
+    # Boutiques : CROSS_SELL_STORES (variables préfixées par boutique), sinon les variables SHOPIFY_* ;
+    # chacune a ses identifiants, ses campagnes, son limiteur, son cache et son journal
+    stores = load_store_configs()
+    # Ingestion, classement, run à blanc, mode d'écriture et d'éligibilité : voir .env.template
+    options = ScanOptions.from_env()
+
+    # Boutiques scannées en parallèle : le run dure le temps de la plus lente, pas la somme
+    report = scan_stores(stores, options)
+    for store_report in report.stores:
+        if store_report.telemetry:
+            logging.info(f"[{store_report.store}] {store_report.telemetry}")
+    logging.info(report.summary())
+    if report.failed_stores:
+        logging.error(f"Boutique(s) en erreur : {', '.join(r.store for r in report.failed_stores)}")
+    logging.info('Scanner terminé.')
+
+
+# --- Écritures depuis la file : concurrence, reprises et file poison réglées dans host.json (extensions.queues) ---
+
+_shared_helpers = {}
+_shared_helpers_lock = threading.Lock()
+
+
+def shared_helper(store):
+    """Helper d'une boutique partagé par les messages et webhooks de ce processus (même pool HTTP, même limiteur)."""
+    with _shared_helpers_lock:
+        if store.name not in _shared_helpers:
+            _shared_helpers[store.name] = store.helper()
+        return _shared_helpers[store.name]
+
+
+@app.queue_trigger(arg_name="msg", queue_name=QUEUE_NAME, connection="AzureWebJobsStorage")
+def write_recommendations_from_queue(msg: func.QueueMessage) -> None:
+    body = msg.get_body().decode('utf-8')
+    # Message sans boutique (déposé avant le multi-boutiques) : la première boutique configurée
+    store = find_store(load_store_configs(), name=message_store(body))
+    if store is None:
+        raise ValueError(f"Message {msg.id} : boutique inconnue {message_store(body)}")
+    # Écritures confirmées au journal du run qui a déposé le message (CROSS_SELL_CACHE_DIR partagé avec le scanner) :
+    # c'est la confirmation de la dernière écriture qui clôt le run et avance le watermark d'éligibilité
+    run_id = message_run(body)
+    journal = RunJournal(default_journal_path(store.store_url)) if run_id is not None else None
+    try:
+        report = process_message(shared_helper(store), body,
+                                 on_batch=(lambda results: journal.confirm(run_id, results)) if journal else None)
+    except WriteFailedError as e:
+        # Le message redevient visible et sera retenté ; après maxDequeueCount il part dans la file poison
+        logging.warning(f"Message {msg.id} (tentative {msg.dequeue_count}) : {e}")
+        raise
+    finally:
+        if journal is not None:
+            journal.close()
+    logging.info(f"Message {msg.id} : {report.summary()}")
+
+
+@app.queue_trigger(arg_name="msg", queue_name=POISON_QUEUE_NAME, connection="AzureWebJobsStorage")
+def report_poisoned_recommendations(msg: func.QueueMessage) -> None:
+    """Messages abandonnés après toutes les tentatives : consignés.
+
+    Leurs clients n'ont jamais été confirmés au journal : le run reste ouvert, le watermark d'éligibilité
+    n'avance pas et le scan suivant les replanifie.
+    """
+    body = msg.get_body().decode('utf-8')
+    recommendations, _, origins = decode_message(body)
+    store = message_store(body) or "boutique unique"
+    for customer_id in recommendations:
+        logging.error(f"[{store}] Écriture abandonnée pour le client {customer_id} (campagne {origins.get(customer_id)}), "
+                      f"message {msg.id} : reprise au prochain scan")
+
+
+# --- Webhook orders/create : le cache et les recommandations en attente du client sont mis à jour à la commande ---
+
+# Un seul webhook à la fois écrit dans le cache SQLite de ce processus
+_webhook_lock = threading.Lock()
+
+
+@app.route(route="webhooks/orders-create", methods=["POST"], auth_level=func.AuthLevel.ANONYMOUS)
+def order_created_webhook(req: func.HttpRequest) -> func.HttpResponse:
+    body = req.get_body()
+    stores = load_store_configs()
+    # Boutique émettrice (X-Shopify-Shop-Domain) ; une seule boutique configurée : celle-ci
+    store = find_store(stores, store_url=req.headers.get(SHOP_DOMAIN_HEADER)) if len(stores) > 1 else stores[0]
+    # Authentifié par la signature Shopify (secret de l'app), pas par une clé de fonction
+    if store is None or not verify_webhook(body, req.headers.get(HMAC_HEADER), store.webhook_secret):
+        logging.warning("Webhook refusé : boutique inconnue ou signature HMAC invalide.")
+        return func.HttpResponse(status_code=401)
+    if req.headers.get(TOPIC_HEADER, ORDERS_CREATE_TOPIC) != ORDERS_CREATE_TOPIC:
+        return func.HttpResponse(status_code=200)
+
+    payload = json.loads(body)
+    campaigns = store.campaigns()
+    helper = shared_helper(store)
+    collection_products = {c.collection_id: list(helper.get_collection_products(c.collection_id)) for c in campaigns}
+    with _webhook_lock:
+        cache = OrderCache(default_cache_path(store.store_url))
+        try:
+            rows = handle_order_created(cache, payload, campaigns, collection_products)
+        finally:
+            cache.close()
+    logging.info(f"[{store.name}] Commande {payload.get('id')} : {len(rows)} recommandation(s) en attente pour le client")
+    return func.HttpResponse(status_code=200)
+
+
+# --- Aperçu async : campagnes évaluées sans écriture, requêtes indépendantes en parallèle sur la boucle de l'hôte ---
+
+@app.route(route="campaigns/preview", methods=["GET"])
+async def preview_cross_sell_campaigns(req: func.HttpRequest) -> func.HttpResponse:
+    """Clients éligibles et recommandations de chaque campagne d'une boutique (?store=nom), sans rien écrire.
+
+    Commandes lues sur ?history_days= jours (ORDER_HISTORY_DAYS par défaut), au plus PREVIEW_MAX_HISTORY_DAYS.
+    """
+    store = find_store(load_store_configs(), name=req.params.get("store"))
+    if store is None or not store.has_credentials():
+        return func.HttpResponse(f"Boutique inconnue : {req.params.get('store')}", status_code=404)
+    options = ScanOptions.from_env()
+    # Réponse HTTP synchrone : l'aperçu lit une fenêtre bornée, jamais tout l'historique de la boutique
+    max_history_days = int(os.environ.get("PREVIEW_MAX_HISTORY_DAYS", 365))
+    history_days = req.params.get("history_days", options.history_days)
+    try:
+        history_days = None if history_days is None else int(history_days)
+    except ValueError:
+        history_days = None
+    if history_days is None or not 0 <= history_days <= max_history_days:
+        return func.HttpResponse(f"history_days requis (?history_days= ou ORDER_HISTORY_DAYS), "
+                                 f"entre 0 et {max_history_days} jours pour un aperçu", status_code=400)
+    # Même limiteur que le helper synchrone de la boutique : files et webhooks de ce processus le respectent aussi
+    async with store.async_helper(throttle=shared_helper(store).throttle,
+                                  max_concurrency=int(os.environ.get("ASYNC_MAX_CONCURRENCY", 8))) as helper:
+        results = await helper.run_campaigns(store.campaigns(), history_days=history_days, ranking=options.ranking)
+    preview = [{'campaign': result.campaign.name, 'eligible': result.eligible_count,
+                'recommendations': len(result.recommendations), 'complete': result.complete_count}
+               for result in results]
+    logging.info(f"[{store.name}] Aperçu des campagnes : {preview}")
+    return func.HttpResponse(json.dumps({'store': store.name, 'campaigns': preview}), mimetype="application/json")
+
+
+# --- Orchestration Durable : tranches de dates scannées en parallèle, classement, écritures en parallèle ---
+
+def durable_settings(store, store_count=1):
+    """Entrée de l'orchestrateur d'une boutique, lue dans les mêmes variables que le scanner séquentiel."""
+    options = ScanOptions.from_env()
+    return orchestration.orchestration_settings(
+        store.campaigns(),
+        ranking=options.ranking,
+        history_days=options.history_days,
+        shard_count=int(os.environ.get("SCAN_SHARD_COUNT", orchestration.DEFAULT_SHARD_COUNT)),
+        write_chunk_size=int(os.environ.get("WRITE_CHUNK_SIZE", orchestration.DEFAULT_WRITE_CHUNK_SIZE)),
+        write_workers=options.write_workers,
+        dry_run=options.dry_run,
+        dry_run_path=store_dry_run_path(options.dry_run_path, store.name, store_count),
+        store=store.name,
+        activity_attempts=int(os.environ.get("DURABLE_ACTIVITY_ATTEMPTS", orchestration.DEFAULT_ACTIVITY_ATTEMPTS)),
+    )
+
+
+async def start_orchestrations(client, stores):
+    """Une orchestration par boutique configurée : {boutique: instance_id}."""
+    instances = {}
+    for store in stores:
+        if not store.has_credentials():
+            logging.error(f"[{store.name}] Orchestration non démarrée : identifiants manquants.")
+            continue
+        instances[store.name] = await client.start_new(orchestration.ORCHESTRATOR_NAME,
+                                                       client_input=durable_settings(store, len(stores)))
+        logging.info(f"[{store.name}] Orchestration du scanner démarrée : {instances[store.name]}")
+    return instances
+
+
+@app.schedule(schedule="0 0 2 * * *", arg_name="myTimer", run_on_startup=False,
+              use_monitor=False)
+@app.durable_client_input(client_name="client")
+async def durable_cross_sell_starter(myTimer: func.TimerRequest, client) -> None:
+    if not durable_mode():
         return
+    await start_orchestrations(client, load_store_configs())
 
-    helper = ShopifyHelper(store_url, access_token=access_token, client_id=client_id, client_secret=client_secret)
-
-    # 1. Récupérer les produits de la collection cible (ex: Louis)
-    collection_product_ids = helper.get_collection_products(collection_id)
-    logging.info(f"Produits dans la collection cible: {len(collection_product_ids)}")
-
-    # 2. Trouver les clients ayant commandé dans la plage cible et ayant acheté un produit de la collection
-    customers = helper.get_eligible_customers(days_start=delay_start, days_end=delay_end, collection_id=collection_id)
-    logging.info(f"Nombre de clients éligibles (J-{delay_start} à J-{delay_end}): {len(customers)}")
-
-    for customer in customers:
-        # 3. Calculer les produits à recommander
-        history = helper.get_customer_purchase_history(customer.id)
-        
-        # On retire les produits déjà achetés
-        remaining_products = [pid for pid in collection_product_ids if pid not in history]
-        
-        if remaining_products:
-            # On en prend 3 max
-            top_recos = remaining_products[:3]
-            
-            # 4. Injecter dans Shopify
-            helper.update_customer_recommendations(customer.id, top_recos)
-            logging.info(f"Recommandations envoyées pour le client {customer.id}: {top_recos}")
-        else:
-            logging.info(f"Client {customer.id} possède déjà toute la collection.")
 
-    logging.info('Scanner terminé.')
+@app.route(route="scanner/start", methods=["POST"])
+@app.durable_client_input(client_name="client")
+async def start_cross_sell_scanner(req: func.HttpRequest, client) -> func.HttpResponse:
+    """Lancement manuel (ou local, avec Azurite), pour toutes les boutiques ou ?store=nom.
+
+    Une seule orchestration : ses URLs de suivi ; plusieurs : {boutique: instance_id}.
+    """
+    stores = load_store_configs()
+    if req.params.get("store"):
+        store = find_store(stores, name=req.params["store"])
+        if store is None:
+            return func.HttpResponse(f"Boutique inconnue : {req.params['store']}", status_code=404)
+        stores = [store]
+    instances = await start_orchestrations(client, stores)
+    if len(instances) == 1:
+        return client.create_check_status_response(req, next(iter(instances.values())))
+    return func.HttpResponse(json.dumps(instances), status_code=202, mimetype="application/json")
+
+
+@app.orchestration_trigger(context_name="context")
+def cross_sell_orchestrator(context: df.DurableOrchestrationContext):
+    report = yield from orchestration.orchestrate(context)
+    if not context.is_replaying:
+        logging.info(f"[{report['store']}] Scanner terminé : {report['orders']} commande(s) en {report['shards']} tranche(s), "
+                     f"{report['succeeded']} client(s) mis à jour, {len(report['failed'])} échec(s)")
+    return report
+
+
+@app.activity_trigger(input_name="settings")
+def load_collection_products(settings: dict) -> dict:
+    return orchestration.load_collection_products(settings)
+
+
+@app.activity_trigger(input_name="settings")
+def scan_order_shard(settings: dict) -> dict:
+    return orchestration.scan_order_shard(settings)
+
+
+@app.activity_trigger(input_name="settings")
+def rank_campaigns(settings: dict) -> dict:
+    return orchestration.rank_campaigns(settings)
+
+
+@app.activity_trigger(input_name="settings")
+def write_recommendation_chunk(settings: dict) -> dict:
+    return orchestration.write_recommendation_chunk(settings)
+
+
+@app.activity_trigger(input_name="settings")
+def delete_run_payloads(settings: dict) -> str:
+    return orchestration.delete_run_payloads(settings)
@@ -0,0 +1,379 @@
+import json
+import logging
+import os
+import shutil
+from dataclasses import asdict
+from datetime import datetime, timedelta
+
+try:
+    from .campaigns import Campaign, CampaignEngine, merge_recommendations
+    from .dry_run import default_dry_run_path
+    from .stores import find_store, load_store_configs
+    from .throttle import ShopifyThrottle
+except ImportError:
+    from campaigns import Campaign, CampaignEngine, merge_recommendations
+    from dry_run import default_dry_run_path
+    from stores import find_store, load_store_configs
+    from throttle import ShopifyThrottle
+
+# Noms des fonctions Durable (déclarées dans function_app.py)
+ORCHESTRATOR_NAME = 'cross_sell_orchestrator'
+LOAD_COLLECTIONS_ACTIVITY = 'load_collection_products'
+SCAN_SHARD_ACTIVITY = 'scan_order_shard'
+RANK_ACTIVITY = 'rank_campaigns'
+WRITE_ACTIVITY = 'write_recommendation_chunk'
+CLEANUP_ACTIVITY = 'delete_run_payloads'
+
+DEFAULT_SHARD_COUNT = 8
+# Clients par activité d'écriture (chacune écrit ensuite par lots de 25 en parallèle)
+DEFAULT_WRITE_CHUNK_SIZE = 500
+# Conteneur Blob des charges utiles des activités (compte AzureWebJobsStorage)
+PAYLOAD_CONTAINER = 'cross-sell-orchestration'
+# Reprises d'une activité en échec (réseau, 5xx Shopify, stockage) avant d'abandonner le run
+DEFAULT_ACTIVITY_ATTEMPTS = 3
+ACTIVITY_RETRY_INTERVAL_MS = 30000
+
+
+def orchestration_settings(campaigns, ranking='affinity', history_days=None, shard_count=DEFAULT_SHARD_COUNT,
+                           write_chunk_size=DEFAULT_WRITE_CHUNK_SIZE, write_workers=4, exclude_previous=True,
+                           dry_run=False, dry_run_path=None, store=None, activity_attempts=DEFAULT_ACTIVITY_ATTEMPTS):
+    """Entrée de l'orchestrateur (JSON) : tout sauf les identifiants, relus par chaque activité dans l'environnement.
+
+    store : nom de la boutique (CROSS_SELL_STORES) ; une orchestration par boutique.
+    activity_attempts : tentatives par activité (call_activity_with_retry).
+    """
+    return {
+        'store': store,
+        'campaigns': [asdict(campaign) for campaign in campaigns],
+        'ranking': ranking,
+        'history_days': history_days,
+        'shard_count': shard_count,
+        'write_chunk_size': write_chunk_size,
+        'write_workers': write_workers,
+        'exclude_previous': exclude_previous,
+        'dry_run': dry_run,
+        'dry_run_path': dry_run_path,
+        'activity_attempts': activity_attempts,
+    }
+
+
+def helper_from_env(settings):
+    """ShopifyHelper d'une activité, pour la boutique settings['store'] (voir stores.load_store_configs).
+
+    Son limiteur ne prend que settings['rest_share'] du seau REST : les tranches scannées en même
+    temps se partagent les 40 appels de la boutique au lieu d'en supposer chacune 40.
+    """
+    store = find_store(load_store_configs(), name=settings.get('store'))
+    if store is None:
+        raise ValueError(f"Boutique inconnue : {settings.get('store')}")
+    dry_run_path = settings.get('dry_run_path')
+    if settings.get('dry_run') and not dry_run_path:
+        dry_run_path = default_dry_run_path(store.store_url)
+    return store.helper(dry_run=settings.get('dry_run', False),
+                        dry_run_path=chunk_dry_run_path(dry_run_path, settings.get('chunk_index')),
+                        throttle=ShopifyThrottle(rest_share=settings.get('rest_share', 1.0)))
+
+
+# --- Charges utiles : historiques partiels et plan d'écriture stockés hors de l'historique Durable ---
+
+class FilePayloadStore:
+    """Charges utiles dans un dossier (DURABLE_PAYLOAD_DIR : stockage monté, ou exécution locale)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, *name.split('/'))
+
+    def put(self, name, payload):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        return name
+
+    def get(self, name):
+        with open(self._path(name), encoding='utf-8') as f:
+            return json.load(f)
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def delete_run(self, run_id):
+        shutil.rmtree(self._path(run_id), ignore_errors=True)
+
+
+class BlobPayloadStore:
+    """Charges utiles dans un conteneur Blob du compte de stockage de l'application."""
+
+    def __init__(self, container_client):
+        self.container = container_client
+
+    @classmethod
+    def from_connection_string(cls, connection_string, container=PAYLOAD_CONTAINER):
+        # Import local : seul le mode durable a besoin du SDK Blob
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import ContainerClient
+
+        client = ContainerClient.from_connection_string(connection_string, container)
+        try:
+            client.create_container()
+        except ResourceExistsError:
+            pass
+        return cls(client)
+
+    def put(self, name, payload):
+        self.container.upload_blob(name, json.dumps(payload), overwrite=True)
+        return name
+
+    def get(self, name):
+        return json.loads(self.container.download_blob(name).readall())
+
+    def delete(self, name):
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            self.container.delete_blob(name)
+        except ResourceNotFoundError:
+            pass
+
+    def delete_run(self, run_id):
+        for blob in self.container.list_blobs(name_starts_with=f"{run_id}/"):
+            self.delete(blob.name)
+
+
+def payload_store_from_env(settings):
+    """DURABLE_PAYLOAD_DIR si défini, sinon le conteneur Blob du compte AzureWebJobsStorage."""
+    directory = os.environ.get("DURABLE_PAYLOAD_DIR")
+    if directory:
+        return FilePayloadStore(directory)
+    return BlobPayloadStore.from_connection_string(os.environ["AzureWebJobsStorage"])
+
+
+def payload_name(settings, kind, index):
+    """Nom d'une charge utile, propre à l'instance d'orchestration : <run_id>/partial-003.json."""
+    return f"{settings['run_id']}/{kind}-{index:03d}.json"
+
+
+def chunk_dry_run_path(path, chunk_index):
+    """Artefact propre à chaque activité d'écriture (elles tournent en parallèle) : plan-003.jsonl."""
+    if not path or chunk_index is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{chunk_index:03d}{extension}"
+
+
+def date_shards(today, shard_count, horizon_days, open_start=True):
+    """Découpe [today - horizon_days, today] en shard_count plages de jours contiguës (début, fin) YYYY-MM-DD.
+
+    open_start : la première plage n'a pas de début (None) et couvre aussi tout l'historique plus ancien.
+    """
+    today = datetime.strptime(today, '%Y-%m-%d')
+    shard_count = max(1, min(shard_count, horizon_days + 1))
+    boundaries = [today - timedelta(days=horizon_days - (horizon_days + 1) * i // shard_count)
+                  for i in range(shard_count + 1)]
+    shards = []
+    for position in range(shard_count):
+        start = boundaries[position]
+        end = boundaries[position + 1] - timedelta(days=1) if position < shard_count - 1 else today
+        shards.append([None if open_start and position == 0 else start.strftime('%Y-%m-%d'),
+                       end.strftime('%Y-%m-%d')])
+    return shards
+
+
+def _campaigns(settings):
+    return [Campaign(**entry) for entry in settings['campaigns']]
+
+
+def _engine(settings, collections):
+    today = datetime.strptime(settings['today'], '%Y-%m-%d')
+    collection_products = {int(cid): pids for cid, pids in collections.items()}
+    return CampaignEngine(_campaigns(settings), collection_products, today=today, ranking=settings['ranking'])
+
+
+# --- Activités ---
+
+def load_collection_products(settings, helper_factory=helper_from_env):
+    """Produits de chaque collection ciblée, lus une seule fois pour toutes les activités."""
+    with helper_factory(settings) as helper:
+        return {str(campaign.collection_id): list(helper.get_collection_products(campaign.collection_id))
+                for campaign in _campaigns(settings)}
+
+
+def scan_order_shard(settings, helper_factory=helper_from_env, store_factory=payload_store_from_env):
+    """Passe sur les commandes d'une plage de dates (settings['shard']).
+
+    L'état partiel du CampaignEngine (historiques de tous les clients de la plage) est stocké
+    hors de l'orchestration ; seule sa référence est renvoyée.
+    """
+    date_start, date_end = settings['shard']
+    engine = _engine(settings, settings['collections'])
+    with helper_factory(settings) as helper:
+        for order in helper.iter_orders(date_start, date_end):
+            if order.customer:
+                engine.add_order(order.customer, order.created_at, order.product_ids)
+        logging.info(f"Tranche {date_start or 'début'} - {date_end} : {helper.telemetry.format_summary()}")
+    partial = engine.export_partial()
+    return {
+        'orders': partial['orders'],
+        'partial': store_factory(settings).put(payload_name(settings, 'partial', settings['shard_index']), partial),
+    }
+
+
+def rank_campaigns(settings, helper_factory=helper_from_env, store_factory=payload_store_from_env):
+    """Fusionne les tranches, relit les recommandations passées et classe.
+
+    Le plan d'écriture est découpé en morceaux de write_chunk_size clients, stockés hors de
+    l'orchestration ; renvoie le bilan des campagnes et les références des morceaux.
+    """
+    payloads = store_factory(settings)
+    engine = _engine(settings, settings['collections'])
+    for shard in settings['partials']:
+        engine.merge_partial(payloads.get(shard['partial']))
+
+    previous = None
+    if settings.get('exclude_previous', True):
+        with helper_factory(settings) as helper:
+            previous = helper.get_previous_recommendations(engine.eligible_customer_ids())
+    results = engine.results(previous)
+
+    recommendations, origins = merge_recommendations(results)
+    history = {}
+    for result in results:
+        history.update(result.previous)
+    plan = {
+        'recommendations': [[customer_id, product_ids] for customer_id, product_ids in recommendations.items()],
+        'origins': [[customer_id, name] for customer_id, name in origins.items()],
+        'history': [[customer_id, product_ids] for customer_id, product_ids in history.items()],
+    }
+    chunks = [payloads.put(payload_name(settings, 'chunk', position), chunk)
+              for position, chunk in enumerate(split_plan(plan, settings['write_chunk_size']))]
+    # Tranches fusionnées : plus utiles une fois les morceaux du plan enregistrés
+    for shard in settings['partials']:
+        payloads.delete(shard['partial'])
+    return {
+        'orders': sum(shard['orders'] for shard in settings['partials']),
+        'campaigns': [{'name': result.campaign.name, 'eligible': result.eligible_count,
+                       'recommended': len(result.recommendations), 'complete': result.complete_count}
+                      for result in results],
+        'customers': len(recommendations),
+        'chunks': chunks,
+    }
+
+
+def write_recommendation_chunk(settings, helper_factory=helper_from_env, store_factory=payload_store_from_env):
+    """Écrit un morceau du plan (référence settings['chunk']) et renvoie son bilan.
+
+    Le morceau est supprimé une fois le lot traité, même avec des clients en échec : ils sont dans
+    le bilan et replanifiés par le run suivant. Si l'activité lève, il reste pour sa reprise.
+    """
+    payloads = store_factory(settings)
+    chunk = payloads.get(settings['chunk'])
+    recommendations = {customer_id: product_ids for customer_id, product_ids in chunk['recommendations']}
+    history = {customer_id: product_ids for customer_id, product_ids in chunk['history']}
+    origins = {customer_id: name for customer_id, name in chunk['origins']}
+    with helper_factory(settings) as helper:
+        report = helper.update_customers_recommendations(recommendations, max_workers=settings.get('write_workers', 4),
+                                                         history=history, origins=origins)
+    payloads.delete(settings['chunk'])
+    return {
+        'succeeded': len(report.succeeded) - len(report.skipped),
+        'skipped': len(report.skipped),
+        'failed': [[failure.customer_id, origins.get(failure.customer_id), failure.error] for failure in report.failed],
+        'requests': report.requests,
+        'artifact': report.artifact,
+    }
+
+
+def delete_run_payloads(settings, store_factory=payload_store_from_env):
+    """Supprime toutes les charges utiles du run (tranches, morceaux du plan) après un échec de l'orchestration."""
+    store_factory(settings).delete_run(settings['run_id'])
+    return settings['run_id']
+
+
+def split_plan(plan, chunk_size):
+    """Découpe le plan d'écriture en morceaux de chunk_size clients (une activité chacun)."""
+    origins = dict(plan['origins'])
+    history = dict(plan['history'])
+    entries = plan['recommendations']
+    return [
+        {
+            'recommendations': entries[start:start + chunk_size],
+            'origins': [[customer_id, origins[customer_id]] for customer_id, _ in entries[start:start + chunk_size]],
+            'history': [[customer_id, history[customer_id]] for customer_id, _ in entries[start:start + chunk_size]
+                        if customer_id in history],
+        }
+        for start in range(0, len(entries), chunk_size)
+    ]
+
+
+# --- Orchestrateur ---
+
+def activity_retry_options(settings):
+    """Reprises Durable des activités : settings['activity_attempts'] tentatives, espacées de 30 s."""
+    # Import local : seul l'orchestrateur a besoin du SDK Durable
+    import azure.durable_functions as df
+    return df.RetryOptions(ACTIVITY_RETRY_INTERVAL_MS, settings.get('activity_attempts', DEFAULT_ACTIVITY_ATTEMPTS))
+
+
+def orchestrate(context):
+    """Orchestrateur Durable : collections, tranches de dates scannées en parallèle, classement, écritures en parallèle.
+
+    Déterministe (rejoué par Durable) : la date du jour vient de context.current_utc_datetime.
+    Historiques partiels et plan d'écriture ne transitent que par référence (payload_store_from_env) :
+    l'historique de l'orchestration reste petit quelle que soit la taille de la boutique.
+    Chaque activité est reprise (call_activity_with_retry) ; si l'une échoue malgré tout, les charges
+    utiles du run sont supprimées avant de propager l'erreur. Renvoie le bilan combiné du run.
+    """
+    settings = dict(context.get_input())
+    settings['today'] = settings.get('today') or context.current_utc_datetime.strftime('%Y-%m-%d')
+    settings['run_id'] = context.instance_id
+    retry = activity_retry_options(settings)
+    try:
+        report = yield from _run(context, settings, retry)
+    except Exception:
+        yield context.call_activity_with_retry(CLEANUP_ACTIVITY, retry, settings)
+        raise
+    return report
+
+
+def _run(context, settings, retry):
+    collections = yield context.call_activity_with_retry(LOAD_COLLECTIONS_ACTIVITY, retry, settings)
+    settings['collections'] = collections
+
+    # Fenêtre lue : ORDER_HISTORY_DAYS, sinon jusqu'à la plus ancienne fenêtre de campagne, plus tout l'historique
+    history_days = settings.get('history_days')
+    horizon = history_days or max(campaign['delay_end'] for campaign in settings['campaigns'])
+    shards = date_shards(settings['today'], settings['shard_count'], horizon, open_start=history_days is None)
+    # Les tranches tournent en même temps sur la même boutique : chacune n'a qu'une part du seau REST
+    rest_share = 1 / len(shards)
+    partials = yield context.task_all([
+        context.call_activity_with_retry(SCAN_SHARD_ACTIVITY, retry,
+                                         {**settings, 'shard': shard, 'shard_index': position,
+                                          'rest_share': rest_share})
+        for position, shard in enumerate(shards)
+    ])
+
+    plan = yield context.call_activity_with_retry(RANK_ACTIVITY, retry, {**settings, 'partials': partials})
+    chunks = plan['chunks']
+    reports = yield context.task_all([
+        context.call_activity_with_retry(WRITE_ACTIVITY, retry,
+                                         {**settings, 'chunk': chunk, 'chunk_index': position})
+        for position, chunk in enumerate(chunks)
+    ])
+
+    return {
+        'store': settings.get('store'),
+        'today': settings['today'],
+        'shards': len(shards),
+        'orders': plan['orders'],
+        'campaigns': plan['campaigns'],
+        'write_chunks': len(chunks),
+        'succeeded': sum(report['succeeded'] for report in reports),
+        'skipped': sum(report['skipped'] for report in reports),
+        'failed': [failure for report in reports for failure in report['failed']],
+        'requests': sum(report['requests'] for report in reports),
+        'artifacts': [report['artifact'] for report in reports if report['artifact']],
+    }
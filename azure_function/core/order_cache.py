@@ -0,0 +1,271 @@
+import json
+import os
+import re
+import tempfile
+
+try:
+    from .purchase_index import PurchaseIndex, CustomerInfo
+    from .shared_storage import connect
+except ImportError:
+    from purchase_index import PurchaseIndex, CustomerInfo
+    from shared_storage import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    customer_id INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at);
+CREATE INDEX IF NOT EXISTS orders_customer ON orders (customer_id);
+
+CREATE TABLE IF NOT EXISTS line_items (
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    PRIMARY KEY (order_id, product_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS line_items_product ON line_items (product_id);
+
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT
+);
+
+-- Recommandations en attente, tenues à jour à chaque commande (webhook orders/create) :
+-- une ligne par commande déclenchant une campagne, due entre due_from et due_until
+CREATE TABLE IF NOT EXISTS due_recommendations (
+    customer_id INTEGER NOT NULL,
+    campaign TEXT NOT NULL,
+    due_from TEXT NOT NULL,
+    due_until TEXT NOT NULL,
+    product_ids TEXT NOT NULL,
+    PRIMARY KEY (customer_id, campaign, due_from)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS due_recommendations_window ON due_recommendations (due_from, due_until);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def default_cache_path(store_url):
+    """Chemin du cache : CROSS_SELL_CACHE_DIR (stockage monté) ou le dossier temporaire de la fonction."""
+    directory = os.environ.get("CROSS_SELL_CACHE_DIR") or tempfile.gettempdir()
+    store = re.sub(r'[^a-zA-Z0-9_-]', '_', store_url or 'default')
+    return os.path.join(directory, f"cross_sell_{store}.sqlite")
+
+
+class OrderCache:
+    """Copie locale (SQLite) des commandes, lignes de commande et clients d'une boutique.
+
+    Chaque synchronisation ne récupère que les commandes modifiées depuis le dernier
+    updated_at connu (watermark) : le volume d'appels dépend de l'activité du jour,
+    pas de la taille de l'historique.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # WAL sur disque local, DELETE sur un partage Azure Files (voir shared_storage.connect)
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # --- état de synchronisation ---
+
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+
+    @property
+    def watermark(self):
+        """updated_at de la commande la plus récemment modifiée déjà en cache."""
+        return self.get_state('orders_updated_at')
+
+    # --- écriture ---
+
+    def upsert_orders(self, orders):
+        """Insère ou remplace un lot de commandes ; renvoie le plus grand updated_at du lot.
+
+        Chaque commande est un tuple (order_id, customer, created_at, updated_at, product_ids)
+        où customer est un CustomerInfo ou None.
+        """
+        max_updated_at = None
+        with self.conn:
+            for order_id, customer, created_at, updated_at, product_ids in orders:
+                customer_id = customer.id if customer else None
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO orders (id, customer_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (order_id, customer_id, created_at, updated_at)
+                )
+                self.conn.execute("DELETE FROM line_items WHERE order_id = ?", (order_id,))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO line_items (order_id, product_id) VALUES (?, ?)",
+                    [(order_id, pid) for pid in product_ids if pid is not None]
+                )
+                if customer:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO customers (id, first_name, last_name, email) VALUES (?, ?, ?, ?)",
+                        (customer.id, customer.first_name, customer.last_name, customer.email)
+                    )
+                if updated_at and (max_updated_at is None or updated_at > max_updated_at):
+                    max_updated_at = updated_at
+        return max_updated_at
+
+    def sync(self, fetch_orders, batch_size=500):
+        """Synchronise le cache à partir de fetch_orders(updated_at_min) et avance le watermark.
+
+        fetch_orders doit renvoyer un itérable de tuples au format de upsert_orders.
+        Les commandes sont écrites lot par lot, mais le watermark n'avance qu'une fois la source
+        entièrement lue : l'API renvoie les commandes sans ordre garanti sur updated_at, et une
+        synchronisation interrompue reprend donc depuis l'ancien watermark (réécritures idempotentes).
+        """
+        watermark = self.watermark
+        max_updated_at = None
+        synced = 0
+        batch = []
+        for order in fetch_orders(watermark):
+            batch.append(order)
+            if len(batch) >= batch_size:
+                max_updated_at = self._commit_batch(batch, max_updated_at)
+                synced += len(batch)
+                batch = []
+        if batch:
+            max_updated_at = self._commit_batch(batch, max_updated_at)
+            synced += len(batch)
+        if max_updated_at and (watermark is None or max_updated_at > watermark):
+            self.set_state('orders_updated_at', max_updated_at)
+        return synced
+
+    def _commit_batch(self, batch, max_updated_at):
+        batch_max = self.upsert_orders(batch)
+        if batch_max and (max_updated_at is None or batch_max > max_updated_at):
+            return batch_max
+        return max_updated_at
+
+    def replace_due(self, customer_id, rows):
+        """Remplace les recommandations en attente d'un client : rows = [(campagne, due_from, due_until, produits)]."""
+        with self.conn:
+            self.conn.execute("DELETE FROM due_recommendations WHERE customer_id = ?", (customer_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO due_recommendations (customer_id, campaign, due_from, due_until, product_ids) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(customer_id, campaign, due_from, due_until, json.dumps(list(product_ids)))
+                 for campaign, due_from, due_until, product_ids in rows]
+            )
+
+    # --- lecture ---
+
+    def due_recommendations(self, today, since=None):
+        """Recommandations dues ce jour (YYYY-MM-DD) : {campagne: {client: produits}}.
+
+        since : {campagne: dernier jour traité} ; seuls les clients devenus dus après ce jour sont renvoyés.
+        """
+        since = since or {}
+        due = {}
+        rows = self.conn.execute(
+            "SELECT campaign, customer_id, product_ids, due_from FROM due_recommendations "
+            "WHERE due_from <= ? AND due_until >= ? ORDER BY due_from, customer_id",
+            (today, today)
+        )
+        for campaign, customer_id, product_ids, due_from in rows:
+            if due_from <= since.get(campaign, ''):
+                continue
+            pending = due.setdefault(campaign, {})
+            if customer_id not in pending:
+                pending[customer_id] = json.loads(product_ids)
+        return due
+
+    def customer_orders(self, customer_id):
+        """Commandes d'un client : [(created_at, [produits])], de la plus ancienne à la plus récente."""
+        orders = {}
+        rows = self.conn.execute(
+            "SELECT o.id, o.created_at, li.product_id FROM orders o LEFT JOIN line_items li ON li.order_id = o.id "
+            "WHERE o.customer_id = ? ORDER BY o.created_at, o.id",
+            (customer_id,)
+        )
+        for order_id, created_at, product_id in rows:
+            products = orders.setdefault(order_id, (created_at, []))[1]
+            if product_id is not None:
+                products.append(product_id)
+        return list(orders.values())
+
+    def customers_updated_since(self, updated_at=None):
+        """Clients dont une commande a été modifiée après updated_at (tous si None)."""
+        query = "SELECT DISTINCT customer_id FROM orders WHERE customer_id IS NOT NULL"
+        params = ()
+        if updated_at:
+            query += " AND updated_at > ?"
+            params = (updated_at,)
+        return [row[0] for row in self.conn.execute(query, params)]
+
+
+    def get_customer_purchase_history(self, customer_id):
+        rows = self.conn.execute(
+            "SELECT DISTINCT li.product_id FROM line_items li JOIN orders o ON o.id = li.order_id "
+            "WHERE o.customer_id = ?",
+            (customer_id,)
+        )
+        return {row[0] for row in rows}
+
+    def get_eligible_customers(self, date_start, date_end, target_product_ids=None):
+        """Clients ayant commandé entre date_start et date_end (YYYY-MM-DD), éventuellement dans une collection."""
+        query = (
+            "SELECT c.id, c.first_name, c.last_name, c.email, MIN(o.created_at) AS first_order "
+            "FROM orders o JOIN customers c ON c.id = o.customer_id "
+        )
+        params = [date_start, date_end]
+        if target_product_ids:
+            target_product_ids = list(target_product_ids)
+            query += (
+                "JOIN line_items li ON li.order_id = o.id "
+                f"AND li.product_id IN ({','.join('?' * len(target_product_ids))}) "
+            )
+            params = target_product_ids + params
+        query += "WHERE o.created_at >= ? AND substr(o.created_at, 1, 10) <= ? GROUP BY c.id ORDER BY first_order"
+        return [CustomerInfo(*row[:4]) for row in self.conn.execute(query, params)]
+
+    def iter_purchases(self, history_start=None):
+        """Itère sur les commandes client du cache : (CustomerInfo, created_at, product_ids)."""
+        query = (
+            "SELECT o.id, o.customer_id, o.created_at, li.product_id, c.first_name, c.last_name, c.email "
+            "FROM orders o JOIN line_items li ON li.order_id = o.id "
+            "LEFT JOIN customers c ON c.id = o.customer_id "
+            "WHERE o.customer_id IS NOT NULL "
+        )
+        params = []
+        if history_start:
+            query += "AND o.created_at >= ? "
+            params.append(history_start)
+        query += "ORDER BY o.created_at, o.id"
+
+        current = None
+        for order_id, customer_id, created_at, product_id, first_name, last_name, email in self.conn.execute(query, params):
+            if current is None or current[0] != order_id:
+                if current is not None:
+                    yield current[1:]
+                current = (order_id, CustomerInfo(customer_id, first_name, last_name, email), created_at, [])
+            current[3].append(product_id)
+        if current is not None:
+            yield current[1:]
+
+    def build_purchase_index(self, index=None, history_start=None):
+        """Alimente un PurchaseIndex (historiques + éligibilité) à partir du cache, sans aucun appel API."""
+        index = index if index is not None else PurchaseIndex()
+        for customer, created_at, product_ids in self.iter_purchases(history_start):
+            index.add_order(customer.id, created_at, product_ids, customer=customer)
+        return index.freeze()
@@ -0,0 +1,219 @@
+import os
+import re
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+
+try:
+    from .purchase_index import CustomerInfo, PurchaseIndex
+except ImportError:
+    from purchase_index import CustomerInfo, PurchaseIndex
+
+# Lignes de commande par record batch : borne la mémoire de l'écriture et de chaque calcul vectorisé
+DEFAULT_BATCH_SIZE = 256 * 1024
+
+LINES_SCHEMA = pa.schema([
+    # Numéro de la commande dans l'instantané (ordre de lecture)
+    ('order', pa.int64()),
+    ('customer_id', pa.int64()),
+    # Jour de la commande (created_at[:10], heure locale de la boutique) en jours depuis 1970-01-01
+    ('day', pa.int32()),
+    ('product_id', pa.int64()),
+])
+CUSTOMERS_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('first_name', pa.string()),
+    ('last_name', pa.string()),
+    ('email', pa.string()),
+])
+
+
+def default_snapshot_path(store_url):
+    """Chemin de l'instantané : CROSS_SELL_CACHE_DIR (stockage monté) ou le dossier temporaire de la fonction."""
+    directory = os.environ.get("CROSS_SELL_CACHE_DIR") or tempfile.gettempdir()
+    store = re.sub(r'[^a-zA-Z0-9_-]', '_', store_url or 'default')
+    return os.path.join(directory, f"cross_sell_orders_{store}.arrow")
+
+
+def customers_path(path):
+    """Fichier des clients à côté de celui des lignes : orders.arrow -> orders.customers.arrow."""
+    root, extension = os.path.splitext(path)
+    return f"{root}.customers{extension or '.arrow'}"
+
+
+def day_number(day):
+    """YYYY-MM-DD -> jours depuis 1970-01-01 (None : pas de borne)."""
+    if day is None:
+        return None
+    return int(np.datetime64(day[:10], 'D').astype(np.int64))
+
+
+class OrderSnapshotWriter:
+    """Écrit les commandes (client, created_at, produits) en Arrow IPC, par record batches.
+
+    Une ligne par ligne de commande, colonnes entières seulement : le fichier se relit par
+    memory map, sans copie ni parsing. Les clients (nom, email) vont dans un second fichier.
+    Les fichiers ne remplacent l'instantané précédent qu'à close().
+    Une commande sans created_at n'a pas de jour à écrire : elle est ignorée et comptée (undated_count).
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.order_count = 0
+        self.undated_count = 0
+        self._customers = {}
+        self._columns = ([], [], [], [])
+        self._tmp_path = f"{path}.tmp"
+        self._sink = pa.OSFile(self._tmp_path, 'wb')
+        self._writer = pa.ipc.new_file(self._sink, LINES_SCHEMA)
+
+    def add(self, customer, created_at, product_ids):
+        if customer is None:
+            return
+        if not created_at:
+            # Jour vide -> NaT à l'écriture : la commande disparaîtrait sans bruit des fenêtres
+            self.undated_count += 1
+            return
+        orders, customer_ids, days, products = self._columns
+        day = created_at[:10]
+        for product_id in product_ids:
+            if product_id is None:
+                continue
+            orders.append(self.order_count)
+            customer_ids.append(customer.id)
+            days.append(day)
+            products.append(product_id)
+        self._customers.setdefault(customer.id, customer)
+        self.order_count += 1
+        if len(orders) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        orders, customer_ids, days, products = self._columns
+        if not orders:
+            return
+        self._writer.write_batch(pa.record_batch([
+            pa.array(orders, pa.int64()),
+            pa.array(customer_ids, pa.int64()),
+            pa.array(np.array(days, dtype='datetime64[D]').astype(np.int32)),
+            pa.array(products, pa.int64()),
+        ], schema=LINES_SCHEMA))
+        self._columns = ([], [], [], [])
+
+    def close(self):
+        """Termine l'écriture et remplace l'instantané ; renvoie l'OrderSnapshot ouvert."""
+        self._flush()
+        self._writer.close()
+        self._sink.close()
+        if self.undated_count:
+            print(f"DEBUG: {self.undated_count} commande(s) sans created_at ignorée(s) dans l'instantané")
+
+        # Clients triés par id : recherche vectorisée (searchsorted) à la lecture
+        customers = sorted(self._customers.values(), key=lambda customer: customer.id)
+        table = pa.table([
+            pa.array([c.id for c in customers], pa.int64()),
+            pa.array([c.first_name for c in customers], pa.string()),
+            pa.array([c.last_name for c in customers], pa.string()),
+            pa.array([c.email for c in customers], pa.string()),
+        ], schema=CUSTOMERS_SCHEMA.with_metadata({'orders': str(self.order_count)}))
+        customers_tmp = f"{customers_path(self.path)}.tmp"
+        with pa.OSFile(customers_tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(self._tmp_path, self.path)
+        os.replace(customers_tmp, customers_path(self.path))
+        return OrderSnapshot(self.path)
+
+
+class OrderSnapshot:
+    """Instantané colonne (Arrow IPC, memory-mappé) des commandes d'une boutique.
+
+    Fenêtre de dates, appartenance à une collection (isin) et dédoublonnage par client sont
+    évalués en NumPy, record batch par record batch, directement sur les pages du fichier.
+    Écrit par le scanner (ORDER_SNAPSHOT=true) et relu par les scripts de diagnostic.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lines_source = pa.memory_map(path)
+        self.lines = pa.ipc.open_file(self._lines_source).read_all()
+        self._customers_source = pa.memory_map(customers_path(path))
+        self.customers = pa.ipc.open_file(self._customers_source).read_all()
+        self.order_count = int((self.customers.schema.metadata or {}).get(b'orders', 0))
+        self._customer_ids = self.customers.column('id').to_numpy()
+
+    @classmethod
+    def write(cls, path, purchases, batch_size=DEFAULT_BATCH_SIZE):
+        """Écrit un itérable de (client, created_at, produits) et renvoie l'instantané ouvert."""
+        writer = OrderSnapshotWriter(path, batch_size=batch_size)
+        for customer, created_at, product_ids in purchases:
+            writer.add(customer, created_at, product_ids)
+        return writer.close()
+
+    def close(self):
+        self.lines = self.customers = self._customer_ids = None
+        self._lines_source.close()
+        self._customers_source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.lines.num_rows
+
+    def _batches(self, *columns):
+        """Colonnes NumPy (sans copie) de chaque record batch."""
+        for batch in self.lines.to_batches():
+            yield [batch.column(name).to_numpy() for name in columns]
+
+    def eligible_customer_ids(self, date_start=None, date_end=None, product_ids=None):
+        """Clients ayant commandé entre date_start et date_end (YYYY-MM-DD, bornes incluses), un produit
+        de product_ids dans la commande si fourni ; dans l'ordre de leur première commande éligible."""
+        start, end = day_number(date_start), day_number(date_end)
+        targets = np.asarray(list(product_ids), dtype=np.int64) if product_ids is not None else None
+        selected = []
+        for customer_ids, days, products in self._batches('customer_id', 'day', 'product_id'):
+            mask = np.ones(len(days), dtype=bool)
+            if start is not None:
+                mask &= days >= start
+            if end is not None:
+                mask &= days <= end
+            if targets is not None:
+                mask &= np.isin(products, targets)
+            selected.append(customer_ids[mask])
+        if not selected:
+            return np.empty(0, dtype=np.int64)
+        customer_ids = np.concatenate(selected)
+        unique, first = np.unique(customer_ids, return_index=True)
+        return unique[np.argsort(first, kind='stable')]
+
+    def customer_infos(self, customer_ids):
+        """CustomerInfo des clients demandés, dans le même ordre."""
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        if not len(customer_ids):
+            return []
+        rows = self.customers.take(pa.array(np.searchsorted(self._customer_ids, customer_ids)))
+        return [CustomerInfo(*row) for row in zip(*(rows.column(name).to_pylist() for name in CUSTOMERS_SCHEMA.names))]
+
+    def eligible_customers(self, date_start=None, date_end=None, product_ids=None):
+        """Comme eligible_customer_ids, en CustomerInfo (même résultat que ShopifyHelper.get_eligible_customers)."""
+        return self.customer_infos(self.eligible_customer_ids(date_start, date_end, product_ids))
+
+    def purchase_history(self, customer_id):
+        """Produits achetés par un client (toutes ses commandes de l'instantané)."""
+        history = [products[customer_ids == customer_id]
+                   for customer_ids, products in self._batches('customer_id', 'product_id')]
+        return set(np.unique(np.concatenate(history)).tolist()) if history else set()
+
+    def purchase_index(self):
+        """PurchaseIndex figé de tous les historiques, construit en bloc (voir PurchaseIndex.from_arrays)."""
+        pairs = [np.unique(np.stack([customer_ids, products]), axis=1)
+                 for customer_ids, products in self._batches('customer_id', 'product_id')]
+        if not pairs:
+            return PurchaseIndex().freeze()
+        pairs = np.concatenate(pairs, axis=1)
+        return PurchaseIndex.from_arrays(pairs[0], pairs[1], order_count=self.order_count)
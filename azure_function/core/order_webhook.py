@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+
+try:
+    from .campaigns import CampaignResult
+    from .ranking import CoPurchaseRanker, RANKING_AFFINITY
+    from .records import order_record
+except ImportError:
+    from campaigns import CampaignResult
+    from ranking import CoPurchaseRanker, RANKING_AFFINITY
+    from records import order_record
+
+HMAC_HEADER = 'X-Shopify-Hmac-Sha256'
+TOPIC_HEADER = 'X-Shopify-Topic'
+SHOP_DOMAIN_HEADER = 'X-Shopify-Shop-Domain'
+ORDERS_CREATE_TOPIC = 'orders/create'
+
+
+def verify_webhook(body, hmac_header, secret):
+    """Vérifie la signature Shopify d'un webhook : base64(HMAC-SHA256(corps brut, secret de l'app))."""
+    if not hmac_header or not secret:
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('ascii'), hmac_header.strip())
+
+
+def _day(created_at, days):
+    return (datetime.strptime(created_at[:10], '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def refresh_customer(cache, customer_id, campaigns, collection_products):
+    """Recalcule les recommandations en attente d'un client à partir de ses commandes en cache.
+
+    Chaque commande contenant un produit d'une campagne rend le client dû pour cette campagne
+    de J+delay_start à J+delay_end ; les produits en attente sont ceux de la collection qu'il
+    ne possède pas encore, dans l'ordre de la collection. Renvoie les lignes enregistrées.
+    """
+    orders = cache.customer_orders(customer_id)
+    owned = {product_id for _, product_ids in orders for product_id in product_ids}
+    rows = []
+    for campaign in campaigns:
+        products = collection_products.get(campaign.collection_id, [])
+        members = set(products)
+        remaining = [product_id for product_id in products if product_id not in owned]
+        for created_at, product_ids in orders:
+            if members.intersection(product_ids):
+                rows.append((campaign.name, _day(created_at, campaign.delay_start), _day(created_at, campaign.delay_end),
+                             remaining))
+    cache.replace_due(customer_id, rows)
+    return rows
+
+
+def handle_order_created(cache, payload, campaigns, collection_products):
+    """Webhook orders/create : la commande entre dans le cache et les recommandations du client sont recalculées.
+
+    Renvoie les lignes en attente du client (vide pour une commande sans client).
+    """
+    record = order_record(payload)
+    cache.upsert_orders([record])
+    customer = record[1]
+    if customer is None:
+        return []
+    return refresh_customer(cache, customer.id, campaigns, collection_products)
+
+
+def refresh_updated_customers(cache, since, campaigns, collection_products):
+    """Rattrapage des webhooks manqués : recalcule les clients dont une commande a changé après since."""
+    customer_ids = cache.customers_updated_since(since)
+    for customer_id in customer_ids:
+        refresh_customer(cache, customer_id, campaigns, collection_products)
+    return len(customer_ids)
+
+
+def due_campaign_results(cache, campaigns, collection_products, today, ranking=RANKING_AFFINITY, previous=None,
+                         since=None):
+    """CampaignResult de chaque campagne pour les seuls clients dus ce jour, sans relire les commandes.
+
+    'collection' : produits en attente tels que calculés à la commande ; 'affinity' : ces clients
+    seulement sont reclassés par co-achats, sur l'historique du cache.
+    since : {campagne: dernier jour traité} ; les clients déjà dus à cette date sont ignorés.
+    """
+    previous = previous or {}
+    due = cache.due_recommendations(today, since=since)
+    ranker = CoPurchaseRanker(cache.build_purchase_index()) if ranking == RANKING_AFFINITY and due else None
+    results = []
+    for campaign in campaigns:
+        pending = due.get(campaign.name, {})
+        if ranker is not None:
+            recommendations = ranker.rank(list(pending), collection_products.get(campaign.collection_id, []),
+                                          campaign.max_recommendations, excluded=previous)
+        else:
+            recommendations = {}
+            for customer_id, product_ids in pending.items():
+                excluded = set(previous.get(customer_id, ()))
+                remaining = [product_id for product_id in product_ids if product_id not in excluded]
+                if remaining:
+                    recommendations[customer_id] = remaining[:campaign.max_recommendations]
+        results.append(CampaignResult(
+            campaign,
+            recommendations=recommendations,
+            eligible_count=len(pending),
+            complete_count=len(pending) - len(recommendations),
+            previous={cid: previous[cid] for cid in recommendations if cid in previous},
+        ))
+    return results
+
+
+def due_customer_ids(cache, today, since=None):
+    customer_ids = set()
+    for pending in cache.due_recommendations(today, since=since).values():
+        customer_ids.update(pending)
+    return customer_ids
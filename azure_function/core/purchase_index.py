@@ -0,0 +1,144 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+import numpy as np
+
+# Informations minimales gardées pour un client éligible
+CustomerInfo = namedtuple('CustomerInfo', ['id', 'first_name', 'last_name', 'email'])
+
+
+class PurchaseIndex:
+    """Index client -> produits achetés, construit en une seule passe sur les commandes.
+
+    Les identifiants produits (entiers 64 bits) sont remplacés par un numéro dense et
+    chaque historique est stocké dans un array('I') trié, bien plus compact qu'un set.
+    L'éligibilité (commande dans la fenêtre contenant un produit cible) est calculée
+    pendant la même passe.
+    """
+
+    def __init__(self, window_start=None, window_end=None, target_product_ids=None):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.target_product_ids = frozenset(target_product_ids) if target_product_ids else None
+        self._product_ids = []
+        self._product_slots = {}
+        self._histories = {}
+        self._eligible = {}
+        self._frozen = False
+        self.order_count = 0
+
+    @classmethod
+    def from_arrays(cls, customer_ids, product_ids, order_count=0):
+        """Index figé construit en bloc à partir de lignes (client, produit) en tableaux NumPy.
+
+        Utilisé pour les instantanés colonne (OrderSnapshot) : tri et dédoublonnage vectorisés,
+        une seule boucle Python par client pour créer son array('I').
+        """
+        index = cls()
+        index.order_count = order_count
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        products, slots = np.unique(np.asarray(product_ids, dtype=np.int64), return_inverse=True)
+        index._product_ids = products.tolist()
+        index._product_slots = {product_id: slot for slot, product_id in enumerate(index._product_ids)}
+
+        order = np.lexsort((slots, customer_ids))
+        customer_ids, slots = customer_ids[order], slots[order].astype(np.uint32)
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (customer_ids[1:] != customer_ids[:-1]) | (slots[1:] != slots[:-1])
+        customer_ids, slots = customer_ids[keep], slots[keep]
+
+        starts = np.flatnonzero(np.r_[True, customer_ids[1:] != customer_ids[:-1]]) if len(customer_ids) else []
+        for customer_id, history in zip(customer_ids[starts].tolist(), np.split(slots, starts[1:])):
+            index._histories[customer_id] = array('I', history.tobytes())
+        index._frozen = True
+        return index
+
+    def _slot(self, product_id):
+        slot = self._product_slots.get(product_id)
+        if slot is None:
+            slot = len(self._product_ids)
+            self._product_slots[product_id] = slot
+            self._product_ids.append(product_id)
+        return slot
+
+    def _in_window(self, created_at):
+        if self.window_start is None and self.window_end is None:
+            return True
+        day = (created_at or '')[:10]
+        if self.window_start is not None and day < self.window_start:
+            return False
+        if self.window_end is not None and day > self.window_end:
+            return False
+        return True
+
+    def add_order(self, customer_id, created_at, product_ids, customer=None):
+        """Ajoute une commande à l'index (les commandes sans client sont ignorées)."""
+        if customer_id is None:
+            return
+        if self._frozen:
+            raise RuntimeError("PurchaseIndex déjà figé")
+        self.order_count += 1
+
+        product_ids = [pid for pid in product_ids if pid is not None]
+        history = self._histories.get(customer_id)
+        if history is None:
+            history = self._histories[customer_id] = array('I')
+        history.extend(self._slot(pid) for pid in product_ids)
+
+        if customer_id in self._eligible or not self._in_window(created_at):
+            return
+        if self.target_product_ids and not self.target_product_ids.intersection(product_ids):
+            return
+        self._eligible[customer_id] = customer or CustomerInfo(customer_id, None, None, None)
+
+    def freeze(self):
+        """Trie et dédoublonne les historiques ; l'index devient en lecture seule."""
+        if not self._frozen:
+            for customer_id, history in self._histories.items():
+                self._histories[customer_id] = array('I', sorted(set(history)))
+            self._frozen = True
+        return self
+
+    def history(self, customer_id):
+        """Ensemble des produits achetés par le client (vide s'il est inconnu)."""
+        history = self._histories.get(customer_id)
+        if history is None:
+            return set()
+        return {self._product_ids[slot] for slot in history}
+
+    def has_purchased(self, customer_id, product_id):
+        slot = self._product_slots.get(product_id)
+        history = self._histories.get(customer_id)
+        if slot is None or history is None:
+            return False
+        if not self._frozen:
+            return slot in history
+        position = bisect_left(history, slot)
+        return position < len(history) and history[position] == slot
+
+    @property
+    def product_ids(self):
+        """IDs produits indexés, dans l'ordre de leur numéro dense (slot)."""
+        return self._product_ids
+
+    def product_slot(self, product_id):
+        """Numéro dense d'un produit (None s'il n'a jamais été acheté)."""
+        return self._product_slots.get(product_id)
+
+    def iter_histories(self):
+        """Itère sur (client, array('I') des slots achetés) ; triés et dédoublonnés une fois figé."""
+        return iter(self._histories.items())
+
+    def eligible_customers(self):
+        """Clients éligibles, dans l'ordre de leur première commande éligible rencontrée."""
+        return list(self._eligible.values())
+
+    def customer_ids(self):
+        return self._histories.keys()
+
+    def __contains__(self, customer_id):
+        return customer_id in self._histories
+
+    def __len__(self):
+        return len(self._histories)
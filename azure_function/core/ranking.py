@@ -0,0 +1,106 @@
+import numpy as np
+from scipy import sparse
+
+RANKING_AFFINITY = 'affinity'
+RANKING_COLLECTION = 'collection'
+RANKING_MODES = (RANKING_AFFINITY, RANKING_COLLECTION)
+
+# Nombre de clients scorés par produit matriciel (borne la mémoire de la matrice dense de scores)
+DEFAULT_CHUNK_SIZE = 4096
+
+
+class CoPurchaseRanker:
+    """Classement des produits manquants par affinité d'achat (co-occurrence produit-produit).
+
+    À partir d'un PurchaseIndex figé, on construit la matrice creuse clients x produits X
+    (1 = produit acheté) puis C = X^T X : C[i, j] = nombre de clients ayant acheté i et j.
+    Le score d'un produit candidat pour un client est la somme de ses co-occurrences avec
+    les produits que le client possède déjà, calculée pour tous les clients d'un coup
+    (X[clients] @ C[:, candidats]). Égalités départagées par la popularité du produit,
+    puis par l'ordre de la collection.
+    """
+
+    def __init__(self, index, chunk_size=DEFAULT_CHUNK_SIZE):
+        index.freeze()
+        self.index = index
+        self.chunk_size = chunk_size
+
+        self._rows = {}
+        indptr = [0]
+        histories = []
+        for row, (customer_id, history) in enumerate(index.iter_histories()):
+            self._rows[customer_id] = row
+            histories.append(np.frombuffer(history, dtype=np.uint32) if len(history) else np.empty(0, np.uint32))
+            indptr.append(indptr[-1] + len(history))
+
+        indices = np.concatenate(histories) if histories else np.empty(0, np.uint32)
+        self.purchases = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int64), indices, np.array(indptr, dtype=np.int64)),
+            shape=(len(self._rows), len(index.product_ids))
+        )
+        cooccurrence = (self.purchases.T @ self.purchases).tocsc()
+        # La diagonale est le nombre d'acheteurs du produit : c'est sa popularité, pas une affinité
+        self.popularity = cooccurrence.diagonal().astype(np.int64)
+        cooccurrence.setdiag(0)
+        cooccurrence.eliminate_zeros()
+        self.cooccurrence = cooccurrence
+
+    def rank(self, customer_ids, candidate_ids, limit=3, excluded=None):
+        """Renvoie {client: [jusqu'à limit produits non possédés, du meilleur au moins bon]}.
+
+        candidate_ids est la liste ordonnée des produits de la collection ; excluded
+        ({client: produits}) retire en plus des candidats propres à chaque client (ex: déjà
+        recommandés). Les clients sans candidat restant sont absents du résultat.
+        """
+        candidate_ids = list(candidate_ids)
+        if not candidate_ids or limit <= 0:
+            return {}
+        candidates = np.array(candidate_ids, dtype=np.int64)
+        positions = {pid: position for position, pid in enumerate(candidate_ids)}
+        excluded = excluded or {}
+        slots = [self.index.product_slot(pid) for pid in candidate_ids]
+        known = np.array([slot is not None for slot in slots])
+        known_slots = np.array([slot for slot in slots if slot is not None], dtype=np.int64)
+
+        cooccurrence = self.cooccurrence[:, known_slots]
+        popularity = np.zeros(len(candidate_ids), dtype=np.int64)
+        popularity[known] = self.popularity[known_slots]
+        # Clé unique par candidat : affinité, puis popularité, puis ordre inverse dans la collection
+        count = len(candidate_ids)
+        tie_break = popularity * count + np.arange(count - 1, -1, -1, dtype=np.int64)
+        scale = int(tie_break.max()) + 1
+
+        customer_ids = [cid for cid in customer_ids if cid in self._rows]
+        recommendations = {}
+        for start in range(0, len(customer_ids), self.chunk_size):
+            chunk = customer_ids[start:start + self.chunk_size]
+            rows = self.purchases[[self._rows[cid] for cid in chunk]]
+
+            scores = np.zeros((len(chunk), count), dtype=np.int64)
+            owned = np.zeros((len(chunk), count), dtype=bool)
+            if len(known_slots):
+                scores[:, known] = (rows @ cooccurrence).toarray()
+                owned[:, known] = rows[:, known_slots].toarray() > 0
+            for row, customer_id in enumerate(chunk):
+                for pid in excluded.get(customer_id, ()):
+                    position = positions.get(pid)
+                    if position is not None:
+                        owned[row, position] = True
+
+            keys = scores * scale + tie_break
+            keys[owned] = -1
+            top = min(limit, count)
+            if top < count:
+                best = np.argpartition(-keys, top - 1, axis=1)[:, :top]
+            else:
+                best = np.broadcast_to(np.arange(count), (len(chunk), count))
+            best_keys = np.take_along_axis(keys, best, axis=1)
+            order = np.argsort(-best_keys, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_keys = np.take_along_axis(best_keys, order, axis=1)
+
+            for customer_id, columns, column_keys in zip(chunk, best, best_keys):
+                products = candidates[columns[column_keys >= 0]].tolist()
+                if products:
+                    recommendations[customer_id] = products
+        return recommendations
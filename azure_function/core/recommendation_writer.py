@@ -0,0 +1,397 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+try:
+    from .bulk_export import gid_to_id
+    from .dry_run import ACTION_UNCHANGED, ACTION_UPDATE
+except ImportError:
+    from bulk_export import gid_to_id
+    from dry_run import ACTION_UNCHANGED, ACTION_UPDATE
+
+METAFIELD_NAMESPACE = 'cross_sell'
+METAFIELD_KEY = 'next_recommendations'
+# Produits déjà recommandés au client (liste JSON, du plus ancien au plus récent)
+HISTORY_METAFIELD_KEY = 'recommendation_history'
+TRIGGER_TAG = 'trigger_reco'
+# Nombre maximal de produits gardés dans l'historique des recommandations
+HISTORY_LIMIT = 30
+
+# Limite Shopify : 25 metafields maximum par appel à metafieldsSet
+MAX_BATCH_SIZE = 25
+# Coût estimé d'un metafieldsSet (quel que soit le nombre de metafields) et d'un tagsAdd
+METAFIELDS_SET_COST = 10
+TAG_ADD_COST = 10
+
+# Lecture des metafields : 100 clients par requête nodes(ids:) (limite Shopify : 250)
+READ_BATCH_SIZE = 100
+# Coût estimé d'un client lu (l'objet + ses deux metafields)
+ESTIMATED_READ_COST_PER_CUSTOMER = 3
+
+RECOMMENDATIONS_QUERY = f"""
+query($ids: [ID!]!) {{
+  nodes(ids: $ids) {{
+    ... on Customer {{
+      id
+      current: metafield(namespace: "{METAFIELD_NAMESPACE}", key: "{METAFIELD_KEY}") {{ value }}
+      history: metafield(namespace: "{METAFIELD_NAMESPACE}", key: "{HISTORY_METAFIELD_KEY}") {{ value }}
+    }}
+  }}
+}}
+"""
+
+
+def customer_gid(customer_id):
+    return f"gid://shopify/Customer/{customer_id}"
+
+
+def format_recommendations(product_ids):
+    """Valeur du metafield : 3 recommandations maximum, séparées par des virgules."""
+    return ",".join(map(str, product_ids[:3]))
+
+
+def parse_product_ids(value):
+    """Lit une valeur de metafield ("1,2,3" ou liste JSON) en liste d'IDs produits."""
+    if not value:
+        return []
+    if value.lstrip().startswith('['):
+        return [int(pid) for pid in json.loads(value)]
+    return [int(pid) for pid in value.split(',') if pid.strip()]
+
+
+def append_history(previous, product_ids, limit=HISTORY_LIMIT):
+    """Ajoute product_ids à l'historique (sans doublon, le plus récent en fin) et garde les limit derniers."""
+    product_ids = list(product_ids)
+    added = set(product_ids)
+    history = [pid for pid in previous if pid not in added] + product_ids
+    return history[-limit:]
+
+
+def build_batch_mutation(with_history=False):
+    """Mutation des metafields d'un lot : un metafieldsSet (atomique) pour les recommandations.
+
+    with_history : second metafieldsSet (aliasé history) pour l'historique des recommandations.
+    """
+    history_var = ", $history: [MetafieldsSetInput!]!" if with_history else ""
+    history_call = (
+        "  history: metafieldsSet(metafields: $history) { userErrors { field message code } }\n"
+        if with_history else ""
+    )
+    return (
+        f"mutation($metafields: [MetafieldsSetInput!]!{history_var}) {{\n"
+        "  metafieldsSet(metafields: $metafields) { userErrors { field message code } }\n"
+        f"{history_call}"
+        "}"
+    )
+
+
+def build_tags_mutation(customer_ids):
+    """Mutation des tags : un tagsAdd aliasé (t0, t1...) par client."""
+    id_vars = ", ".join(f"$id{i}: ID!" for i in range(len(customer_ids)))
+    tag_calls = "\n".join(
+        f"  t{i}: tagsAdd(id: $id{i}, tags: $tags) {{ userErrors {{ field message }} }}"
+        for i in range(len(customer_ids))
+    )
+    return f"mutation($tags: [String!]!, {id_vars}) {{\n{tag_calls}\n}}"
+
+
+@dataclass
+class WriteResult:
+    customer_id: int
+    success: bool
+    recommendations: str = ''
+    error: str = None
+    # Run à blanc : le metafield a déjà cette valeur, aucune écriture prévue
+    skipped: bool = False
+
+
+@dataclass
+class WriteReport:
+    """Résultat détaillé, client par client, d'une écriture par lots."""
+    results: list = field(default_factory=list)
+    requests: int = 0
+    elapsed: float = 0.0
+    # Run à blanc : chemin de l'artefact des écritures prévues
+    artifact: str = None
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.success]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.success]
+
+    @property
+    def skipped(self):
+        return [r for r in self.results if r.skipped]
+
+    def summary(self):
+        skipped = f", {len(self.skipped)} inchangé(s)" if self.skipped else ""
+        return (f"{len(self.succeeded) - len(self.skipped)} client(s) mis à jour{skipped}, {len(self.failed)} échec(s) "
+                f"en {self.requests} requête(s) ({self.elapsed:.1f}s)")
+
+
+def metafield_values(data):
+    """Réponse de RECOMMENDATIONS_QUERY -> {client: (valeur courante, valeur de l'historique)}."""
+    return {
+        gid_to_id(node['id']): ((node.get('current') or {}).get('value'), (node.get('history') or {}).get('value'))
+        for node in data.get('nodes') or [] if node
+    }
+
+
+def previous_products(metafields):
+    """Produits déjà recommandés par client (voir metafield_values) ; clients sans recommandation absents."""
+    previous = {}
+    for customer_id, (current, history) in metafields.items():
+        history = parse_product_ids(history)
+        current = parse_product_ids(current)
+        # Les recommandations écrites avant l'historique ne sont que dans le metafield courant
+        products = history + [pid for pid in current if pid not in history]
+        if products:
+            previous[customer_id] = tuple(products)
+    return previous
+
+
+def batch_request(batch, history=None):
+    """Mutation des metafields d'un lot [(client, produits)] : (clients, valeurs, requête, variables, coût estimé)."""
+    customer_ids = [customer_id for customer_id, _ in batch]
+    values = {customer_id: format_recommendations(product_ids) for customer_id, product_ids in batch}
+    variables = {
+        'metafields': [
+            {
+                'ownerId': customer_gid(customer_id),
+                'namespace': METAFIELD_NAMESPACE,
+                'key': METAFIELD_KEY,
+                'type': 'single_line_text_field',
+                'value': values[customer_id],
+            }
+            for customer_id in customer_ids
+        ],
+    }
+    if history is not None:
+        variables['history'] = [
+            {
+                'ownerId': customer_gid(customer_id),
+                'namespace': METAFIELD_NAMESPACE,
+                'key': HISTORY_METAFIELD_KEY,
+                'type': 'json',
+                'value': json.dumps(append_history(history.get(customer_id, ()),
+                                                   parse_product_ids(values[customer_id]))),
+            }
+            for customer_id in customer_ids
+        ]
+    cost = METAFIELDS_SET_COST * (2 if history is not None else 1)
+    return customer_ids, values, build_batch_mutation(with_history=history is not None), variables, cost
+
+
+def tags_request(customer_ids):
+    """Mutation des tags des clients dont les metafields sont écrits : (requête, variables, coût estimé)."""
+    variables = {'tags': [TRIGGER_TAG]}
+    variables.update({f"id{i}": customer_gid(customer_id) for i, customer_id in enumerate(customer_ids)})
+    return build_tags_mutation(customer_ids), variables, TAG_ADD_COST * len(customer_ids)
+
+
+def metafields_errors(customer_ids, data, with_history=False):
+    """userErrors des metafieldsSet d'un lot : {client: [messages]}.
+
+    Les erreurs qui ne désignent aucun metafield sont rangées sous la clé None (tout le lot).
+    """
+    set_errors = list((data.get('metafieldsSet') or {}).get('userErrors', []))
+    if with_history:
+        set_errors += (data.get('history') or {}).get('userErrors', [])
+    errors = {}
+    for error in set_errors:
+        # field = ["metafields", "<index>", "value"] : on retrouve le client concerné
+        path = error.get('field') or []
+        customer_id = customer_ids[int(path[1])] if len(path) > 1 and str(path[1]).isdigit() else None
+        errors.setdefault(customer_id, []).append(error['message'])
+    return errors
+
+
+def write_batch_steps(batch, history=None):
+    """Écriture d'un lot, indépendante du transport (threads ou asyncio).
+
+    Générateur : produit chaque requête (mutation, variables, coût), reçoit sa réponse 'data'
+    (ou l'exception levée, via throw) et renvoie les WriteResult du lot.
+
+    metafieldsSet est atomique : au moindre userError, aucun metafield du lot n'est écrit.
+    Tout le lot est alors en échec ; les clients non mis en cause sont renvoyés une fois dans
+    un nouveau lot. Le tag, qui déclenche le Flow, n'est ajouté qu'aux clients dont les
+    metafields sont confirmés : jamais d'e-mail sur des recommandations périmées.
+    """
+    with_history = history is not None
+    customer_ids, values, mutation, variables, cost = batch_request(batch, history)
+    errors = {}
+    try:
+        data = yield mutation, variables, cost
+    except Exception as e:
+        return [WriteResult(customer_id, False, values[customer_id], str(e)) for customer_id in customer_ids]
+
+    confirmed = customer_ids
+    rejected = metafields_errors(customer_ids, data, with_history)
+    if rejected:
+        reason = "; ".join(message for messages in rejected.values() for message in messages)
+        for customer_id in customer_ids:
+            errors[customer_id] = rejected.get(customer_id) or [f"lot rejeté : {reason}"]
+        confirmed = []
+        retry = [] if None in rejected else [item for item in batch if item[0] not in rejected]
+        if retry:
+            retry_ids, _, mutation, variables, cost = batch_request(retry, history)
+            try:
+                data = yield mutation, variables, cost
+            except Exception as e:
+                for customer_id in retry_ids:
+                    errors[customer_id] = [str(e)]
+            else:
+                retry_errors = metafields_errors(retry_ids, data, with_history)
+                if retry_errors:
+                    reason = "; ".join(message for messages in retry_errors.values() for message in messages)
+                    for customer_id in retry_ids:
+                        errors[customer_id] = retry_errors.get(customer_id) or [f"lot rejeté : {reason}"]
+                else:
+                    confirmed = retry_ids
+                    for customer_id in retry_ids:
+                        del errors[customer_id]
+
+    if confirmed:
+        mutation, variables, cost = tags_request(confirmed)
+        try:
+            data = yield mutation, variables, cost
+        except Exception as e:
+            for customer_id in confirmed:
+                errors[customer_id] = [str(e)]
+        else:
+            for i, customer_id in enumerate(confirmed):
+                for error in (data.get(f"t{i}") or {}).get('userErrors', []):
+                    errors.setdefault(customer_id, []).append(error['message'])
+
+    return [
+        WriteResult(customer_id, customer_id not in errors, values[customer_id],
+                    "; ".join(errors[customer_id]) if customer_id in errors else None)
+        for customer_id in customer_ids
+    ]
+
+
+def run_batch_steps(steps, send):
+    """Déroule write_batch_steps avec send(mutation, variables, coût) -> data ; renvoie (résultats, requêtes)."""
+    requests = 0
+    try:
+        request = next(steps)
+        while True:
+            requests += 1
+            try:
+                data = send(*request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(data)
+    except StopIteration as stop:
+        return stop.value, requests
+
+
+class RecommendationWriter:
+    """Écrit les recommandations (metafields, puis tag des clients écrits) par lots de 25 clients via GraphQL.
+
+    Les lots sont envoyés par un pool de threads borné ; chaque envoi réserve le coût
+    estimé du lot auprès du limiteur du helper (ShopifyThrottle). read_previous relit
+    en masse les recommandations déjà envoyées, write les complète dans l'historique.
+
+    Avec un artifact (DryRunArtifact), rien n'est écrit : les valeurs actuelles sont lues
+    par lots de 100 et chaque écriture prévue est consignée dans l'artefact ; les clients
+    dont le metafield a déjà la bonne valeur sont marqués skipped.
+    """
+
+    def __init__(self, helper, batch_size=MAX_BATCH_SIZE, max_workers=4, artifact=None):
+        self.helper = helper
+        self.artifact = artifact
+        self.batch_size = READ_BATCH_SIZE if artifact is not None else min(batch_size, MAX_BATCH_SIZE)
+        self.max_workers = max_workers
+
+    def _read_metafields(self, customer_ids):
+        """Valeurs brutes des metafields cross_sell : {client: (valeur courante, valeur de l'historique)}."""
+        data = self.helper.graphql(RECOMMENDATIONS_QUERY, {'ids': [customer_gid(cid) for cid in customer_ids]},
+                                   cost=ESTIMATED_READ_COST_PER_CUSTOMER * len(customer_ids))
+        return metafield_values(data)
+
+    def _read_batch(self, customer_ids):
+        return previous_products(self._read_metafields(customer_ids))
+
+    def read_previous(self, customer_ids):
+        """Produits déjà recommandés, par client : {client: (produits, du plus ancien au plus récent)}.
+
+        Une requête nodes(ids:) pour 100 clients, envoyées par le pool de threads.
+        Les clients sans recommandation passée sont absents du résultat.
+        """
+        customer_ids = list(customer_ids)
+        batches = [customer_ids[i:i + READ_BATCH_SIZE] for i in range(0, len(customer_ids), READ_BATCH_SIZE)]
+        previous = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for batch_previous in pool.map(self._read_batch, batches):
+                previous.update(batch_previous)
+        return previous
+
+    def _write_batch(self, batch, history=None):
+        """Envoie un lot (voir write_batch_steps) ; renvoie (résultats, requêtes)."""
+        return run_batch_steps(write_batch_steps(batch, history),
+                               lambda mutation, variables, cost: self.helper.graphql(mutation, variables, cost=cost))
+
+    def _plan_batch(self, batch, history=None, origins=None):
+        """Run à blanc d'un lot : compare aux valeurs actuelles et consigne les écritures prévues."""
+        customer_ids = [customer_id for customer_id, _ in batch]
+        values = {customer_id: format_recommendations(product_ids) for customer_id, product_ids in batch}
+        try:
+            current = self._read_metafields(customer_ids)
+        except Exception as e:
+            return [WriteResult(customer_id, False, values[customer_id], str(e)) for customer_id in customer_ids]
+
+        results = []
+        rows = []
+        for customer_id in customer_ids:
+            current_value = current.get(customer_id, (None, None))[0]
+            unchanged = current_value == values[customer_id]
+            planned_history = None
+            if history is not None and not unchanged:
+                planned_history = json.dumps(append_history(history.get(customer_id, ()),
+                                                            parse_product_ids(values[customer_id])))
+            rows.append({
+                'customer_id': customer_id,
+                'campaign': (origins or {}).get(customer_id),
+                'action': ACTION_UNCHANGED if unchanged else ACTION_UPDATE,
+                'metafield': f"{METAFIELD_NAMESPACE}.{METAFIELD_KEY}",
+                'current_value': current_value,
+                'planned_value': values[customer_id],
+                'planned_history': planned_history,
+                'tag': None if unchanged else TRIGGER_TAG,
+            })
+            results.append(WriteResult(customer_id, True, values[customer_id], skipped=unchanged))
+        self.artifact.write(rows)
+        return results
+
+    def write(self, recommendations, history=None, on_batch=None, origins=None):
+        """Écrit les recommandations {client: [produits]} et renvoie un WriteReport.
+
+        history : recommandations passées lues par read_previous ; si fourni, les nouvelles
+        y sont ajoutées dans le metafield d'historique (borné à HISTORY_LIMIT produits).
+        on_batch(results) est appelé après chaque lot (ex: point de reprise du RunJournal).
+        origins ({client: campagne}) n'est utilisé que pour l'artefact d'un run à blanc.
+        """
+        items = [(customer_id, list(product_ids)) for customer_id, product_ids in recommendations.items() if product_ids]
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+        report = WriteReport()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            if self.artifact is not None:
+                # Run à blanc : une lecture par lot
+                batch_results = pool.map(lambda batch: (self._plan_batch(batch, history, origins), 1), batches)
+            else:
+                batch_results = pool.map(lambda batch: self._write_batch(batch, history), batches)
+            for results, requests in batch_results:
+                report.requests += requests
+                report.results.extend(results)
+                if on_batch is not None:
+                    on_batch(results)
+        report.elapsed = time.monotonic() - started
+        return report
@@ -0,0 +1,54 @@
+import json
+from typing import NamedTuple
+
+try:
+    import orjson
+except ImportError:
+    # orjson absent : décodage par le module json standard, mêmes résultats
+    orjson = None
+
+try:
+    from .purchase_index import CustomerInfo
+except ImportError:
+    from purchase_index import CustomerInfo
+
+# Champs REST demandés pour les commandes (fields=) : adresses, taxes, expéditions... ne sont pas transférés
+ORDER_FIELDS = 'id,created_at,updated_at,customer,line_items'
+# Historique d'un client : seules les lignes de commande servent
+ORDER_HISTORY_FIELDS = 'id,line_items'
+
+
+def loads(content):
+    """Décode un corps JSON (bytes ou str) avec orjson si disponible."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class OrderRecord(NamedTuple):
+    """Commande réduite à ce qu'utilise le scanner ; même ordre de champs que OrderCache.upsert_orders."""
+    id: int
+    customer: CustomerInfo
+    created_at: str
+    updated_at: str
+    product_ids: tuple
+
+
+def order_record(order):
+    """OrderRecord d'une commande JSON REST (page orders.json ou webhook orders/create)."""
+    customer = order.get('customer')
+    if customer:
+        customer = CustomerInfo(customer['id'], customer.get('first_name'), customer.get('last_name'),
+                                customer.get('email'))
+    return OrderRecord(
+        order['id'],
+        customer or None,
+        order.get('created_at'),
+        order.get('updated_at') or order.get('created_at'),
+        tuple(item['product_id'] for item in order.get('line_items') or () if item.get('product_id') is not None),
+    )
+
+
+def decode_orders(content):
+    """Page orders.json -> liste d'OrderRecord ; les dictionnaires décodés sont libérés aussitôt."""
+    return [order_record(order) for order in loads(content).get('orders', ())]
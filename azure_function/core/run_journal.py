@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+try:
+    from .recommendation_writer import TRIGGER_TAG, format_recommendations
+    from .shared_storage import connect
+except ImportError:
+    from recommendation_writer import TRIGGER_TAG, format_recommendations
+    from shared_storage import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs (run_key);
+
+CREATE TABLE IF NOT EXISTS planned_writes (
+    run_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    customer_id INTEGER NOT NULL,
+    product_ids TEXT NOT NULL,
+    history TEXT,
+    origin TEXT,
+    payload_hash TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, customer_id)
+);
+
+CREATE TABLE IF NOT EXISTS written_customers (
+    customer_id INTEGER PRIMARY KEY,
+    payload_hash TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    written_at TEXT NOT NULL
+);
+
+-- Campagnes d'un run : leur watermark avance quand la file confirme la dernière écriture
+CREATE TABLE IF NOT EXISTS run_campaigns (
+    run_id INTEGER NOT NULL,
+    campaign TEXT NOT NULL,
+    PRIMARY KEY (run_id, campaign)
+);
+
+-- Éligibilité incrémentale : dernier jour traité par un run réussi, par campagne
+CREATE TABLE IF NOT EXISTS eligibility_watermarks (
+    campaign TEXT PRIMARY KEY,
+    last_day TEXT NOT NULL,
+    run_id INTEGER NOT NULL
+);
+"""
+
+# Étapes d'un run : scan des commandes, plan enregistré / écriture en cours, terminé, abandonné
+STATUS_SCANNING = 'scanning'
+STATUS_WRITING = 'writing'
+STATUS_DONE = 'done'
+STATUS_ABANDONED = 'abandoned'
+
+
+def default_journal_path(store_url):
+    """Chemin du journal : CROSS_SELL_CACHE_DIR (stockage monté) ou le dossier temporaire de la fonction."""
+    directory = os.environ.get("CROSS_SELL_CACHE_DIR") or tempfile.gettempdir()
+    store = re.sub(r'[^a-zA-Z0-9_-]', '_', store_url or 'default')
+    return os.path.join(directory, f"cross_sell_journal_{store}.sqlite")
+
+
+def payload_hash(product_ids):
+    """Empreinte de ce qui est écrit pour un client (valeur du metafield + tag)."""
+    payload = f"{format_recommendations(list(product_ids))}|{TRIGGER_TAG}"
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class Run:
+    id: int
+    run_key: str
+    status: str
+    # True si le run reprend un run interrompu dont le plan d'écriture est déjà enregistré
+    resumed: bool = False
+
+
+@dataclass
+class PendingWrites:
+    """Écritures restant à faire pour un run, au format attendu par update_customers_recommendations."""
+    recommendations: dict = field(default_factory=dict)
+    history: dict = field(default_factory=dict)
+    origins: dict = field(default_factory=dict)
+    # Clients déjà écrits avec exactement la même valeur : ignorés sans appel API
+    unchanged: int = 0
+    # Clients déjà écrits par la partie interrompue de ce run
+    already_done: int = 0
+
+
+class RunJournal:
+    """Journal (SQLite) des runs du scanner : reprise après interruption et écritures idempotentes.
+
+    Une fois le scan terminé, le plan d'écriture (client -> produits) est enregistré ; chaque
+    lot écrit avec succès est ensuite marqué fait. Si le run est interrompu (crash, timeout
+    Azure), le run suivant de la même journée reprend ce plan sans refaire le scan et
+    n'écrit que les clients restants. La dernière valeur écrite pour chaque client est
+    gardée : un client dont la valeur n'a pas changé n'est pas réécrit.
+
+    Le journal garde aussi, par campagne, le dernier jour traité par un run terminé : le run
+    suivant ne traite que les clients entrés dans la fenêtre depuis (voir Campaign.window).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # WAL sur disque local, DELETE sur un partage Azure Files (voir shared_storage.connect)
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def begin(self, run_key):
+        """Démarre le run run_key (ex: la date du jour), ou reprend celui resté inachevé.
+
+        Les runs inachevés d'une autre clé sont marqués abandonnés.
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE runs SET status = ?, finished_at = ? WHERE run_key != ? AND status IN (?, ?)",
+                (STATUS_ABANDONED, _now(), run_key, STATUS_SCANNING, STATUS_WRITING)
+            )
+            row = self.conn.execute(
+                "SELECT id, status FROM runs WHERE run_key = ? AND status IN (?, ?) ORDER BY id DESC LIMIT 1",
+                (run_key, STATUS_SCANNING, STATUS_WRITING)
+            ).fetchone()
+            if row and row[1] == STATUS_WRITING:
+                return Run(row[0], run_key, STATUS_WRITING, resumed=True)
+            if row:
+                # Interrompu pendant le scan : rien n'a été écrit, on recommence le scan
+                return Run(row[0], run_key, STATUS_SCANNING)
+            cursor = self.conn.execute(
+                "INSERT INTO runs (run_key, status, started_at) VALUES (?, ?, ?)",
+                (run_key, STATUS_SCANNING, _now())
+            )
+            return Run(cursor.lastrowid, run_key, STATUS_SCANNING)
+
+    def save_plan(self, run, recommendations, history=None, origins=None, campaigns=()):
+        """Enregistre le plan d'écriture du run (fin du scan) ; le run passe à l'étape d'écriture.
+
+        campaigns : noms des campagnes évaluées, dont le watermark avance quand confirm() clôt le run.
+        """
+        history = history or {}
+        origins = origins or {}
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO run_campaigns (run_id, campaign) VALUES (?, ?)",
+                                  [(run.id, name) for name in campaigns])
+            self.conn.execute("DELETE FROM planned_writes WHERE run_id = ?", (run.id,))
+            self.conn.executemany(
+                "INSERT INTO planned_writes (run_id, position, customer_id, product_ids, history, origin, payload_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run.id, position, customer_id, json.dumps(list(product_ids)),
+                     json.dumps(list(history[customer_id])) if customer_id in history else None,
+                     origins.get(customer_id), payload_hash(product_ids))
+                    for position, (customer_id, product_ids) in enumerate(recommendations.items())
+                ]
+            )
+            self.conn.execute("UPDATE runs SET status = ? WHERE id = ?", (STATUS_WRITING, run.id))
+        run.status = STATUS_WRITING
+
+    def pending(self, run):
+        """Écritures restantes du run, dans l'ordre du plan.
+
+        Les clients dont la dernière valeur écrite est identique sont marqués faits
+        immédiatement et comptés dans PendingWrites.unchanged.
+        """
+        pending = PendingWrites()
+        unchanged = []
+        rows = self.conn.execute(
+            "SELECT p.customer_id, p.product_ids, p.history, p.origin, p.payload_hash, p.done, w.payload_hash "
+            "FROM planned_writes p LEFT JOIN written_customers w ON w.customer_id = p.customer_id "
+            "WHERE p.run_id = ? ORDER BY p.position",
+            (run.id,)
+        )
+        for customer_id, product_ids, history, origin, planned_hash, done, written_hash in rows:
+            if done:
+                pending.already_done += 1
+            elif planned_hash == written_hash:
+                unchanged.append(customer_id)
+            else:
+                pending.recommendations[customer_id] = json.loads(product_ids)
+                pending.origins[customer_id] = origin
+                if history is not None:
+                    pending.history[customer_id] = tuple(json.loads(history))
+        if unchanged:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE planned_writes SET done = 1 WHERE run_id = ? AND customer_id = ?",
+                    [(run.id, customer_id) for customer_id in unchanged]
+                )
+        pending.unchanged = len(unchanged)
+        return pending
+
+    def record(self, run, results):
+        """Marque faits les clients écrits avec succès (liste de WriteResult) ; appelé après chaque lot.
+
+        success n'est vrai que pour une écriture confirmée par Shopify (metafields écrits, puis tag) :
+        un client d'un lot rejeté par metafieldsSet n'est jamais journalisé, et comme son hash
+        n'est pas enregistré, pending() ne le prendra pas pour inchangé au run suivant.
+        """
+        written = [r.customer_id for r in results if r.success]
+        if not written:
+            return
+        now = _now()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO written_customers (customer_id, payload_hash, run_id, written_at) "
+                "SELECT customer_id, payload_hash, run_id, ? FROM planned_writes WHERE run_id = ? AND customer_id = ? "
+                "ON CONFLICT(customer_id) DO UPDATE SET payload_hash = excluded.payload_hash, "
+                "run_id = excluded.run_id, written_at = excluded.written_at",
+                [(now, run.id, customer_id) for customer_id in written]
+            )
+            self.conn.executemany(
+                "UPDATE planned_writes SET done = 1 WHERE run_id = ? AND customer_id = ?",
+                [(run.id, customer_id) for customer_id in written]
+            )
+
+    def finish(self, run):
+        """Clôt le run s'il ne reste aucune écriture ; renvoie le nombre de clients encore à écrire."""
+        remaining = self.conn.execute(
+            "SELECT COUNT(*) FROM planned_writes WHERE run_id = ? AND done = 0", (run.id,)
+        ).fetchone()[0]
+        if not remaining:
+            with self.conn:
+                self.conn.execute("UPDATE runs SET status = ?, finished_at = ? WHERE id = ?",
+                                  (STATUS_DONE, _now(), run.id))
+            run.status = STATUS_DONE
+        return remaining
+
+    def confirm(self, run_id, results):
+        """Écritures confirmées par la fonction de la file (WRITE_MODE=queue) pour le run run_id.
+
+        Les clients écrits sont journalisés ; quand le run n'a plus d'écriture en attente, il est clos
+        et le watermark d'éligibilité de ses campagnes avance au jour du run. Renvoie le nombre de
+        clients restants, ou None si le run n'est plus en cours (abandonné, déjà clos, inconnu).
+        """
+        row = self.conn.execute("SELECT run_key, status FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = Run(run_id, *row)
+        # Même pour un run abandonné : le prochain scan ne réécrira pas ces clients (valeur identique)
+        self.record(run, results)
+        if run.status != STATUS_WRITING:
+            return None
+        remaining = self.finish(run)
+        if not remaining:
+            campaigns = [name for (name,) in self.conn.execute(
+                "SELECT campaign FROM run_campaigns WHERE run_id = ?", (run_id,))]
+            self.advance_eligibility(run, campaigns, run.run_key)
+        return remaining
+
+    def eligibility_watermarks(self):
+        """{campagne: dernier jour (YYYY-MM-DD) traité par un run terminé}."""
+        return dict(self.conn.execute("SELECT campaign, last_day FROM eligibility_watermarks"))
+
+    def advance_eligibility(self, run, campaign_names, day):
+        """Enregistre day comme dernier jour traité pour ces campagnes ; à n'appeler qu'une fois le run terminé.
+
+        Le watermark ne recule jamais (confirmation tardive d'un run plus ancien).
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO eligibility_watermarks (campaign, last_day, run_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(campaign) DO UPDATE SET last_day = excluded.last_day, run_id = excluded.run_id "
+                "WHERE excluded.last_day > eligibility_watermarks.last_day",
+                [(name, day, run.id) for name in campaign_names]
+            )
@@ -0,0 +1,266 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+try:
+    from .campaigns import merge_recommendations
+    from .order_cache import OrderCache, default_cache_path
+    from .run_journal import RunJournal, default_journal_path
+    from .write_queue import QUEUE_NAME, RecommendationQueue
+except ImportError:
+    from campaigns import merge_recommendations
+    from order_cache import OrderCache, default_cache_path
+    from run_journal import RunJournal, default_journal_path
+    from write_queue import QUEUE_NAME, RecommendationQueue
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScanOptions:
+    """Réglages du scanner de nuit, communs à toutes les boutiques."""
+    # "rest", "bulk", "cache" ou "webhook" (voir ORDER_INGESTION_MODE dans .env.template)
+    ingestion_mode: str = 'rest'
+    history_days: int = None
+    write_workers: int = 4
+    ranking: str = 'affinity'
+    dry_run: bool = False
+    dry_run_path: str = None
+    # "direct" ou "queue"
+    write_mode: str = 'direct'
+    # "incremental" ou "full"
+    eligibility_mode: str = 'incremental'
+    # Boutiques scannées en même temps (None : toutes)
+    store_workers: int = None
+    # Commandes écrites dans un instantané colonne (Arrow IPC) et éligibilité évaluée dessus en NumPy
+    snapshot: bool = False
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        return cls(
+            ingestion_mode=environ.get("ORDER_INGESTION_MODE", "rest"),
+            history_days=int(environ["ORDER_HISTORY_DAYS"]) if environ.get("ORDER_HISTORY_DAYS") else None,
+            write_workers=int(environ.get("WRITE_MAX_WORKERS", 4)),
+            ranking=environ.get("RECOMMENDATION_RANKING", "affinity"),
+            dry_run=environ.get("DRY_RUN", "").lower() in ("1", "true", "yes"),
+            dry_run_path=environ.get("DRY_RUN_OUTPUT") or None,
+            write_mode=environ.get("WRITE_MODE", "direct").lower(),
+            eligibility_mode=environ.get("ELIGIBILITY_MODE", "incremental").lower(),
+            store_workers=int(environ["STORE_MAX_WORKERS"]) if environ.get("STORE_MAX_WORKERS") else None,
+            snapshot=environ.get("ORDER_SNAPSHOT", "").lower() in ("1", "true", "yes"),
+        )
+
+
+@dataclass
+class StoreReport:
+    """Bilan du run d'une boutique."""
+    store: str
+    # (campagne, éligibles, avec recommandations, sans produit restant)
+    campaigns: list = field(default_factory=list)
+    planned: int = 0
+    written: int = 0
+    failed: int = 0
+    unchanged: int = 0
+    already_done: int = 0
+    remaining: int = 0
+    # Mode queue : messages déposés dans la file
+    enqueued: int = 0
+    resumed: bool = False
+    seconds: float = 0.0
+    # Exception qui a interrompu le run de cette boutique (les autres continuent)
+    error: str = None
+    telemetry: str = ''
+
+    def summary(self):
+        if self.error:
+            return f"[{self.store}] échec après {self.seconds:.1f}s : {self.error}"
+        sent = f"{self.enqueued} message(s) en file" if self.enqueued else f"{self.written} écrit(s), {self.failed} échec(s)"
+        return (f"[{self.store}] {self.planned} client(s) à écrire : {sent}, {self.unchanged} inchangé(s), "
+                f"{self.remaining} restant(s) ({self.seconds:.1f}s)")
+
+
+@dataclass
+class RunReport:
+    """Bilan combiné d'un run multi-boutiques."""
+    stores: list = field(default_factory=list)
+    # Durée réelle du run : les boutiques tournant en parallèle, proche de la plus lente
+    seconds: float = 0.0
+
+    @property
+    def failed_stores(self):
+        return [report for report in self.stores if report.error]
+
+    def total(self, name):
+        return sum(getattr(report, name) for report in self.stores)
+
+    def summary(self):
+        lines = [report.summary() for report in self.stores]
+        lines.append(
+            f"{len(self.stores)} boutique(s) en {self.seconds:.1f}s (somme des runs : {self.total('seconds'):.1f}s) : "
+            f"{self.total('written')} client(s) écrit(s), {self.total('enqueued')} message(s) en file, "
+            f"{self.total('failed')} échec(s), {len(self.failed_stores)} boutique(s) en erreur"
+        )
+        return "\n".join(lines)
+
+
+def store_dry_run_path(path, store, store_count):
+    """Artefact de run à blanc propre à chaque boutique quand plusieurs tournent en parallèle : plan-tb1648.jsonl."""
+    if not path or store_count <= 1:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{store}{extension}"
+
+
+def scan_store(store, options, store_count=1, queue_connection_string=None):
+    """Run de nuit complet d'une boutique : scan, plan d'écriture journalisé, écritures ou dépôt en file.
+
+    Le helper, le limiteur, le cache et le journal sont propres à la boutique. Renvoie un StoreReport ;
+    une erreur est consignée dans le rapport au lieu d'interrompre les autres boutiques.
+    """
+    prefix = f"[{store.name}] "
+    report = StoreReport(store.name)
+    started = time.perf_counter()
+    cache = journal = helper = None
+    try:
+        campaigns = store.campaigns()
+        if not store.has_credentials() or not campaigns:
+            raise ValueError("variables d'environnement manquantes (URL, token ou duo ID/Secret, campagnes)")
+        cache = OrderCache(default_cache_path(store.store_url)) if options.ingestion_mode in ("cache", "webhook") else None
+        helper = store.helper(cache=cache, dry_run=options.dry_run,
+                              dry_run_path=store_dry_run_path(options.dry_run_path, store.name, store_count))
+        telemetry = helper.telemetry
+
+        # Journal du run : un run interrompu (crash, timeout) reprend son plan d'écriture le jour même.
+        # Un run à blanc utilise un journal en mémoire pour ne pas toucher à celui des vrais runs.
+        journal_path = default_journal_path(store.store_url)
+        journal = RunJournal(":memory:" if options.dry_run else journal_path)
+        today = datetime.now().strftime('%Y-%m-%d')
+        run = journal.begin(today)
+        report.resumed = run.resumed
+        since = None
+        if options.eligibility_mode == "incremental":
+            if options.dry_run and os.path.exists(journal_path):
+                # Run à blanc : même tranche que le prochain vrai run, lue dans le journal réel
+                real_journal = RunJournal(journal_path)
+                since = real_journal.eligibility_watermarks()
+                real_journal.close()
+            else:
+                since = journal.eligibility_watermarks()
+
+        if run.resumed:
+            logger.info(f"{prefix}Reprise du run {run.id} : plan d'écriture déjà calculé, scan ignoré.")
+        else:
+            # Une seule passe sur les commandes pour toutes les campagnes : historique de chaque client,
+            # clients éligibles par campagne et produits de la collection qu'ils ne possèdent pas encore
+            # (ni ne se sont déjà vu recommander), classés par affinité de co-achat
+            source = "bulk" if options.ingestion_mode == "bulk" else "rest"
+            snapshot_path = None
+            if options.snapshot:
+                # Import local : seul le mode instantané a besoin de pyarrow
+                try:
+                    from .order_snapshot import default_snapshot_path
+                except ImportError:
+                    from order_snapshot import default_snapshot_path
+                snapshot_path = default_snapshot_path(store.store_url)
+            with telemetry.phase("scanner.scan", source=options.ingestion_mode, ranking=options.ranking):
+                if options.ingestion_mode == "webhook":
+                    results = helper.run_due_campaigns(campaigns, ranking=options.ranking, since=since)
+                else:
+                    results = helper.run_campaigns(campaigns, history_days=options.history_days, source=source,
+                                                   ranking=options.ranking, since=since, snapshot_path=snapshot_path)
+            for result in results:
+                campaign = result.campaign
+                last_day = (since or {}).get(campaign.name)
+                report.campaigns.append((campaign.name, result.eligible_count, len(result.recommendations),
+                                         result.complete_count))
+                logger.info(f"{prefix}Campagne {campaign.name} (J-{campaign.delay_start} à J-{campaign.delay_end}, "
+                         f"{'nouveaux depuis le ' + last_day if last_day else 'fenêtre complète'}): "
+                         f"{result.eligible_count} client(s) éligible(s), {len(result.recommendations)} avec "
+                         f"recommandations, {result.complete_count} sans produit restant à recommander")
+
+            # Un client éligible à plusieurs campagnes ne reçoit que celle listée en premier
+            recommendations, origins = merge_recommendations(results)
+            history = {}
+            for result in results:
+                history.update(result.previous)
+            journal.save_plan(run, recommendations, history=history, origins=origins,
+                              campaigns=[campaign.name for campaign in campaigns])
+
+        pending = journal.pending(run)
+        report.planned = len(pending.recommendations)
+        report.unchanged = pending.unchanged
+        report.already_done = pending.already_done
+        logger.info(f"{prefix}{len(pending.recommendations)} client(s) à écrire, {pending.already_done} déjà écrit(s) "
+                 f"par ce run, {pending.unchanged} inchangé(s) ignoré(s)")
+
+        if options.write_mode == "queue" and not options.dry_run:
+            # Plan déposé dans la file (un message par lot de 25, marqué de la boutique et du run) ; les clients
+            # ne sont journalisés qu'à la confirmation de leur écriture par write_recommendations_from_queue
+            with telemetry.phase("scanner.enqueue"):
+                queue = RecommendationQueue.from_connection_string(queue_connection_string
+                                                                   or os.environ["AzureWebJobsStorage"])
+                report.enqueued = queue.enqueue(pending.recommendations, history=pending.history,
+                                                origins=pending.origins, store=store.name, run=run.id)
+            telemetry.add_items("scanner.enqueue", len(pending.recommendations))
+            logger.info(f"{prefix}{report.enqueued} message(s) déposé(s) dans la file {QUEUE_NAME}")
+        else:
+            # Écritures par lots de 25 clients, en parallèle ; chaque lot réussi est journalisé
+            with telemetry.phase("scanner.write", dry_run=options.dry_run):
+                writes = helper.update_customers_recommendations(pending.recommendations,
+                                                                 max_workers=options.write_workers,
+                                                                 history=pending.history,
+                                                                 on_batch=lambda results: journal.record(run, results),
+                                                                 origins=pending.origins)
+            telemetry.add_items("scanner.write", len(writes.results))
+            report.written = len(writes.succeeded) - len(writes.skipped)
+            report.failed = len(writes.failed)
+            logger.info(f"{prefix}Écriture des recommandations : {writes.summary()}")
+            if options.dry_run:
+                logger.info(f"{prefix}Run à blanc : aucune écriture Shopify, plan consigné dans {writes.artifact}")
+            for failure in writes.failed:
+                logger.error(f"{prefix}Échec de la mise à jour du client {failure.customer_id} "
+                          f"(campagne {pending.origins[failure.customer_id]}): {failure.error}")
+
+        report.remaining = journal.finish(run)
+        if report.remaining and report.enqueued:
+            # Run clos et watermark avancé par RunJournal.confirm, à la dernière écriture confirmée ; un message
+            # parti en file poison laisse le run ouvert et ses clients sont repris par le scan suivant
+            logger.info(f"{prefix}{report.remaining} client(s) en attente de confirmation par la file.")
+        elif report.remaining:
+            logger.warning(f"{prefix}{report.remaining} client(s) restant(s) : ils seront réessayés au prochain "
+                        f"lancement du jour.")
+        else:
+            # Run terminé : le prochain ne traitera que les clients entrés dans la fenêtre après aujourd'hui
+            # (en mode "full" aussi, pour qu'un retour en incrémental reparte de ce run)
+            journal.advance_eligibility(run, [campaign.name for campaign in campaigns], today)
+        report.telemetry = telemetry.format_summary()
+    except Exception as e:
+        logger.exception(f"{prefix}Run interrompu")
+        report.error = f"{type(e).__name__}: {e}"
+    finally:
+        for resource in (journal, cache, helper):
+            if resource is not None:
+                resource.close()
+        report.seconds = time.perf_counter() - started
+    return report
+
+
+def scan_stores(stores, options, queue_connection_string=None):
+    """Scanne les boutiques en parallèle (un thread chacune) et renvoie le RunReport combiné.
+
+    Ajouter une boutique n'allonge le run que si elle est plus lente que les autres : chacune a
+    son propre budget d'API Shopify, les threads passent l'essentiel du temps à attendre le réseau.
+    """
+    started = time.perf_counter()
+    workers = max(1, min(options.store_workers or len(stores), len(stores)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="store") as executor:
+        reports = list(executor.map(
+            lambda store: scan_store(store, options, store_count=len(stores),
+                                     queue_connection_string=queue_connection_string),
+            stores
+        ))
+    return RunReport(reports, seconds=time.perf_counter() - started)
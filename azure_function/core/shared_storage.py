@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+# Systèmes de fichiers réseau : Azure Files est monté en SMB (cifs) sur les plans Linux
+NETWORK_FILESYSTEMS = frozenset({'cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', '9p', 'fuse.blobfuse', 'fuse.blobfuse2'})
+
+MOUNTS_PATH = '/proc/mounts'
+
+
+def _unescape(field):
+    """Décode les échappements octaux de /proc/mounts (\\040 pour une espace)."""
+    return field.encode('latin-1').decode('unicode_escape')
+
+
+def filesystem_type(path, mounts_path=MOUNTS_PATH):
+    """Type du système de fichiers qui contient path (point de montage le plus long), ou None si inconnu."""
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    try:
+        with open(mounts_path, encoding='latin-1') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = _unescape(fields[1])
+                inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+                if inside and len(mount_point) >= len(best):
+                    best, fstype = mount_point, fields[2]
+    except OSError:
+        # Pas de /proc/mounts (macOS, Windows) : rien ne permet de dire que le dossier est distant
+        return None
+    return fstype
+
+
+def is_network_path(path, mounts_path=MOUNTS_PATH):
+    """True si path est sur un partage réseau (SMB/NFS/blobfuse)."""
+    return filesystem_type(path, mounts_path) in NETWORK_FILESYSTEMS
+
+
+def connect(path):
+    """Connexion SQLite partagée par les threads, en WAL sur disque local et en DELETE sur un partage réseau.
+
+    WAL repose sur la mémoire partagée (fichier -shm) et des verrous que SMB/NFS ne garantissent
+    pas : sur Azure Files la base se corromprait ou resterait verrouillée.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    if is_network_path(os.path.dirname(os.path.abspath(path))):
+        conn.execute("PRAGMA journal_mode=DELETE")
+    else:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def require_shared_cache_dir(feature, environ=None, mounts_path=MOUNTS_PATH):
+    """Vérifie au démarrage que CROSS_SELL_CACHE_DIR est commun à toutes les instances ; sinon RuntimeError.
+
+    feature : ce qui a besoin du partage, repris dans le message. Le dossier temporaire par défaut est
+    propre à chaque instance ; sur Azure (WEBSITE_INSTANCE_ID), le dossier doit en plus être un partage monté.
+    """
+    environ = os.environ if environ is None else environ
+    directory = environ.get("CROSS_SELL_CACHE_DIR")
+    if not directory:
+        raise RuntimeError(f"{feature} : CROSS_SELL_CACHE_DIR doit pointer vers un stockage partagé (partage Azure "
+                           f"Files monté), le dossier temporaire par défaut est propre à chaque instance")
+    if environ.get("WEBSITE_INSTANCE_ID") and not is_network_path(directory, mounts_path):
+        raise RuntimeError(f"{feature} : CROSS_SELL_CACHE_DIR={directory} n'est pas un partage monté, "
+                           f"les autres instances ne le voient pas")
+    return directory
@@ -1,118 +1,476 @@
-import shopify
 import os
+import time
 import requests
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+
+try:
+    from .bulk_export import BulkOrderExport
+    from .collection_index import CollectionIndex, DEFAULT_COLLECTION_TTL
+    from .dry_run import DryRunArtifact, default_dry_run_path
+    from .order_webhook import due_campaign_results, due_customer_ids, refresh_updated_customers
+    from .purchase_index import PurchaseIndex
+    from .records import ORDER_FIELDS, ORDER_HISTORY_FIELDS, decode_orders, loads
+    from .recommendation_writer import RecommendationWriter
+    from .telemetry import ScanTelemetry, instrumented
+    from .throttle import ShopifyThrottle, get_header
+    from .token_provider import default_token_provider
+    from .campaigns import CampaignEngine
+except ImportError:
+    from bulk_export import BulkOrderExport
+    from collection_index import CollectionIndex, DEFAULT_COLLECTION_TTL
+    from dry_run import DryRunArtifact, default_dry_run_path
+    from order_webhook import due_campaign_results, due_customer_ids, refresh_updated_customers
+    from purchase_index import PurchaseIndex
+    from records import ORDER_FIELDS, ORDER_HISTORY_FIELDS, decode_orders, loads
+    from recommendation_writer import RecommendationWriter
+    from telemetry import ScanTelemetry, instrumented
+    from throttle import ShopifyThrottle, get_header
+    from token_provider import default_token_provider
+    from campaigns import CampaignEngine
+
+API_VERSION = '2025-01'
+
+
+class ShopifyGraphQLError(Exception):
+    """Erreur renvoyée dans le champ 'errors' d'une réponse GraphQL."""
+
+
+def request_steps(throttle, kind, cost=None):
+    """Reprises d'une requête Admin, sans E/S : partagées par ShopifyHelper et AsyncShopifyHelper.
+
+    Produit des étapes (action, valeur) et reçoit leur résultat :
+    ('wait', secondes) attendre (déjà réservé auprès du limiteur) ; ('send', None) envoyer la requête
+    et renvoyer la réponse ; ('refresh', réponse) renouveler le jeton refusé par un 401 et renvoyer
+    True si la requête peut être rejouée (une seule fois).
+    Un 429 ou un THROTTLED GraphQL attend selon le limiteur avant de réessayer.
+    Renvoie la réponse (kind='rest') ou le contenu de 'data' (kind='graphql').
+    """
+    attempt = 0
+    refreshed = False
+    while True:
+        yield 'wait', throttle.reserve_graphql(cost) if kind == 'graphql' else throttle.reserve_rest()
+        response = yield 'send', None
+        if response.status_code == 429:
+            yield 'wait', throttle.reserve_backoff(attempt, get_header(response.headers, 'Retry-After'))
+            attempt += 1
+            continue
+        if response.status_code == 401 and not refreshed:
+            refreshed = True
+            if (yield 'refresh', response):
+                continue
+        if kind != 'graphql':
+            throttle.record_rest(response.headers)
+            response.raise_for_status()
+            return response
+        response.raise_for_status()
+
+        data = loads(response.content)
+        throttle.record_graphql(data.get('extensions', {}).get('cost'))
+        errors = data.get('errors') or []
+        if any((error.get('extensions') or {}).get('code') == 'THROTTLED' for error in errors):
+            yield 'wait', throttle.reserve_backoff(attempt)
+            attempt += 1
+            continue
+        if errors:
+            raise ShopifyGraphQLError(errors)
+        return data.get('data', {})
+
 
 class ShopifyHelper:
-    def __init__(self, store_url, access_token=None, client_id=None, client_secret=None):
+    def __init__(self, store_url, access_token=None, client_id=None, client_secret=None, cache=None,
+                 throttle=None, pool_size=10, timeout=60, token_provider=None,
+                 collection_ttl=DEFAULT_COLLECTION_TTL, dry_run=False, dry_run_path=None, base_url=None,
+                 telemetry=None):
         self.store_url = store_url
+        # base_url : autre hôte que https://{store_url} (ex: fake Admin API locale des tests)
+        self.api_url = f"{base_url or f'https://{store_url}'}/admin/api/{API_VERSION}"
+        self.timeout = timeout
+        # Session HTTP propre à l'instance : connexions keep-alive réutilisées, aucun état global,
+        # plusieurs helpers (boutiques ou threads différents) peuvent tourner en parallèle
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        # Cache local optionnel (OrderCache) : les lectures sont alors servies depuis SQLite
+        self.cache = cache
+        self._cache_synced = False
+        # Limiteur par lequel passent tous les appels REST et GraphQL (partageable entre helpers d'une même boutique)
+        self.throttle = throttle or ShopifyThrottle()
+        # Requêtes, octets, latences, attentes du limiteur et durée de chaque méthode (spans OpenTelemetry)
+        self.telemetry = telemetry or ScanTelemetry(store_url)
+        # Produits des collections, lus une fois par run (IDs seulement, toutes les pages)
+        self.collections = CollectionIndex(self, ttl=collection_ttl)
+        # Run à blanc : tout est lu normalement, les écritures prévues vont dans un fichier (JSONL ou CSV)
+        self.dry_run = dry_run
+        self.dry_run_path = dry_run_path
         
-        # Si on n'a pas de token mais qu'on a les clés client (Flux 2026)
+        # Si on n'a pas de token mais qu'on a les clés client (Flux 2026) : jeton mis en cache
+        # par le TokenProvider et renouvelé avant expiration
+        self.token_provider = None
+        self._client_credentials = None
         if not access_token and client_id and client_secret:
-            access_token = self._get_new_token(client_id, client_secret)
+            self.token_provider = token_provider or default_token_provider()
+            self._client_credentials = (client_id, client_secret)
+            access_token = self.token_provider.get_token(store_url, client_id, client_secret)
             
         self.access_token = access_token
-        self.session = shopify.Session(self.store_url, '2025-01', self.access_token)
-        shopify.ShopifyResource.activate_session(self.session)
-
-    def _get_new_token(self, client_id, client_secret):
-        """Récupère un jeton d'accès frais via le flux Client Credentials (2026)."""
-        url = f"https://{self.store_url}/admin/oauth/access_token"
-        payload = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials"
-        }
-        response = requests.post(url, json=payload)
-        
-        if response.status_code != 200:
-            print(f"DEBUG: Échec token - Code: {response.status_code}")
-            print(f"DEBUG: Réponse: {response.text}")
-            response.raise_for_status()
-            
-        return response.json().get("access_token")
+        self.http.headers.update({
+            'X-Shopify-Access-Token': self.access_token or '',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        })
+
+    def _ensure_token(self):
+        """Récupère auprès du TokenProvider le jeton courant (renouvelé s'il approche de l'expiration)."""
+        if self.token_provider is None:
+            return
+        token = self.token_provider.get_token(self.store_url, *self._client_credentials)
+        if token != self.access_token:
+            self.access_token = token
+            self.http.headers['X-Shopify-Access-Token'] = token
+
+    def _refresh_token(self, rejected):
+        """Après un 401, remplace le jeton refusé (rejected) ; renvoie True si la requête peut être rejouée.
+
+        Le TokenProvider n'échange le jeton qu'une fois : les requêtes refusées en même temps
+        reçoivent le jeton déjà renouvelé.
+        """
+        if self.token_provider is None:
+            return False
+        token = self.token_provider.get_token(self.store_url, *self._client_credentials, rejected=rejected)
+        self.access_token = token
+        self.http.headers['X-Shopify-Access-Token'] = token
+        print(f"DEBUG: 401 sur {self.store_url}, jeton renouvelé")
+        return True
 
+    def close(self):
+        """Ferme les connexions du pool HTTP."""
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _send(self, kind, steps, send):
+        """Déroule request_steps : attentes, envoi par send() et renouvellement du jeton après un 401."""
+        self._ensure_token()
+        sent_token = None
+        try:
+            action, value = next(steps)
+            while True:
+                if action == 'wait':
+                    if value:
+                        time.sleep(value)
+                    self.telemetry.record_throttle_wait(value, kind)
+                    result = None
+                elif action == 'send':
+                    sent_token = self.access_token
+                    started = time.perf_counter()
+                    result = send()
+                    self.telemetry.record_request(kind, result.status_code, time.perf_counter() - started,
+                                                  len(result.content))
+                else:
+                    result = self._refresh_token(sent_token)
+                action, value = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    def _request(self, method, url, **kwargs):
+        """Requête REST via la session HTTP du helper, à travers le limiteur, avec reprise sur 429.
+
+        Un 401 (jeton révoqué ou expiré avant l'heure) renouvelle le jeton et rejoue la requête une fois.
+
+        url peut être relative à l'API Admin (ex: 'orders.json') ou complète (lien de pagination).
+        """
+        if not url.startswith('http'):
+            url = f"{self.api_url}/{url}"
+        return self._send('rest', request_steps(self.throttle, 'rest'),
+                          lambda: self.http.request(method, url, timeout=self.timeout, **kwargs))
+
+    def graphql(self, query, variables=None, cost=10):
+        """Exécute une requête GraphQL Admin et renvoie le contenu de 'data'.
+
+        cost : coût estimé de la requête, réservé auprès du limiteur avant l'envoi.
+        """
+        url = f"{self.api_url}/graphql.json"
+        payload = {'query': query, 'variables': variables or {}}
+        return self._send('graphql', request_steps(self.throttle, 'graphql', cost),
+                          lambda: self.http.post(url, json=payload, timeout=self.timeout))
+
+    @instrumented(items=len)
     def get_collection_products(self, collection_id):
-        """Récupère tous les IDs de produits d'une collection."""
-        products = shopify.Product.find(collection_id=collection_id)
-        return [p.id for p in products]
+        """Récupère tous les IDs de produits d'une collection, dans l'ordre de la collection."""
+        return self.collections.product_ids(collection_id)
+
+    def get_collection_product_set(self, collection_id):
+        """IDs de produits d'une collection sous forme de frozenset (test d'appartenance en O(1))."""
+        return self.collections.members(collection_id)
 
+    @instrumented(items=int)
+    def sync_cache(self, force=False):
+        """Met à jour le cache local avec les commandes modifiées depuis le dernier watermark.
+
+        Une seule synchronisation par instance, sauf si force=True.
+        """
+        if self.cache is None or (self._cache_synced and not force):
+            return 0
+
+        def fetch_orders(updated_at_min):
+            filters = {'status': 'any'}
+            if updated_at_min:
+                filters['updated_at_min'] = updated_at_min
+            for page in self.iter_order_pages(**filters):
+                # OrderRecord : même forme que les tuples attendus par OrderCache.upsert_orders
+                yield from page
+
+        print(f"DEBUG: Synchronisation du cache depuis {self.cache.watermark or 'le début'}")
+        synced = self.cache.sync(fetch_orders)
+        self._cache_synced = True
+        print(f"DEBUG: {synced} commande(s) synchronisée(s)")
+        return synced
+
+    @instrumented()
     def get_customer_purchase_history(self, customer_id):
         """Récupère tous les produits achetés par un client."""
-        orders = shopify.Order.find(customer_id=customer_id, status='any')
+        self.telemetry.record_cache('orders', hit=self.cache is not None)
+        if self.cache is not None:
+            self.sync_cache()
+            return self.cache.get_customer_purchase_history(customer_id)
+
         purchased_ids = set()
-        for order in orders:
-            for line_item in order.line_items:
-                purchased_ids.add(line_item.product_id)
+        for page in self.iter_order_pages(fields=ORDER_HISTORY_FIELDS, customer_id=customer_id, status='any'):
+            for order in page:
+                purchased_ids.update(order.product_ids)
         return purchased_ids
 
-    def get_eligible_customers(self, days_start=180, days_end=None, collection_id=None):
-        """Trouve les clients ayant passé commande dans une plage de jours donnée."""
+    def _days_ago(self, days):
+        """Date J-days au format YYYY-MM-DD (None si days est None)."""
+        if days is None:
+            return None
+        return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+    def _window_dates(self, days_start, days_end=None):
+        """Convertit une plage J-days_start à J-days_end en dates (début, fin) au format YYYY-MM-DD."""
         if days_end is None:
             days_end = days_start
-            
-        date_start = (datetime.now() - timedelta(days=days_end)).strftime('%Y-%m-%d')
-        date_end = (datetime.now() - timedelta(days=days_start)).strftime('%Y-%m-%d')
+        return self._days_ago(days_end), self._days_ago(days_start)
+
+    def _new_purchase_index(self, days_start, days_end, collection_id):
+        date_start, date_end = self._window_dates(days_start, days_end)
+        target_product_ids = self.get_collection_product_set(collection_id) if collection_id else None
+        return PurchaseIndex(date_start, date_end, target_product_ids)
+
+    def iter_purchases(self, history_days=None, source='rest', poll_interval=5):
+        """Itère une seule fois sur les commandes client : (client, created_at, product_ids).
+
+        source : 'rest' (pagination des commandes), 'bulk' (export GraphQL) ; si un cache
+        local est configuré, il est synchronisé puis lu à la place de l'API.
+        """
+        history_start = self._days_ago(history_days)
+        self.telemetry.record_cache('orders', hit=self.cache is not None)
+        if self.cache is not None:
+            self.sync_cache()
+            yield from self.cache.iter_purchases(history_start)
+        elif source == 'bulk':
+            export = BulkOrderExport(self, poll_interval=poll_interval)
+            url = export.wait(export.start(history_start))
+            for _, customer, created_at, product_ids in export.iter_orders(url):
+                if customer is not None:
+                    yield customer, created_at, product_ids
+        else:
+            for order in self.iter_orders(history_start):
+                if order.customer:
+                    yield order.customer, order.created_at, order.product_ids
+
+    @instrumented(items=len)
+    def build_purchase_index(self, days_start=180, days_end=None, collection_id=None, history_days=None,
+                             source='rest'):
+        """Construit en une seule passe sur les commandes l'historique de tous les clients et leur éligibilité.
+
+        Remplace la boucle get_eligible_customers + get_customer_purchase_history(client) :
+        une seule lecture des commandes depuis J-history_days (tout l'historique par défaut).
+        """
+        index = self._new_purchase_index(days_start, days_end, collection_id)
+        for customer, created_at, product_ids in self.iter_purchases(history_days, source=source):
+            index.add_order(customer.id, created_at, product_ids, customer=customer)
+        return index.freeze()
+
+    def build_purchase_index_bulk(self, days_start=180, days_end=None, collection_id=None, history_days=None):
+        """Même index que build_purchase_index, alimenté par une seule opération bulk GraphQL."""
+        return self.build_purchase_index(days_start, days_end, collection_id, history_days, source='bulk')
+
+    @instrumented(items=lambda results: sum(result.eligible_count for result in results))
+    def run_campaigns(self, campaigns, history_days=None, source='rest', ranking='affinity', exclude_previous=True,
+                      since=None, snapshot_path=None):
+        """Évalue toutes les campagnes en une seule passe sur les commandes (voir CampaignEngine).
+
+        exclude_previous : relit en masse les recommandations déjà envoyées aux clients éligibles
+        pour ne pas les reproposer (CampaignResult.previous).
+        since : {campagne: dernier jour traité} ; seuls les clients entrés dans la fenêtre depuis sont éligibles.
+        snapshot_path : les commandes sont d'abord écrites dans un instantané colonne (Arrow IPC),
+        sur lequel l'éligibilité est évaluée en NumPy ; le fichier reste pour les scripts de diagnostic.
+        """
+        collection_products = {c.collection_id: self.get_collection_products(c.collection_id) for c in campaigns}
+        engine = CampaignEngine(campaigns, collection_products, ranking=ranking, since=since)
+        load_previous = self.get_previous_recommendations if exclude_previous else None
+        if snapshot_path:
+            with self.write_order_snapshot(snapshot_path, history_days, source=source) as snapshot:
+                return engine.run_snapshot(snapshot, load_previous=load_previous)
+        return engine.run(self.iter_purchases(history_days, source=source), load_previous=load_previous)
+
+    @instrumented(items=len)
+    def write_order_snapshot(self, path, history_days=None, source='rest'):
+        """Écrit les commandes client (depuis J-history_days) dans un instantané Arrow IPC ; renvoie l'OrderSnapshot."""
+        # Import local : seul le mode instantané a besoin de pyarrow
+        try:
+            from .order_snapshot import OrderSnapshot
+        except ImportError:
+            from order_snapshot import OrderSnapshot
+        return OrderSnapshot.write(path, self.iter_purchases(history_days, source=source))
+
+    @instrumented(items=lambda results: sum(result.eligible_count for result in results))
+    def run_due_campaigns(self, campaigns, ranking='affinity', exclude_previous=True, today=None, full_refresh=False,
+                          since=None):
+        """Mode webhook : seuls les clients dus aujourd'hui sont traités, sans repasser sur les commandes.
+
+        Les recommandations en attente sont tenues à jour par le webhook orders/create (voir order_webhook) ;
+        le cache est d'abord synchronisé pour rattraper les webhooks manqués, et les clients touchés sont
+        recalculés (tous au premier passage, ou avec full_refresh après un changement de campagnes).
+        since : {campagne: dernier jour traité} ; seuls les clients devenus dus depuis sont renvoyés.
+        """
+        if self.cache is None:
+            raise ValueError("run_due_campaigns nécessite un cache local (OrderCache)")
+        collection_products = {c.collection_id: list(self.get_collection_products(c.collection_id)) for c in campaigns}
+        watermark = None if full_refresh else self.cache.watermark
+        self.sync_cache()
+        refreshed = refresh_updated_customers(self.cache, watermark, campaigns, collection_products)
+        print(f"DEBUG: {refreshed} client(s) recalculé(s) depuis {watermark or 'le début'}")
+
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        due_ids = due_customer_ids(self.cache, today, since=since)
+        previous = self.get_previous_recommendations(due_ids) if exclude_previous else None
+        return due_campaign_results(self.cache, campaigns, collection_products, today, ranking=ranking,
+                                    previous=previous, since=since)
+
+    def iter_order_pages(self, page_size=250, fields=ORDER_FIELDS, **filters):
+        """Parcourt les commandes page par page en suivant les curseurs page_info (en-tête Link).
+
+        Les filtres (dates, statut...) ne sont envoyés qu'à la première requête :
+        Shopify les encode ensuite dans le curseur (fields= est repris dans le lien). Seuls
+        les champs fields sont demandés ; chaque page est une liste d'OrderRecord.
+        """
+        response = self._request('GET', 'orders.json', params={'limit': page_size, 'fields': fields, **filters})
+        while True:
+            yield decode_orders(response.content)
+            next_link = response.links.get('next')
+            if not next_link:
+                break
+            response = self._request('GET', next_link['url'])
+
+    def iter_orders(self, date_start=None, date_end=None, page_size=250):
+        """Itère paresseusement sur toutes les commandes créées entre date_start et date_end (YYYY-MM-DD).
+
+        Une borne à None n'est pas filtrée.
+        """
+        filters = {'status': 'any'}
+        if date_start:
+            filters['created_at_min'] = f"{date_start}T00:00:00Z"
+        if date_end:
+            filters['created_at_max'] = f"{date_end}T23:59:59Z"
+        pages = self.iter_order_pages(page_size=page_size, **filters)
+        for page in pages:
+            yield from page
+
+    def iter_eligible_customers(self, days_start=180, days_end=None, collection_id=None):
+        """Générateur des clients ayant passé commande dans une plage de jours donnée.
+
+        Chaque client n'est produit qu'une fois, dès sa première commande éligible.
+        """
+        date_start, date_end = self._window_dates(days_start, days_end)
         
         print(f"DEBUG: Recherche des commandes entre {date_start} et {date_end}")
-        
-        # Récupérer TOUTES les commandes dans la plage sans pagination
-        # (la pagination avec page_info ne peut pas être mixée avec les filtres temporels)
-        orders = shopify.Order.find(
-            created_at_min=f"{date_start}T00:00:00Z",
-            created_at_max=f"{date_end}T23:59:59Z",
-            status='any',
-            limit=250
-        )
 
         # On extrait les clients uniques qui ont acheté dans la collection cible si spécifiée
-        customers = {}
-        target_product_ids = self.get_collection_products(collection_id) if collection_id else None
+        seen_customer_ids = set()
+        target_product_ids = self.get_collection_product_set(collection_id) if collection_id else None
         
-        for o in orders:
-            if not o.customer or o.customer.id in customers:
+        for o in self.iter_orders(date_start, date_end):
+            if not o.customer or o.customer.id in seen_customer_ids:
                 continue
                 
             if target_product_ids:
                 # Vérifier si un produit de la collection est dans CETTE commande
-                has_target_product = any(item.product_id in target_product_ids for item in o.line_items)
+                has_target_product = not target_product_ids.isdisjoint(o.product_ids)
                 if not has_target_product:
                     continue
             
-            customers[o.customer.id] = o.customer
-            
-        return list(customers.values())
+            seen_customer_ids.add(o.customer.id)
+            yield o.customer
+
+    @instrumented(items=len)
+    def get_eligible_customers(self, days_start=180, days_end=None, collection_id=None):
+        """Trouve les clients ayant passé commande dans une plage de jours donnée."""
+        self.telemetry.record_cache('orders', hit=self.cache is not None)
+        if self.cache is not None:
+            self.sync_cache()
+            date_start, date_end = self._window_dates(days_start, days_end)
+            target_product_ids = self.get_collection_products(collection_id) if collection_id else None
+            return self.cache.get_eligible_customers(date_start, date_end, target_product_ids)
 
+        return list(self.iter_eligible_customers(days_start=days_start, days_end=days_end, collection_id=collection_id))
+
+    @instrumented()
     def update_customer_recommendations(self, customer_id, product_ids):
-        """Met à jour les metafields et ajoute le tag de déclenchement."""
-        customer = shopify.Customer.find(customer_id)
-        if not customer:
-            print(f"DEBUG: Client {customer_id} non trouvé.")
-            return False
+        """Met à jour les recommandations d'un seul client, par le même chemin que update_customers_recommendations.
 
-        # On s'assure d'avoir exactement 3 recommandations (ou moins si on n'en a pas assez)
-        reco_ids = product_ids[:3]
-        recommendation_str = ",".join(map(str, reco_ids))
-        
-        # Injection des recommandations dans un Metafield
-        metafield = shopify.Metafield({
-            'namespace': 'cross_sell',
-            'key': 'next_recommendations',
-            'value': recommendation_str,
-            'type': 'single_line_text_field'
-        })
-        customer.add_metafield(metafield)
-        
-        # Ajout du Tag pour Shopify Flow
-        tags = [t.strip() for t in customer.tags.split(',')] if customer.tags else []
-        if 'trigger_reco' not in tags:
-            tags.append('trigger_reco')
-            customer.tags = ", ".join(tags)
-        
-        # Sauvegarde unique pour tout envoyer (Metafield + Tags)
-        if customer.save():
-            print(f"DEBUG: Recommandations ({recommendation_str}) injectées pour le client {customer_id}")
-            return True
-        else:
-            print(f"DEBUG: Erreur lors de la sauvegarde du client {customer_id}: {customer.errors.full_messages()}")
+        En run à blanc, la ligne prévue est ajoutée à l'artefact du helper : les appels client par client
+        s'y cumulent. Renvoie True si l'écriture a réussi, est prévue ou n'est pas nécessaire (valeur identique).
+        """
+        if self.dry_run and not self.dry_run_path:
+            # Même artefact pour tous les clients traités un par un par ce helper
+            self.dry_run_path = default_dry_run_path(self.store_url)
+        report = self._write_recommendations({customer_id: product_ids}, max_workers=1, append=True)
+        result, = report.results or [None]
+        if result is None or not result.success:
+            print(f"DEBUG: Erreur lors de la sauvegarde du client {customer_id}: {result.error if result else 'aucun produit'}")
             return False
+        if not self.dry_run:
+            print(f"DEBUG: Recommandations ({result.recommendations}) injectées pour le client {customer_id}")
+        return True
+
+    @instrumented(items=len)
+    def get_previous_recommendations(self, customer_ids, max_workers=4):
+        """Produits déjà recommandés à chaque client (metafields cross_sell), lus par lots de 100 via nodes(ids:)."""
+        return RecommendationWriter(self, max_workers=max_workers).read_previous(customer_ids)
+
+    @instrumented(items=lambda report: len(report.results))
+    def update_customers_recommendations(self, recommendations, batch_size=25, max_workers=4, history=None,
+                                         on_batch=None, origins=None):
+        """Met à jour les recommandations de plusieurs clients par lots GraphQL (metafieldsSet + tagsAdd).
+
+        recommendations : dict client -> liste de produits. history : recommandations passées
+        (get_previous_recommendations) complétées dans le metafield d'historique. on_batch(results)
+        est appelé après chaque lot. Renvoie un WriteReport indiquant le succès ou l'erreur pour chaque client.
+
+        En run à blanc, rien n'est écrit : l'artefact (WriteReport.artifact) liste les écritures
+        prévues, avec la campagne d'origine si origins est fourni.
+        """
+        return self._write_recommendations(recommendations, batch_size=batch_size, max_workers=max_workers,
+                                           history=history, on_batch=on_batch, origins=origins)
+
+    def _write_recommendations(self, recommendations, batch_size=25, max_workers=4, history=None, on_batch=None,
+                               origins=None, append=False):
+        if not self.dry_run:
+            writer = RecommendationWriter(self, batch_size=batch_size, max_workers=max_workers)
+            return writer.write(recommendations, history=history, on_batch=on_batch)
+
+        path = self.dry_run_path or default_dry_run_path(self.store_url)
+        with DryRunArtifact(path, append=append) as artifact:
+            writer = RecommendationWriter(self, max_workers=max_workers, artifact=artifact)
+            report = writer.write(recommendations, history=history, on_batch=on_batch, origins=origins)
+        report.artifact = path
+        print(f"DEBUG: [run à blanc] {artifact.rows} écriture(s) prévue(s) consignée(s) dans {path}")
+        return report
@@ -0,0 +1,99 @@
+import os
+import re
+from dataclasses import dataclass
+
+try:
+    from .campaigns import load_campaigns
+    from .shopify_helper import ShopifyHelper
+except ImportError:
+    from campaigns import load_campaigns
+    from shopify_helper import ShopifyHelper
+
+DEFAULT_STORE = 'default'
+
+
+@dataclass(frozen=True)
+class StoreConfig:
+    """Une boutique servie par le scanner : identifiants, secret du webhook et campagnes propres.
+
+    Chaque boutique a son helper (session HTTP, limiteur, télémétrie), son cache et son journal
+    (fichiers nommés d'après store_url) : les boutiques se scannent en parallèle sans rien partager.
+    """
+    name: str
+    store_url: str
+    access_token: str = None
+    client_id: str = None
+    client_secret: str = None
+    webhook_secret: str = None
+    # CROSS_SELL_CAMPAIGNS de la boutique (chemin ou JSON en ligne) ; vide = configuration globale (boutique unique)
+    campaigns_source: str = None
+    # Autre hôte que https://{store_url} (fake Admin API des tests)
+    base_url: str = None
+
+    def has_credentials(self):
+        return bool(self.store_url and (self.access_token or (self.client_id and self.client_secret)))
+
+    def campaigns(self):
+        return load_campaigns(self.campaigns_source)
+
+    def helper(self, **kwargs):
+        """Nouveau ShopifyHelper de la boutique ; kwargs : cache, dry_run, throttle..."""
+        return ShopifyHelper(self.store_url, access_token=self.access_token, client_id=self.client_id,
+                             client_secret=self.client_secret, base_url=self.base_url, **kwargs)
+
+    def async_helper(self, **kwargs):
+        """Nouvel AsyncShopifyHelper de la boutique (points d'entrée async) ; kwargs : throttle, max_concurrency..."""
+        # Import local : seuls les points d'entrée async ont besoin de httpx
+        try:
+            from .async_shopify_helper import AsyncShopifyHelper
+        except ImportError:
+            from async_shopify_helper import AsyncShopifyHelper
+        return AsyncShopifyHelper(self.store_url, access_token=self.access_token, client_id=self.client_id,
+                                  client_secret=self.client_secret, base_url=self.base_url, **kwargs)
+
+
+def env_prefix(name):
+    """Préfixe des variables d'une boutique : 'tb-outdoor' -> 'TB_OUTDOOR_'."""
+    return re.sub(r'[^A-Z0-9]', '_', name.upper()) + '_'
+
+
+def load_store_configs(environ=None):
+    """Boutiques à scanner.
+
+    CROSS_SELL_STORES=tb_outdoor,tb1648 : une boutique par nom, lue dans les variables préfixées
+    (TB_OUTDOOR_SHOPIFY_STORE_URL, TB_OUTDOOR_SHOPIFY_ACCESS_TOKEN, TB_OUTDOOR_CROSS_SELL_CAMPAIGNS...).
+    Chaque boutique doit alors avoir ses propres campagnes : ValueError sinon, plutôt que de relancer
+    la collection globale (TARGET_COLLECTION_ID) d'une autre boutique.
+    Sans CROSS_SELL_STORES : la boutique unique des variables SHOPIFY_* historiques.
+    """
+    environ = os.environ if environ is None else environ
+    names = [name.strip() for name in environ.get("CROSS_SELL_STORES", "").split(',') if name.strip()]
+    if not names:
+        return [_store_from_env(DEFAULT_STORE, '', environ)]
+    return [_store_from_env(name, env_prefix(name), environ) for name in names]
+
+
+def _store_from_env(name, prefix, environ):
+    def get(key):
+        return environ.get(prefix + key) or None
+
+    if prefix and not get("CROSS_SELL_CAMPAIGNS"):
+        raise ValueError(f"Boutique {name} : {prefix}CROSS_SELL_CAMPAIGNS manquant, les campagnes globales "
+                         f"(CROSS_SELL_CAMPAIGNS / TARGET_COLLECTION_ID) ne s'appliquent pas en multi-boutiques")
+    return StoreConfig(
+        name=name,
+        store_url=get("SHOPIFY_STORE_URL"),
+        access_token=get("SHOPIFY_ACCESS_TOKEN"),
+        client_id=get("SHOPIFY_CLIENT_ID"),
+        client_secret=get("SHOPIFY_CLIENT_SECRET"),
+        webhook_secret=get("SHOPIFY_WEBHOOK_SECRET"),
+        campaigns_source=get("CROSS_SELL_CAMPAIGNS"),
+    )
+
+
+def find_store(stores, name=None, store_url=None):
+    """Boutique par nom ou par domaine (en-tête X-Shopify-Shop-Domain) ; la première si aucun critère."""
+    for store in stores:
+        if (name is None or store.name == name) and (store_url is None or store.store_url == store_url):
+            return store
+    return None
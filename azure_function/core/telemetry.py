@@ -0,0 +1,223 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import metrics, trace
+except ImportError:
+    # OpenTelemetry absent : les compteurs locaux et le résumé de fin de run restent disponibles
+    metrics = trace = None
+
+INSTRUMENTATION_NAME = 'cross_sell.scanner'
+
+# Bornes des histogrammes de latence des requêtes (secondes)
+LATENCY_BOUNDARIES = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def configure_telemetry():
+    """Branche OpenTelemetry sur Application Insights si APPLICATIONINSIGHTS_CONNECTION_STRING est défini.
+
+    Nécessite azure-monitor-opentelemetry ; sans lui (ou sans chaîne de connexion), les spans
+    et métriques vont au fournisseur déjà configuré par l'hôte, ou nulle part. Renvoie True si branché.
+    """
+    if not os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING'):
+        return False
+    try:
+        from azure.monitor.opentelemetry import configure_azure_monitor
+    except ImportError:
+        return False
+    configure_azure_monitor()
+    return True
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+class _PhaseStats:
+    __slots__ = ('calls', 'seconds', 'items')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+
+
+class ScanTelemetry:
+    """Instrumentation d'un run du scanner : spans et métriques OpenTelemetry + résumé local.
+
+    Compte les requêtes (par type et statut), les octets reçus, la latence, l'attente imposée
+    par le limiteur, les succès du cache et le débit de chaque phase (éléments par seconde).
+    Une instance par helper ; thread-safe (les écritures partent en parallèle).
+    """
+
+    def __init__(self, store_url=None):
+        self.store_url = store_url
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.request_seconds = 0.0
+        self.throttle_wait = 0.0
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+        self.phases = defaultdict(_PhaseStats)
+
+        self._attributes = {'store': store_url} if store_url else {}
+        if trace is None:
+            self.tracer = None
+            return
+        self.tracer = trace.get_tracer(INSTRUMENTATION_NAME)
+        meter = metrics.get_meter(INSTRUMENTATION_NAME)
+        self._requests = meter.create_counter('shopify.requests', unit='{request}',
+                                              description="Requêtes envoyées à l'API Admin")
+        self._bytes = meter.create_counter('shopify.bytes_received', unit='By',
+                                           description="Octets reçus de l'API Admin")
+        self._latency = meter.create_histogram('shopify.request.duration', unit='s',
+                                               description="Durée des requêtes à l'API Admin",
+                                               explicit_bucket_boundaries_advisory=LATENCY_BOUNDARIES)
+        self._throttle = meter.create_counter('shopify.throttle.wait', unit='s',
+                                              description="Attente imposée par le limiteur")
+        self._cache = meter.create_counter('scanner.cache.lookups', unit='{lookup}',
+                                           description="Accès aux caches (attribut hit)")
+        self._items = meter.create_counter('scanner.items', unit='{item}',
+                                           description="Éléments traités par phase (clients, commandes...)")
+        self._phase_duration = meter.create_histogram('scanner.phase.duration', unit='s',
+                                                      description="Durée des phases du scanner")
+
+    def _attrs(self, **attributes):
+        return {**self._attributes, **attributes}
+
+    # --- enregistrement ---
+
+    def record_request(self, kind, status, seconds, size=0):
+        """Une requête HTTP terminée : kind 'rest', 'graphql' ou 'bulk', status le code HTTP."""
+        with self._lock:
+            self.requests[kind] += 1
+            if status == 429:
+                self.requests[f"{kind}:429"] += 1
+            self.bytes_received += size
+            self.request_seconds += seconds
+        if self.tracer is not None:
+            attributes = self._attrs(kind=kind, status=status)
+            self._requests.add(1, attributes)
+            self._bytes.add(size, attributes)
+            self._latency.record(seconds, attributes)
+
+    def record_throttle_wait(self, seconds, kind):
+        if seconds <= 0:
+            return
+        with self._lock:
+            self.throttle_wait += seconds
+        if self.tracer is not None:
+            self._throttle.add(seconds, self._attrs(kind=kind))
+
+    def record_cache(self, cache, hit, count=1):
+        with self._lock:
+            (self.cache_hits if hit else self.cache_misses)[cache] += count
+        if self.tracer is not None:
+            self._cache.add(count, self._attrs(cache=cache, hit=hit))
+
+    def add_items(self, phase, count):
+        """Éléments traités par une phase, pour son débit (clients par seconde...)."""
+        with self._lock:
+            self.phases[phase].items += count
+        if self.tracer is not None:
+            self._items.add(count, self._attrs(phase=phase))
+
+    @contextmanager
+    def phase(self, name, **attributes):
+        """Span OpenTelemetry + durée cumulée de la phase name (imbriquable)."""
+        started = time.perf_counter()
+        try:
+            if self.tracer is None:
+                yield _NoopSpan()
+            else:
+                # Le span enregistre lui-même l'exception éventuelle et passe en erreur
+                with self.tracer.start_as_current_span(name, attributes=self._attrs(**attributes)) as span:
+                    yield span
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                stats = self.phases[name]
+                stats.calls += 1
+                stats.seconds += seconds
+            if self.tracer is not None:
+                self._phase_duration.record(seconds, self._attrs(phase=name))
+
+    # --- résumé ---
+
+    def cache_hit_rate(self, cache):
+        hits, misses = self.cache_hits[cache], self.cache_misses[cache]
+        return hits / (hits + misses) if hits + misses else None
+
+    def summary(self):
+        """Résumé du run (dict) : requêtes, octets, attentes, caches et débit de chaque phase."""
+        with self._lock:
+            phases = {
+                name: {
+                    'calls': stats.calls,
+                    'seconds': round(stats.seconds, 3),
+                    'items': stats.items,
+                    'items_per_second': round(stats.items / stats.seconds, 1) if stats.items and stats.seconds else None,
+                }
+                for name, stats in self.phases.items()
+            }
+            request_count = sum(count for kind, count in self.requests.items() if ':' not in kind)
+            return {
+                'store': self.store_url,
+                'requests': dict(self.requests),
+                'bytes_received': self.bytes_received,
+                'mean_request_seconds': round(self.request_seconds / request_count, 3) if request_count else None,
+                'throttle_wait_seconds': round(self.throttle_wait, 3),
+                'cache_hit_rate': {cache: self.cache_hit_rate(cache)
+                                   for cache in set(self.cache_hits) | set(self.cache_misses)},
+                'phases': phases,
+            }
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"Télémétrie {summary['store'] or ''} : "
+                 f"{', '.join(f'{count} {kind}' for kind, count in sorted(summary['requests'].items())) or 'aucune requête'}, "
+                 f"{summary['bytes_received'] / 1e6:.1f} Mo reçus, latence moyenne {summary['mean_request_seconds'] or 0:.3f}s, "
+                 f"{summary['throttle_wait_seconds']:.1f}s d'attente du limiteur"]
+        for cache, rate in sorted(summary['cache_hit_rate'].items()):
+            lines.append(f"  cache {cache} : {rate:.0%} de succès")
+        for name, stats in summary['phases'].items():
+            rate = f", {stats['items_per_second']}/s" if stats['items_per_second'] else ''
+            lines.append(f"  {name} : {stats['seconds']:.2f}s ({stats['calls']} appel(s), {stats['items']} élément(s){rate})")
+        return "\n".join(lines)
+
+
+def instrumented(name=None, items=None):
+    """Décorateur de méthode de ShopifyHelper : span 'shopify.<méthode>' autour de l'appel.
+
+    items(résultat) : nombre d'éléments produits, compté pour le débit de la phase.
+    Les coroutines (AsyncShopifyHelper) sont mesurées jusqu'à leur résultat.
+    """
+    def decorator(method):
+        phase = name or f"shopify.{method.__name__}"
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                with self.telemetry.phase(phase):
+                    result = await method(self, *args, **kwargs)
+                if items is not None:
+                    self.telemetry.add_items(phase, items(result))
+                return result
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.telemetry.phase(phase):
+                result = method(self, *args, **kwargs)
+            if items is not None:
+                self.telemetry.add_items(phase, items(result))
+            return result
+        return wrapper
+    return decorator
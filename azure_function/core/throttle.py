@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+
+REST_CALL_LIMIT_HEADER = 'X-Shopify-Shop-Api-Call-Limit'
+
+
+class ThrottledError(Exception):
+    """Shopify a refusé la requête (429 / THROTTLED) après toutes les tentatives autorisées."""
+
+
+def get_header(headers, name):
+    """Lecture d'un en-tête HTTP sans tenir compte de la casse (HTTP/2 renvoie tout en minuscules)."""
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        lowered = name.lower()
+        for key, candidate in headers.items():
+            if key.lower() == lowered:
+                return candidate
+    return value
+
+
+class ShopifyThrottle:
+    """Limiteur partagé par tous les appels REST et GraphQL d'une boutique.
+
+    REST : seau percé (40 appels, 2 rendus par seconde par défaut), recalé sur l'en-tête
+    X-Shopify-Shop-Api-Call-Limit de chaque réponse.
+    GraphQL : seau de points de coût, recalé sur extensions.cost.throttleStatus.
+    Les requêtes attendent avant d'être envoyées plutôt que de provoquer un 429 ;
+    si un 429 arrive malgré tout, retry_delay donne une attente exponentielle avec jitter.
+
+    Les méthodes reserve_* réservent sans dormir et renvoient l'attente à observer : un même
+    limiteur sert aux threads (wait_*) et aux coroutines (asyncio.sleep, voir AsyncShopifyHelper).
+
+    rest_share : part du seau REST de la boutique laissée à ce limiteur, quand plusieurs processus
+    (activités Durable en parallèle) appellent la même boutique chacun avec le sien.
+    """
+
+    def __init__(self, rest_bucket_size=40, rest_leak_rate=2.0, graphql_bucket_size=1000,
+                 graphql_restore_rate=50.0, max_retries=5, base_delay=1.0, max_delay=30.0, rest_share=1.0):
+        self.rest_share = rest_share
+        self.rest_bucket_size = rest_bucket_size * rest_share
+        self.rest_leak_rate = rest_leak_rate * rest_share
+        self.graphql_bucket_size = graphql_bucket_size
+        self.graphql_restore_rate = graphql_restore_rate
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._rest_used = 0.0
+        self._rest_updated = time.monotonic()
+        self._graphql_available = float(graphql_bucket_size)
+        self._graphql_updated = time.monotonic()
+
+        # Temps total passé à attendre (pacing + backoff), en secondes
+        self.wait_time = 0.0
+        self.throttled_count = 0
+
+    def _account(self, seconds):
+        """Comptabilise une attente à venir ; renvoie sa durée (0 si aucune)."""
+        if seconds <= 0:
+            return 0.0
+        with self._lock:
+            self.wait_time += seconds
+        return seconds
+
+    def _sleep(self, seconds):
+        """Attend seconds secondes et renvoie la durée attendue (0 si aucune)."""
+        seconds = self._account(seconds)
+        if seconds:
+            time.sleep(seconds)
+        return seconds
+
+    # --- REST ---
+
+    def _rest_level(self, now):
+        return max(0.0, self._rest_used - (now - self._rest_updated) * self.rest_leak_rate)
+
+    def wait_rest(self):
+        """Réserve une place dans le seau REST, en attendant qu'elle se libère si besoin ; renvoie l'attente."""
+        return self._sleep(self._reserve_rest())
+
+    def reserve_rest(self):
+        """Comme wait_rest, sans dormir : renvoie l'attente à observer avant d'envoyer la requête."""
+        return self._account(self._reserve_rest())
+
+    def _reserve_rest(self):
+        with self._lock:
+            now = time.monotonic()
+            level = self._rest_level(now)
+            # On garde une place de marge pour les appels d'autres processus
+            overflow = level + 1 - (self.rest_bucket_size - 1)
+            delay = overflow / self.rest_leak_rate if overflow > 0 else 0.0
+            self._rest_used = level + 1
+            self._rest_updated = now
+        return delay
+
+    def record_rest(self, headers):
+        """Recale le seau REST sur l'en-tête X-Shopify-Shop-Api-Call-Limit ("32/40").
+
+        L'en-tête ne voit pas les requêtes encore en vol (réservées ici mais pas arrivées chez
+        Shopify) et une réponse lente peut arriver après de plus récentes : on garde donc le
+        plus haut des deux niveaux, sans jamais baisser le niveau local sur la foi du serveur.
+        Avec rest_share, l'en-tête (seau commun à tous les processus) est ramené à la part du limiteur.
+        """
+        value = get_header(headers, REST_CALL_LIMIT_HEADER)
+        if not value:
+            return
+        try:
+            used, size = (int(part) for part in str(value).split('/'))
+        except ValueError:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.rest_bucket_size = size * self.rest_share
+            self._rest_used = max(used * self.rest_share, self._rest_level(now))
+            self._rest_updated = now
+
+    # --- GraphQL ---
+
+    def _graphql_level(self, now):
+        restored = (now - self._graphql_updated) * self.graphql_restore_rate
+        return min(float(self.graphql_bucket_size), self._graphql_available + restored)
+
+    def wait_graphql(self, cost):
+        """Réserve cost points de coût GraphQL, en attendant leur restauration si besoin ; renvoie l'attente."""
+        return self._sleep(self._reserve_graphql(cost))
+
+    def reserve_graphql(self, cost):
+        """Comme wait_graphql, sans dormir : renvoie l'attente à observer avant d'envoyer la requête."""
+        return self._account(self._reserve_graphql(cost))
+
+    def _reserve_graphql(self, cost):
+        with self._lock:
+            now = time.monotonic()
+            available = self._graphql_level(now)
+            cost = min(cost, self.graphql_bucket_size)
+            delay = (cost - available) / self.graphql_restore_rate if available < cost else 0.0
+            self._graphql_available = available - cost
+            self._graphql_updated = now
+        return delay
+
+    def record_graphql(self, cost_extension):
+        """Recale le seau GraphQL sur extensions.cost d'une réponse.
+
+        Même prudence qu'en REST : on garde le plus bas des deux soldes disponibles.
+        """
+        status = (cost_extension or {}).get('throttleStatus')
+        if not status:
+            return
+        with self._lock:
+            now = time.monotonic()
+            local = self._graphql_level(now)
+            self.graphql_bucket_size = status['maximumAvailable']
+            self.graphql_restore_rate = status['restoreRate']
+            self._graphql_available = min(float(status['currentlyAvailable']), local)
+            self._graphql_updated = now
+
+    # --- 429 ---
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Attente avant la tentative suivante : Retry-After si fourni, sinon exponentielle avec jitter."""
+        if retry_after is not None:
+            try:
+                return float(retry_after) + random.uniform(0, self.base_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def backoff(self, attempt, retry_after=None):
+        """Enregistre un refus (429 / THROTTLED) et attend avant de réessayer.
+
+        Renvoie l'attente ; lève ThrottledError quand le nombre maximal de tentatives est atteint.
+        """
+        return self._sleep(self._refused(attempt, retry_after))
+
+    def reserve_backoff(self, attempt, retry_after=None):
+        """Comme backoff, sans dormir : renvoie l'attente à observer avant de réessayer."""
+        return self._account(self._refused(attempt, retry_after))
+
+    def _refused(self, attempt, retry_after):
+        with self._lock:
+            self.throttled_count += 1
+        if attempt >= self.max_retries:
+            raise ThrottledError(f"Requête toujours limitée après {attempt + 1} tentatives")
+        return self.retry_delay(attempt, retry_after)
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+import requests
+
+try:
+    from .throttle import ShopifyThrottle, get_header
+except ImportError:
+    from throttle import ShopifyThrottle, get_header
+
+# Durée de vie supposée si Shopify ne renvoie pas expires_in
+DEFAULT_TOKEN_TTL = 3600
+# Renouvellement anticipé : un jeton qui expire dans moins de 5 minutes est remplacé
+DEFAULT_REFRESH_MARGIN = 300
+
+
+class TokenProvider:
+    """Cache des jetons d'accès du flux Client Credentials, par boutique.
+
+    Les jetons sont gardés en mémoire et, si cache_path est fourni, dans un fichier JSON
+    partagé entre les démarrages à froid et les scripts de debug. Un jeton est renouvelé
+    avant son expiration ; pour une même boutique, un seul échange est en cours à la fois,
+    les autres appelants attendent puis réutilisent le jeton obtenu.
+    """
+
+    def __init__(self, cache_path=None, refresh_margin=DEFAULT_REFRESH_MARGIN, http=None, throttle=None):
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.http = http or requests.Session()
+        self.throttle = throttle or ShopifyThrottle()
+        self._tokens = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.exchange_count = 0
+
+    def _lock_for(self, store_url):
+        with self._locks_guard:
+            return self._locks.setdefault(store_url, threading.Lock())
+
+    def _is_fresh(self, entry):
+        return entry is not None and entry['expires_at'] - self.refresh_margin > time.time()
+
+    def _read_disk(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_disk(self, store_url, entry):
+        if not self.cache_path:
+            return
+        tokens = self._read_disk()
+        tokens[store_url] = entry
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Écriture atomique, lisible par le seul utilisateur courant
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(tokens, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _exchange(self, store_url, client_id, client_secret):
+        """Échange client_id/secret contre un jeton via /admin/oauth/access_token."""
+        url = f"https://{store_url}/admin/oauth/access_token"
+        payload = {
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "grant_type": "client_credentials"
+        }
+        attempt = 0
+        response = self.http.post(url, json=payload, timeout=30)
+        while response.status_code == 429:
+            self.throttle.backoff(attempt, get_header(response.headers, 'Retry-After'))
+            attempt += 1
+            response = self.http.post(url, json=payload, timeout=30)
+
+        if response.status_code != 200:
+            print(f"DEBUG: Échec token - Code: {response.status_code}")
+            print(f"DEBUG: Réponse: {response.text}")
+            response.raise_for_status()
+
+        self.exchange_count += 1
+        data = response.json()
+        return {
+            'access_token': data.get("access_token"),
+            'expires_at': time.time() + int(data.get("expires_in") or DEFAULT_TOKEN_TTL)
+        }
+
+    def _usable(self, entry, force_refresh, rejected):
+        return not force_refresh and self._is_fresh(entry) and entry['access_token'] != rejected
+
+    def get_token(self, store_url, client_id, client_secret, force_refresh=False, rejected=None):
+        """Renvoie un jeton valide pour la boutique, en ne le renouvelant qu'à l'approche de l'expiration.
+
+        rejected : jeton refusé par Shopify (401). Il n'est échangé qu'une fois : les appelants
+        qui le rejettent en même temps attendent l'échange en cours et reçoivent le nouveau jeton.
+        """
+        entry = self._tokens.get(store_url)
+        if self._usable(entry, force_refresh, rejected):
+            return entry['access_token']
+
+        with self._lock_for(store_url):
+            # Un autre thread a pu renouveler le jeton pendant l'attente du verrou
+            entry = self._tokens.get(store_url)
+            if self._usable(entry, force_refresh, rejected):
+                return entry['access_token']
+
+            if not force_refresh:
+                # ... ou un autre processus partageant le cache disque
+                entry = self._read_disk().get(store_url)
+                if self._usable(entry, force_refresh, rejected):
+                    self._tokens[store_url] = entry
+                    return entry['access_token']
+
+            entry = self._exchange(store_url, client_id, client_secret)
+            self._tokens[store_url] = entry
+            self._write_disk(store_url, entry)
+            return entry['access_token']
+
+    def invalidate(self, store_url):
+        """Oublie le jeton en mémoire (ex: après un 401) ; le prochain appel en redemandera un."""
+        self._tokens.pop(store_url, None)
+
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+
+def default_token_provider():
+    """Fournisseur partagé par tout le processus ; cache disque via SHOPIFY_TOKEN_CACHE si défini."""
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = TokenProvider(cache_path=os.environ.get("SHOPIFY_TOKEN_CACHE") or None)
+        return _default_provider
@@ -0,0 +1,141 @@
+import json
+
+try:
+    from .recommendation_writer import MAX_BATCH_SIZE, WriteResult, format_recommendations
+except ImportError:
+    from recommendation_writer import MAX_BATCH_SIZE, WriteResult, format_recommendations
+
+# File des écritures (déclencheur write_recommendations_from_queue) et sa file poison, créée par l'hôte
+QUEUE_NAME = 'cross-sell-writes'
+POISON_QUEUE_NAME = f'{QUEUE_NAME}-poison'
+# Limite Azure Storage Queue : 64 Ko par message (encodé en base64) ; un lot de 25 clients en fait ~3 Ko
+MAX_MESSAGE_BYTES = 48 * 1024
+
+
+class WriteFailedError(Exception):
+    """Des clients d'un message n'ont pas pu être écrits : le message sera redélivré (puis mis en poison)."""
+
+
+def encode_message(entries, store=None, run=None):
+    """Message compact pour un lot : [[client, [produits], campagne, [historique] ou null], ...].
+
+    store : boutique à écrire (plusieurs boutiques partagent la file) ; run : id du run du RunJournal
+    qui a déposé le lot, à qui la fonction de la file confirme les écritures. Le lot est alors
+    enveloppé dans {"store": ..., "run": ..., "writes": [...]}.
+    """
+    if store is not None or run is not None:
+        return json.dumps({'store': store, 'run': run, 'writes': entries}, separators=(',', ':'))
+    return json.dumps(entries, separators=(',', ':'))
+
+
+def _message_entries(body):
+    message = json.loads(body)
+    if isinstance(message, dict):
+        return message, message['writes']
+    return {}, message
+
+
+def message_store(body):
+    """Boutique d'un message (None : boutique unique, sans enveloppe)."""
+    return _message_entries(body)[0].get('store')
+
+
+def message_run(body):
+    """Run du journal qui a déposé le message (None : message sans confirmation attendue)."""
+    return _message_entries(body)[0].get('run')
+
+
+def decode_message(body):
+    """Inverse de encode_message : (recommendations, history, origins) prêts pour update_customers_recommendations.
+
+    history vaut None si le plan a été déposé sans historique.
+    """
+    recommendations, history, origins = {}, {}, {}
+    for customer_id, product_ids, origin, previous in _message_entries(body)[1]:
+        recommendations[customer_id] = product_ids
+        if origin is not None:
+            origins[customer_id] = origin
+        if previous is not None:
+            history[customer_id] = tuple(previous)
+    return recommendations, history or None, origins
+
+
+def iter_messages(recommendations, history=None, origins=None, batch_size=MAX_BATCH_SIZE, store=None, run=None):
+    """Découpe le plan d'écriture en messages d'au plus batch_size clients : (clients, corps)."""
+    origins = origins or {}
+    entries = []
+    for customer_id, product_ids in recommendations.items():
+        if not product_ids:
+            continue
+        # Sans history, le metafield d'historique n'est pas écrit (null) ; avec, il est complété
+        previous = list(history.get(customer_id, ())) if history is not None else None
+        entries.append([customer_id, list(product_ids), origins.get(customer_id), previous])
+        if len(entries) == batch_size:
+            yield entries, encode_message(entries, store, run)
+            entries = []
+    if entries:
+        yield entries, encode_message(entries, store, run)
+
+
+class RecommendationQueue:
+    """File Azure Storage des écritures de recommandations : le scan y dépose le plan, une fonction déclenchée par la file l'écrit.
+
+    Un message = un lot GraphQL (25 clients) ; la fonction write_recommendations_from_queue le
+    traite avec la concurrence, les reprises et la file poison configurées dans host.json.
+    """
+
+    def __init__(self, queue_client):
+        self.queue_client = queue_client
+
+    @classmethod
+    def from_connection_string(cls, connection_string, name=QUEUE_NAME):
+        # Import local : seul le mode WRITE_MODE=queue a besoin du SDK Storage
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.queue import QueueClient, TextBase64DecodePolicy, TextBase64EncodePolicy
+
+        # Base64 : encodage attendu par défaut par le déclencheur de file des Azure Functions
+        client = QueueClient.from_connection_string(connection_string, name,
+                                                    message_encode_policy=TextBase64EncodePolicy(),
+                                                    message_decode_policy=TextBase64DecodePolicy())
+        try:
+            client.create_queue()
+        except ResourceExistsError:
+            pass
+        return cls(client)
+
+    def enqueue(self, recommendations, history=None, origins=None, batch_size=MAX_BATCH_SIZE, on_batch=None,
+                store=None, run=None):
+        """Dépose le plan d'écriture dans la file ; renvoie le nombre de messages envoyés.
+
+        store : nom de la boutique (voir stores.StoreConfig), indiqué dans chaque message. run : id du
+        run du RunJournal ; les clients n'y sont marqués écrits qu'à la confirmation par la fonction de
+        la file (RunJournal.confirm), pas au dépôt.
+
+        on_batch(results) reçoit, après chaque message, des WriteResult pour ses clients confiés à la file.
+        """
+        sent = 0
+        for entries, body in iter_messages(recommendations, history, origins, batch_size, store=store, run=run):
+            if len(body) > MAX_MESSAGE_BYTES:
+                raise ValueError(f"Message de {len(body)} octets : réduire batch_size ({batch_size})")
+            self.queue_client.send_message(body)
+            sent += 1
+            if on_batch is not None:
+                on_batch([WriteResult(customer_id, True, format_recommendations(product_ids))
+                          for customer_id, product_ids, _, _ in entries])
+        return sent
+
+
+def process_message(helper, body, max_workers=1, on_batch=None):
+    """Écrit les recommandations d'un message ; lève WriteFailedError si un client a échoué.
+
+    on_batch(results) reçoit les WriteResult de chaque lot, avant l'éventuelle WriteFailedError : les
+    clients écrits sont confirmés même si le message doit être redélivré pour les autres.
+    Les écritures sont idempotentes (mêmes metafields, même tag) : redélivrer tout le message est sans risque.
+    """
+    recommendations, history, origins = decode_message(body)
+    report = helper.update_customers_recommendations(recommendations, max_workers=max_workers,
+                                                     history=history, on_batch=on_batch, origins=origins)
+    if report.failed:
+        failures = ", ".join(f"{failure.customer_id} ({failure.error})" for failure in report.failed)
+        raise WriteFailedError(f"{len(report.failed)} client(s) non écrit(s) : {failures}")
+    return report
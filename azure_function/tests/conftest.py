@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from core.shopify_helper import ShopifyHelper
+from tests.fake_admin_api import FakeAdminAPI
+from tests.synthetic_shop import generate_shop
+
+# Boutique par défaut des tests : quelques milliers de commandes, lue en quelques pages REST
+DEFAULT_SHOP_SPEC = dict(orders=2000, customers=400, products=80, collections=3, seed=11)
+
+
+@pytest.fixture(scope="module")
+def shop(request):
+    """Boutique synthétique du module de test (SHOP_SPEC du module si défini).
+
+    Une seule boutique par module : les écritures d'un test restent visibles des suivants.
+    """
+    return generate_shop(**getattr(request.module, 'SHOP_SPEC', DEFAULT_SHOP_SPEC))
+
+
+@pytest.fixture
+def api(shop):
+    """Faux Admin API servant la boutique du module, compteurs remis à zéro à chaque test."""
+    with FakeAdminAPI(shop) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def make_helper():
+    """Fabrique de ShopifyHelper branchés sur un faux Admin API : make_helper(api, throttle=...)."""
+    def make(api, **kwargs):
+        return ShopifyHelper(api.store_url, access_token="test", base_url=api.base_url, **kwargs)
+    return make
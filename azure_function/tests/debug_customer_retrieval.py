@@ -6,6 +6,7 @@ import shopify
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from core.token_provider import default_token_provider
 
 load_dotenv()
 
@@ -18,16 +19,8 @@ def debug_customer_retrieval():
     collection_id = "298781474968"  # Forgés
 
     if not access_token and client_id and client_secret:
-        import requests
-        url = f"https://{store_url}/admin/oauth/access_token"
-        payload = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials"
-        }
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            access_token = response.json().get("access_token")
+        # Jeton mis en cache (SHOPIFY_TOKEN_CACHE) et partagé avec les autres scripts
+        access_token = default_token_provider().get_token(store_url, client_id, client_secret)
 
     session = shopify.Session(store_url, '2025-01', access_token)
     shopify.ShopifyResource.activate_session(session)
@@ -59,6 +52,12 @@ def debug_customer_retrieval():
         print(f"✗ Erreur: {e}")
         return
 
+    # Instantané colonne écrit par le scanner (ORDER_SNAPSHOT=true) : étapes 2-3 sans appel API
+    snapshot_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("ORDER_SNAPSHOT_PATH")
+    if snapshot_path:
+        debug_from_snapshot(snapshot_path, product_ids, date_start, date_end)
+        return
+
     # Étape 2: Récupérer TOUTES les commandes dans la période
     print(f"\nÉTAPE 2: Récupérer TOUTES les commandes ({date_start} à {date_end})")
     print("-" * 90)
@@ -108,7 +107,7 @@ def debug_customer_retrieval():
         print(f"✓ Clients uniques de la collection: {len(collection_customers)}")
         
         # Étape 4: Afficher les clients trouvés
-        print(f"\nÉTAPE 3: Détail des clients de la collection")
+        print("\nÉTAPE 3: Détail des clients de la collection")
         print("-" * 90)
         
         for i, (customer_id, customer) in enumerate(collection_customers.items(), 1):
@@ -135,5 +134,31 @@ def debug_customer_retrieval():
         import traceback
         traceback.print_exc()
 
+def debug_from_snapshot(snapshot_path, product_ids, date_start, date_end):
+    """Mêmes étapes que ci-dessus, lues dans l'instantané Arrow du scanner (memory map, calculs NumPy)."""
+    from core.order_snapshot import OrderSnapshot
+
+    print(f"\nÉTAPE 2: Commandes de la collection dans l'instantané {snapshot_path}")
+    print("-" * 90)
+    with OrderSnapshot(snapshot_path) as snapshot:
+        print(f"✓ {snapshot.order_count} commandes, {len(snapshot)} lignes dans l'instantané")
+        customers = snapshot.eligible_customers(date_start, date_end, product_ids)
+        print(f"✓ Clients uniques de la collection: {len(customers)}")
+
+        print("\nÉTAPE 3: Détail des clients de la collection")
+        print("-" * 90)
+        for i, customer in enumerate(customers, 1):
+            all_bought_ids = snapshot.purchase_history(customer.id)
+            recommendations = [pid for pid in product_ids if pid not in all_bought_ids][:3]
+
+            print(f"\n{i}. {customer.email}")
+            print(f"   Nom: {customer.first_name or ''} {customer.last_name or ''}")
+            print(f"   Total de produits achetés: {len(all_bought_ids)}")
+            print(f"   Produits de Forgés achetés: {len([p for p in all_bought_ids if p in product_ids])}")
+            print(f"   Recommandations disponibles: {len(recommendations)}")
+            if recommendations:
+                print(f"   IDs recommandés: {recommendations}")
+
+
 if __name__ == "__main__":
     debug_customer_retrieval()
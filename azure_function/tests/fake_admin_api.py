@@ -0,0 +1,492 @@
+"""Stand-in local de l'API Admin Shopify, servi depuis une SyntheticShop.
+
+Couvre ce qu'utilise ShopifyHelper :
+- REST : orders.json, products.json, customers.json, customers/{id}.json (GET/PUT),
+  pagination par curseur page_info (en-tête Link), en-tête X-Shopify-Shop-Api-Call-Limit
+  et 429 + Retry-After quand le seau est plein ;
+- GraphQL : collection.products, nodes(ids:) des metafields clients, metafieldsSet/tagsAdd,
+  bulkOperationRunQuery + suivi + fichier JSONL, coût dans extensions.cost et THROTTLED.
+
+Les requêtes GraphQL sont reconnues d'après les opérations qu'elles contiennent, pas
+analysées : le serveur ne répond qu'aux requêtes que le helper envoie réellement.
+
+    with FakeAdminAPI(generate_shop(orders=100_000)) as api:
+        helper = ShopifyHelper(api.store_url, access_token="test", base_url=api.base_url)
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import base64
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from tests.synthetic_shop import iso
+
+API_PATH = re.compile(r'^/admin/api/[^/]+/(?P<resource>.+)$')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 250
+
+
+def _timestamp(value):
+    """Date REST (2025-01-02, 2025-01-02T10:00:00Z ou +01:00) en timestamp."""
+    if value is None:
+        return None
+    value = value.replace('Z', '+00:00')
+    if len(value) == 10:
+        value += 'T00:00:00+00:00'
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def _gid(kind, value):
+    return f"gid://shopify/{kind}/{value}"
+
+
+def _gid_id(gid):
+    return int(str(gid).rsplit('/', 1)[-1])
+
+
+def _encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
+
+class LeakyBucket:
+    """Seau percé côté serveur, comme la limite REST de Shopify (taille, fuite par seconde).
+
+    leak_rate=None : aucune limite, le niveau renvoyé reste celui d'un appel isolé.
+    """
+
+    def __init__(self, size, leak_rate=None):
+        self.size = size
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def fill(self):
+        """Remplit le seau, comme si un autre client venait de consommer toute la limite."""
+        with self.lock:
+            self.level = float(self.size)
+            self.updated = time.monotonic()
+
+    def take(self, amount=1.0):
+        """Consomme amount ; renvoie (accepté, niveau après)."""
+        if self.leak_rate is None:
+            return True, amount
+        with self.lock:
+            now = time.monotonic()
+            self.level = max(0.0, self.level - (now - self.updated) * self.leak_rate)
+            self.updated = now
+            if self.level + amount > self.size:
+                return False, self.level
+            self.level += amount
+            return True, self.level
+
+
+class FakeAdminAPI:
+    """Serveur HTTP local (thread en arrière-plan) qui imite l'API Admin pour une SyntheticShop.
+
+    rest_leak_rate / graphql_restore_rate : débit simulé des limites Shopify (None = illimité,
+    les en-têtes de coût sont tout de même renvoyés). bulk_polls : nombre de sondages avant
+    qu'une opération bulk soit terminée. Les compteurs (calls, bytes_sent) servent aux benchmarks.
+    """
+
+    def __init__(self, shop, store_url='fake-shop.myshopify.com', rest_bucket_size=40, rest_leak_rate=None,
+                 graphql_bucket_size=1000, graphql_restore_rate=None, bulk_polls=1):
+        self.shop = shop
+        self.store_url = store_url
+        self.rest_bucket = LeakyBucket(rest_bucket_size, rest_leak_rate)
+        self.graphql_bucket_size = graphql_bucket_size
+        self.graphql_restore_rate = graphql_restore_rate
+        self.graphql_bucket = LeakyBucket(graphql_bucket_size, graphql_restore_rate)
+        self.bulk_polls = bulk_polls
+
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.throttled = 0
+        self._bulk_operations = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # --- cycle de vie ---
+
+    def start(self):
+        api = self
+
+        class Handler(_AdminHandler):
+            pass
+        Handler.api = api
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, name, sent=0):
+        with self._lock:
+            self.calls[name] += 1
+            self.bytes_sent += sent
+
+    def add_bytes(self, sent):
+        with self._lock:
+            self.bytes_sent += sent
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+            self.throttled = 0
+
+    # --- REST ---
+
+    def rest_page(self, resource, params, url):
+        """Renvoie (corps JSON, en-tête Link) pour une ressource paginée."""
+        if 'page_info' in params:
+            state = _decode_cursor(params['page_info'])
+        else:
+            state = {'filters': {k: v for k, v in params.items() if k not in ('limit', 'fields')}, 'offset': 0}
+        limit = min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        fields = params.get('fields')
+
+        key, total, items = self._rest_items(resource, state['filters'], state['offset'], limit)
+        if fields:
+            wanted = set(fields.split(','))
+            items = [{k: v for k, v in item.items() if k in wanted} for item in items]
+
+        link = None
+        next_offset = state['offset'] + limit
+        if next_offset < total:
+            query = {'limit': limit, 'page_info': _encode_cursor({'filters': state['filters'], 'offset': next_offset})}
+            if fields:
+                query['fields'] = fields
+            link = f'<{self.base_url}{url.path}?{urlencode(query)}>; rel="next"'
+        return {key: items}, link
+
+    def _rest_items(self, resource, filters, offset, limit):
+        shop = self.shop
+        if resource == 'orders.json':
+            positions = shop.select_orders(
+                created_at_min=_timestamp(filters.get('created_at_min')),
+                created_at_max=_timestamp(filters.get('created_at_max')),
+                updated_at_min=_timestamp(filters.get('updated_at_min')),
+                customer_id=filters.get('customer_id'),
+            )
+            return 'orders', len(positions), [shop.order_dict(int(p)) for p in positions[offset:offset + limit]]
+        if resource == 'products.json':
+            if filters.get('collection_id'):
+                product_ids = shop.collections.get(int(filters['collection_id']), [])
+            else:
+                product_ids = shop.product_ids
+            return 'products', len(product_ids), [shop.product_dict(pid) for pid in product_ids[offset:offset + limit]]
+        if resource == 'customers.json':
+            total = len(shop.customer_ids)
+            return 'customers', total, [shop.customer_dict(p) for p in range(offset, min(offset + limit, total))]
+        raise KeyError(resource)
+
+    def update_customer(self, customer_id, payload):
+        shop = self.shop
+        with shop.lock:
+            if payload.get('tags') is not None:
+                shop.tags[customer_id] = {t.strip() for t in payload['tags'].split(',') if t.strip()}
+            for metafield in payload.get('metafields') or []:
+                key = f"{metafield['namespace']}.{metafield['key']}"
+                shop.metafields.setdefault(customer_id, {})[key] = metafield['value']
+
+    # --- GraphQL ---
+
+    def graphql(self, query, variables):
+        """Renvoie (data, errors) pour les opérations utilisées par le helper."""
+        if 'bulkOperationRunQuery' in query:
+            return self._bulk_start(variables['query']), None
+        if 'BulkOperation' in query:
+            return self._bulk_status(variables['id']), None
+        if 'collection(id:' in query:
+            return self._collection_products(variables), None
+        if 'nodes(ids:' in query:
+            return self._customer_metafields(variables['ids']), None
+        if 'metafieldsSet' in query or 'tagsAdd' in query:
+            return self._metafields_set(query, variables), None
+        return None, [{'message': 'Opération non prise en charge par la fake API'}]
+
+    def _collection_products(self, variables):
+        product_ids = self.shop.collections.get(_gid_id(variables['id']))
+        if product_ids is None:
+            return {'collection': None}
+        start = int(variables.get('cursor') or 0)
+        page = product_ids[start:start + MAX_PAGE_SIZE]
+        end = start + len(page)
+        return {'collection': {'products': {
+            'pageInfo': {'hasNextPage': end < len(product_ids), 'endCursor': str(end)},
+            'nodes': [{'id': _gid('Product', int(pid))} for pid in page],
+        }}}
+
+    def _customer_metafields(self, ids):
+        nodes = []
+        with self.shop.lock:
+            for gid in ids:
+                customer_id = _gid_id(gid)
+                if self.shop.customer_index(customer_id) is None:
+                    nodes.append(None)
+                    continue
+                values = self.shop.metafields.get(customer_id, {})
+                current = values.get('cross_sell.next_recommendations')
+                history = values.get('cross_sell.recommendation_history')
+                nodes.append({
+                    'id': gid,
+                    'current': {'value': current} if current is not None else None,
+                    'history': {'value': history} if history is not None else None,
+                })
+        return {'nodes': nodes}
+
+    def _metafields_set(self, query, variables):
+        data = {}
+        shop = self.shop
+        with shop.lock:
+            for alias, name in (('metafieldsSet', 'metafields'), ('history', 'history')):
+                if name not in variables:
+                    continue
+                for metafield in variables[name]:
+                    key = f"{metafield['namespace']}.{metafield['key']}"
+                    shop.metafields.setdefault(_gid_id(metafield['ownerId']), {})[key] = metafield['value']
+                data[alias] = {'userErrors': []}
+            for alias in re.findall(r'(t\d+): tagsAdd', query):
+                customer_id = _gid_id(variables[f"id{alias[1:]}"])
+                shop.tags.setdefault(customer_id, set()).update(variables['tags'])
+                data[alias] = {'userErrors': []}
+        return data
+
+    def _bulk_start(self, bulk_query):
+        match = re.search(r'created_at:>=([0-9T:\-Z+]+)', bulk_query)
+        with self._lock:
+            operation_id = _gid('BulkOperation', len(self._bulk_operations) + 1)
+            self._bulk_operations[operation_id] = {
+                'created_at_min': _timestamp(match.group(1)) if match else None,
+                'polls': 0,
+            }
+        return {'bulkOperationRunQuery': {'bulkOperation': {'id': operation_id, 'status': 'CREATED'},
+                                          'userErrors': []}}
+
+    def _bulk_status(self, operation_id):
+        with self._lock:
+            operation = self._bulk_operations.get(operation_id)
+            if operation is None:
+                return {'node': None}
+            operation['polls'] += 1
+            done = operation['polls'] >= self.bulk_polls
+        positions = self.shop.select_orders(created_at_min=operation['created_at_min'])
+        return {'node': {
+            'id': operation_id,
+            'status': 'COMPLETED' if done else 'RUNNING',
+            'errorCode': None,
+            'objectCount': str(len(positions)) if done else '0',
+            'url': f"{self.base_url}/bulk/{_gid_id(operation_id)}.jsonl" if done and len(positions) else None,
+            'partialDataUrl': None,
+        }}
+
+    def iter_bulk_lines(self, number):
+        """Lignes JSONL de l'export : chaque commande suivie de ses lignes de commande."""
+        operation = self._bulk_operations[_gid('BulkOperation', number)]
+        shop = self.shop
+        for position in shop.select_orders(created_at_min=operation['created_at_min']):
+            position = int(position)
+            order_gid = _gid('Order', int(shop.order_ids[position]))
+            customer = int(shop.order_customer[position])
+            customer_node = None
+            if customer >= 0:
+                details = shop.customer_dict(customer)
+                customer_node = {'id': _gid('Customer', details['id']), 'firstName': details['first_name'],
+                                 'lastName': details['last_name'], 'email': details['email']}
+            yield json.dumps({'id': order_gid, 'createdAt': iso(shop.order_created[position]),
+                              'customer': customer_node})
+            start, end = shop.order_offsets[position], shop.order_offsets[position + 1]
+            for product_id in shop.line_item_products[start:end]:
+                yield json.dumps({'product': {'id': _gid('Product', int(product_id))}, '__parentId': order_gid})
+
+
+class _AdminHandler(BaseHTTPRequestHandler):
+    api = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None, counter=None):
+        """Envoie une réponse JSON ; counter est compté avant l'envoi (visible dès que le client la reçoit)."""
+        body = json.dumps(payload).encode('utf-8')
+        if counter:
+            self.api.count(counter, len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            if value is not None:
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _rest_limit(self):
+        """Applique la limite REST ; renvoie l'en-tête de consommation, ou None si refusé (429 envoyé)."""
+        bucket = self.api.rest_bucket
+        accepted, level = bucket.take()
+        if not accepted:
+            with self.api._lock:
+                self.api.throttled += 1
+            # Comme Shopify : temps nécessaire pour qu'une place se libère
+            retry_after = f"{1.0 / bucket.leak_rate:.2f}"
+            self._send_json(429, {'errors': 'Exceeded 2 calls per second for api client. Reduce request rates.'},
+                            {'Retry-After': retry_after}, counter='rest:429')
+            return None
+        return f"{int(round(level))}/{bucket.size}"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/bulk/'):
+            return self._send_bulk(url)
+        match = API_PATH.match(url.path)
+        if not match:
+            return self._send_json(404, {'errors': 'Not Found'})
+        resource = match.group('resource')
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        call_limit = self._rest_limit()
+        if call_limit is None:
+            return
+        headers = {'X-Shopify-Shop-Api-Call-Limit': call_limit}
+
+        customer = re.match(r'^customers/(\d+)\.json$', resource)
+        if customer:
+            position = self.api.shop.customer_index(int(customer.group(1)))
+            if position is None:
+                return self._send_json(404, {'errors': 'Not Found'}, headers)
+            return self._send_json(200, {'customer': self.api.shop.customer_dict(position)}, headers,
+                                   counter='rest:customer')
+
+        try:
+            payload, link = self.api.rest_page(resource, params, url)
+        except KeyError:
+            return self._send_json(404, {'errors': 'Not Found'}, headers)
+        headers['Link'] = link
+        self._send_json(200, payload, headers, counter=f"rest:{resource.split('.')[0]}")
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        match = API_PATH.match(url.path)
+        customer = re.match(r'^customers/(\d+)\.json$', match.group('resource')) if match else None
+        if not customer:
+            return self._send_json(404, {'errors': 'Not Found'})
+        call_limit = self._rest_limit()
+        if call_limit is None:
+            return
+        customer_id = int(customer.group(1))
+        position = self.api.shop.customer_index(customer_id)
+        if position is None:
+            return self._send_json(404, {'errors': 'Not Found'}, {'X-Shopify-Shop-Api-Call-Limit': call_limit})
+        self.api.update_customer(customer_id, self._read_json().get('customer', {}))
+        self._send_json(200, {'customer': self.api.shop.customer_dict(position)},
+                        {'X-Shopify-Shop-Api-Call-Limit': call_limit}, counter='rest:customer_update')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if not url.path.endswith('/graphql.json'):
+            return self._send_json(404, {'errors': 'Not Found'})
+
+        request = self._read_json()
+        query = request.get('query', '')
+        variables = request.get('variables') or {}
+        # Coût : 10 par opération, plus un point par objet renvoyé dans les listes
+        cost = 10 + len(variables.get('ids') or variables.get('metafields') or [])
+        api = self.api
+        accepted, level = api.graphql_bucket.take(cost)
+        available = max(0.0, api.graphql_bucket_size - level)
+        extensions = {'cost': {
+            'requestedQueryCost': cost,
+            'actualQueryCost': cost if accepted else 0,
+            'throttleStatus': {'maximumAvailable': float(api.graphql_bucket_size),
+                               'currentlyAvailable': available,
+                               'restoreRate': float(api.graphql_restore_rate or api.graphql_bucket_size)},
+        }}
+        if not accepted:
+            with api._lock:
+                api.throttled += 1
+            return self._send_json(200, {'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+                                         'extensions': extensions}, counter='graphql:throttled')
+
+        data, errors = api.graphql(query, variables)
+        payload = {'data': data, 'extensions': extensions}
+        if errors:
+            payload['errors'] = errors
+        operation = re.search(r'(bulkOperationRunQuery|BulkOperation|collection|nodes|metafieldsSet|tagsAdd)', query)
+        self._send_json(200, payload, counter=f"graphql:{operation.group(1) if operation else 'unknown'}")
+
+    def _send_bulk(self, url):
+        number = int(url.path.rsplit('/', 1)[-1].split('.')[0])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/jsonl')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.api.count('bulk:download')
+        buffer = []
+        for line in self.api.iter_bulk_lines(number):
+            buffer.append(line)
+            if len(buffer) >= 1000:
+                self._write_chunk(('\n'.join(buffer) + '\n').encode('utf-8'))
+                buffer = []
+        if buffer:
+            self._write_chunk(('\n'.join(buffer) + '\n').encode('utf-8'))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self.api.add_bytes(len(data))
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+
+if __name__ == "__main__":
+    import argparse
+    from tests.synthetic_shop import generate_shop
+
+    parser = argparse.ArgumentParser(description="Lance la fake Admin API sur une boutique synthétique.")
+    parser.add_argument('--orders', type=int, default=10_000)
+    parser.add_argument('--customers', type=int, default=2_000)
+    parser.add_argument('--rest-leak-rate', type=float, default=None)
+    args = parser.parse_args()
+
+    with FakeAdminAPI(generate_shop(orders=args.orders, customers=args.customers),
+                      rest_leak_rate=args.rest_leak_rate) as api:
+        print(f"Fake Admin API : {api.base_url} (Ctrl+C pour arrêter)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -2,7 +2,6 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-import shopify
 import os
 from dotenv import load_dotenv
 from core.shopify_helper import ShopifyHelper
@@ -24,13 +23,13 @@ def find_last_louis_buyer():
 
     # 2. Chercher les dernières commandes
     # On cherche les 50 dernières commandes pour trouver un match
-    orders = shopify.Order.find(limit=50, status='any')
+    orders = next(helper.iter_order_pages(page_size=50, status='any'))
     
     found = False
     for order in orders:
-        has_louis = any(item.product_id in louis_pids for item in order.line_items)
+        has_louis = any(product_id in louis_pids for product_id in order.product_ids)
         if has_louis and order.customer:
-            print(f"\n✅ TROUVÉ ! Commande {order.name} du {order.created_at}")
+            print(f"\n✅ TROUVÉ ! Commande {order.id} du {order.created_at}")
             print(f"Client: {order.customer.first_name} {order.customer.last_name} ({order.customer.email})")
             print(f"ID Client: {order.customer.id}")
             
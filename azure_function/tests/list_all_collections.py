@@ -1,7 +1,12 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
 import shopify
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from core.token_provider import default_token_provider
 
 load_dotenv()
 
@@ -20,19 +25,11 @@ def get_all_collections():
 
     # Initialiser la session
     if not access_token and client_id and client_secret:
-        # Récupérer un token frais
-        import requests
-        url = f"https://{store_url}/admin/oauth/access_token"
-        payload = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials"
-        }
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            access_token = response.json().get("access_token")
-        else:
-            print(f"✗ Erreur lors de la récupération du token: {response.text}")
+        # Jeton mis en cache (SHOPIFY_TOKEN_CACHE) et partagé avec les autres scripts
+        try:
+            access_token = default_token_provider().get_token(store_url, client_id, client_secret)
+        except Exception as e:
+            print(f"✗ Erreur lors de la récupération du token: {e}")
             return
 
     session = shopify.Session(store_url, '2025-01', access_token)
@@ -0,0 +1,199 @@
+"""Benchmark du pipeline du scanner, phase par phase, contre la fake Admin API.
+
+Pour chaque taille de boutique : nombre d'appels API, octets reçus, temps et pic de
+mémoire (RSS) de chaque phase. Les budgets de benchmark_budgets.json sont vérifiés par
+tests/test_benchmarks.py (max_seconds seulement avec BENCH_CHECK_TIME=1) ; ce script affiche
+le rapport complet :
+
+    python tests/pipeline_benchmark.py --sizes small,medium --output rapport.json
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+
+try:
+    import resource
+except ImportError:
+    # Windows : pas de module resource, pic mémoire lu par psutil s'il est installé
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from core.ranking import CoPurchaseRanker
+from core.shopify_helper import ShopifyHelper
+from tests.fake_admin_api import FakeAdminAPI
+from tests.synthetic_shop import generate_shop
+
+BUDGETS_PATH = Path(__file__).parent / 'benchmark_budgets.json'
+
+SIZES = {
+    'small': dict(orders=5_000, customers=1_000, products=200, collections=5),
+    'medium': dict(orders=50_000, customers=10_000, products=1_000, collections=10),
+    'large': dict(orders=1_000_000, customers=200_000, products=5_000, collections=20),
+}
+
+# Fenêtre d'éligibilité mesurée (J-180 à J-365, comme les campagnes Forgés / Top Chef)
+DAYS_START = 180
+DAYS_END = 365
+
+
+@dataclass
+class PhaseResult:
+    size: str
+    phase: str
+    seconds: float
+    api_calls: int
+    bytes_received: int
+    # None si la plateforme ne permet pas de mesurer le pic (ni /proc, ni resource, ni psutil)
+    peak_rss_mb: float
+    items: int
+
+
+def _rss_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _process_peak_kb():
+    """Pic mémoire du processus entier (Ko), sans /proc : resource (Unix) ou psutil (Windows)."""
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) // 1024
+    return None
+
+
+def _reset_peak_rss():
+    """Remet à zéro le pic RSS du processus (Linux) ; False si impossible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class PhaseMeter:
+    """Mesure une phase : temps, appels et octets servis par la fake API, pic RSS au-dessus du départ."""
+
+    def __init__(self, api, size):
+        self.api = api
+        self.size = size
+        self.results = []
+
+    def run(self, phase, fn):
+        self.api.reset_counters()
+        exact_peak = _reset_peak_rss()
+        rss_before = _rss_kb('VmRSS:') or 0
+        started = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - started
+        if exact_peak:
+            peak = max(0, (_rss_kb('VmHWM:') or 0) - rss_before)
+        else:
+            # Sans /proc : pic du processus entier, borne haute grossière
+            peak = _process_peak_kb()
+        self.results.append(PhaseResult(
+            self.size, phase, seconds, sum(self.api.calls.values()), self.api.bytes_sent,
+            peak / 1024 if peak is not None else None, len(value) if hasattr(value, '__len__') else 0,
+        ))
+        return value
+
+
+def run_size(size, spec=None):
+    """Exécute toutes les phases sur une boutique de taille size et renvoie les PhaseResult."""
+    shop = generate_shop(**(spec or SIZES[size]))
+    # Collection la plus vendue : le cas le plus chargé pour l'éligibilité et le classement
+    collection_id = int(max(shop.collections, key=lambda cid: len(shop.collections[cid])))
+
+    with FakeAdminAPI(shop) as api:
+        meter = PhaseMeter(api, size)
+        with ShopifyHelper(api.store_url, access_token="bench", base_url=api.base_url) as helper:
+            candidates = meter.run('collection_products', lambda: helper.get_collection_products(collection_id))
+            meter.run('eligible_customers', lambda: helper.get_eligible_customers(DAYS_START, DAYS_END, collection_id))
+            index = meter.run('history_rest', lambda: helper.build_purchase_index(DAYS_START, DAYS_END, collection_id))
+            meter.run('history_bulk', lambda: helper.build_purchase_index_bulk(DAYS_START, DAYS_END, collection_id))
+
+            eligible = [customer.id for customer in index.eligible_customers()]
+            recommendations = meter.run('ranking', lambda: CoPurchaseRanker(index).rank(eligible, candidates))
+            meter.run('write', lambda: helper.update_customers_recommendations(recommendations).results)
+    return meter.results
+
+
+def check_budgets(results, budgets, check_time=False):
+    """Liste des dépassements de budget (vide si tout est dans les limites).
+
+    check_time : vérifie aussi max_seconds ; le temps dépend de la machine (runners CI partagés),
+    il n'est donc vérifié que sur demande. Appels API et pic RSS le sont toujours.
+    """
+    metrics = [('api_calls', 'max_api_calls'), ('peak_rss_mb', 'max_peak_rss_mb')]
+    if check_time:
+        metrics.append(('seconds', 'max_seconds'))
+    failures = []
+    for result in results:
+        budget = budgets.get(result.size, {}).get(result.phase)
+        if not budget:
+            continue
+        for metric, limit_key in metrics:
+            limit = budget.get(limit_key)
+            value = getattr(result, metric)
+            if limit is not None and value is not None and value > limit:
+                failures.append(f"{result.size}/{result.phase}: {metric} = {value:.2f} > {limit}")
+    return failures
+
+
+def check_time_enabled():
+    """BENCH_CHECK_TIME=1 : les budgets max_seconds sont aussi vérifiés (machine dédiée)."""
+    return os.environ.get("BENCH_CHECK_TIME", "").lower() in ("1", "true", "yes")
+
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def format_report(results):
+    lines = [f"{'taille':<8} {'phase':<20} {'temps (s)':>10} {'appels':>8} {'Mo reçus':>10} "
+             f"{'pic RSS (Mo)':>13} {'éléments':>9}"]
+    for r in results:
+        peak = f"{r.peak_rss_mb:>13.1f}" if r.peak_rss_mb is not None else f"{'n/d':>13}"
+        lines.append(f"{r.size:<8} {r.phase:<20} {r.seconds:>10.3f} {r.api_calls:>8} {r.bytes_received / 1e6:>10.2f} "
+                     f"{peak} {r.items:>9}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline du scanner contre la fake Admin API.")
+    parser.add_argument('--sizes', default='small', help=f"Tailles séparées par des virgules ({', '.join(SIZES)})")
+    parser.add_argument('--output', help="Fichier JSON où écrire les résultats")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes.split(','):
+        results.extend(run_size(size))
+    print(format_report(results))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+    failures = check_budgets(results, load_budgets(), check_time=check_time_enabled())
+    for failure in failures:
+        print(f"✗ Budget dépassé : {failure}")
+    sys.exit(1 if failures else 0)
@@ -1,4 +1,5 @@
 import os
+import sys
 import logging
 from shopify_helper import ShopifyHelper
 from dotenv import load_dotenv
@@ -24,10 +25,15 @@ def production_run():
         print("Erreur : Variables d'environnement manquantes dans .env")
         return
 
-    helper = ShopifyHelper(store_url, access_token=access_token, client_id=client_id, client_secret=client_secret)
+    # --dry-run : rien n'est écrit dans Shopify, chaque écriture prévue va dans l'artefact du run à blanc
+    # (cross_sell_dry_run_<boutique>_<horodatage>.jsonl dans CROSS_SELL_CACHE_DIR ou le dossier temporaire),
+    # et nulle part ailleurs
+    dry_run = '--dry-run' in sys.argv
+    helper = ShopifyHelper(store_url, access_token=access_token, client_id=client_id, client_secret=client_secret,
+                           dry_run=dry_run)
 
     print(f"\n{'='*60}")
-    print(f"LANCEMENT DU SCANNER RÉEL : {store_url}")
+    print(f"LANCEMENT DU SCANNER {'À BLANC' if dry_run else 'RÉEL'} : {store_url}")
     print(f"Période cible : J-{delay_start} à J-{delay_end} (12-18 mois)")
     print(f"Collection cible : {collection_id}")
     print(f"{'='*60}\n")
@@ -36,8 +42,9 @@ def production_run():
     collection_product_ids = helper.get_collection_products(collection_id)
     print(f"INFO: {len(collection_product_ids)} produits dans la collection Louis.")
 
-    # 2. Trouver les clients
-    customers = helper.get_eligible_customers(days_start=delay_start, days_end=delay_end, collection_id=collection_id)
+    # 2. Trouver les clients et leur historique en une seule passe sur les commandes
+    index = helper.build_purchase_index(days_start=delay_start, days_end=delay_end, collection_id=collection_id)
+    customers = index.eligible_customers()
     print(f"INFO: {len(customers)} clients éligibles trouvés sur cette période.")
 
     # 3. Traiter chaque client
@@ -45,7 +52,7 @@ def production_run():
     for customer in customers:
         print(f"\nTraitement de {customer.first_name} {customer.last_name} ({customer.id})...")
         
-        history = helper.get_customer_purchase_history(customer.id)
+        history = index.history(customer.id)
         
         # On retire les produits déjà achetés
         top_recos = [pid for pid in collection_product_ids if pid not in history][:3]
@@ -0,0 +1,208 @@
+"""Boutique Shopify synthétique, déterministe, pour la fake Admin API (fake_admin_api.py).
+
+Les volumes sont paramétrables (jusqu'à des millions de commandes) : les commandes sont
+stockées en colonnes NumPy (dates, client, lignes de commande à plat) et ne sont converties
+en JSON qu'au moment où l'API les sert.
+
+    python tests/synthetic_shop.py --orders 1000000 --customers 200000
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import numpy as np
+
+PRODUCT_ID_BASE = 7_000_000_000
+CUSTOMER_ID_BASE = 5_000_000_000
+ORDER_ID_BASE = 6_000_000_000
+COLLECTION_ID_BASE = 290_000_000_000
+
+FIRST_NAMES = ['Louis', 'Marie', 'Jean', 'Camille', 'Pierre', 'Léa', 'Paul', 'Chloé', 'Hugo', 'Manon']
+LAST_NAMES = ['Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau']
+
+
+@dataclass
+class ShopSpec:
+    """Volumes et forme de la boutique générée."""
+    orders: int = 10_000
+    customers: int = 2_000
+    products: int = 400
+    collections: int = 5
+    # Profondeur de l'historique, en jours avant end_date
+    days: int = 730
+    max_line_items: int = 4
+    # Part des commandes sans client (invités, POS)
+    guest_ratio: float = 0.05
+    # Exposants de Zipf : quelques produits / collections / clients concentrent les achats
+    product_skew: float = 1.1
+    collection_skew: float = 0.8
+    customer_skew: float = 0.6
+    # Probabilité qu'une ligne vienne de la collection principale de la commande (co-achats réalistes)
+    collection_affinity: float = 0.8
+    seed: int = 42
+    # Date de la commande la plus récente : aujourd'hui (minuit UTC), pour que les fenêtres
+    # relatives (J-180...) du helper tombent toujours sur les mêmes commandes
+    end_date: datetime = field(default_factory=lambda: datetime.now(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0))
+
+
+def _zipf_weights(count, skew, rng):
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def iso(timestamp):
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+class SyntheticShop:
+    """Données d'une boutique : produits, collections, clients, commandes, metafields et tags."""
+
+    def __init__(self, spec=None):
+        self.spec = spec = spec or ShopSpec()
+        rng = np.random.default_rng(spec.seed)
+
+        # Produits et collections (chaque produit appartient à une collection)
+        self.product_ids = PRODUCT_ID_BASE + np.arange(spec.products, dtype=np.int64)
+        product_collection = np.sort(rng.integers(0, spec.collections, spec.products))
+        self.collection_ids = COLLECTION_ID_BASE + np.arange(spec.collections, dtype=np.int64)
+        self.collections = {
+            int(cid): self.product_ids[product_collection == position]
+            for position, cid in enumerate(self.collection_ids)
+        }
+        product_weights = _zipf_weights(spec.products, spec.product_skew, rng)
+        collection_weights = _zipf_weights(spec.collections, spec.collection_skew, rng)
+
+        # Clients
+        self.customer_ids = CUSTOMER_ID_BASE + np.arange(spec.customers, dtype=np.int64)
+        customer_weights = _zipf_weights(spec.customers, spec.customer_skew, rng)
+
+        # Commandes, triées par date de création
+        end = int(spec.end_date.timestamp())
+        created = np.sort(rng.integers(end - spec.days * 86400, end, spec.orders))
+        self.order_ids = ORDER_ID_BASE + np.arange(spec.orders, dtype=np.int64)
+        self.order_created = created
+        self.order_updated = np.minimum(created + rng.integers(0, 30 * 86400, spec.orders), end)
+        self.order_customer = rng.choice(spec.customers, size=spec.orders, p=customer_weights).astype(np.int64)
+        self.order_customer[rng.random(spec.orders) < spec.guest_ratio] = -1
+
+        # Lignes de commande à plat : order_offsets[i]:order_offsets[i+1] sont les lignes de la commande i
+        counts = rng.integers(1, spec.max_line_items + 1, spec.orders)
+        self.order_offsets = np.zeros(spec.orders + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.order_offsets[1:])
+        item_order_collection = np.repeat(rng.choice(spec.collections, size=spec.orders, p=collection_weights), counts)
+        items = rng.choice(spec.products, size=int(counts.sum()), p=product_weights)
+        from_collection = rng.random(len(items)) < spec.collection_affinity
+        for position in range(spec.collections):
+            members = np.flatnonzero(product_collection == position)
+            mask = from_collection & (item_order_collection == position)
+            if len(members) and mask.any():
+                weights = product_weights[members] / product_weights[members].sum()
+                items[mask] = rng.choice(members, size=int(mask.sum()), p=weights)
+        self.line_item_products = self.product_ids[items]
+
+        # État modifiable par l'API (écritures du scanner)
+        self.lock = threading.Lock()
+        self.metafields = {}
+        self.tags = {}
+        self._customer_orders = None
+
+    # --- lecture, au format de l'API REST ---
+
+    def customer_index(self, customer_id):
+        position = int(customer_id) - CUSTOMER_ID_BASE
+        return position if 0 <= position < len(self.customer_ids) else None
+
+    def customer_dict(self, position):
+        customer_id = int(self.customer_ids[position])
+        with self.lock:
+            tags = ", ".join(sorted(self.tags.get(customer_id, ())))
+        return {
+            'id': customer_id,
+            'first_name': FIRST_NAMES[position % len(FIRST_NAMES)],
+            'last_name': LAST_NAMES[(position // len(FIRST_NAMES)) % len(LAST_NAMES)],
+            'email': f"client{position}@example.com",
+            'tags': tags,
+        }
+
+    def order_dict(self, position):
+        customer = int(self.order_customer[position])
+        start, end = self.order_offsets[position], self.order_offsets[position + 1]
+        order_id = int(self.order_ids[position])
+        return {
+            'id': order_id,
+            'name': f"#{position + 1000}",
+            'created_at': iso(self.order_created[position]),
+            'updated_at': iso(self.order_updated[position]),
+            'financial_status': 'paid',
+            'customer': self.customer_dict(customer) if customer >= 0 else None,
+            'line_items': [
+                {'id': order_id * 10 + offset, 'product_id': int(pid), 'quantity': 1}
+                for offset, pid in enumerate(self.line_item_products[start:end])
+            ],
+        }
+
+    def product_dict(self, product_id):
+        return {'id': int(product_id), 'title': f"Produit {int(product_id) - PRODUCT_ID_BASE}", 'status': 'active'}
+
+    def customer_orders(self, position):
+        """Positions des commandes d'un client (index construit au premier appel)."""
+        if self._customer_orders is None:
+            order = np.argsort(self.order_customer, kind='stable')
+            bounds = np.searchsorted(self.order_customer[order], np.arange(len(self.customer_ids) + 1))
+            self._customer_orders = (order, bounds)
+        order, bounds = self._customer_orders
+        return order[bounds[position]:bounds[position + 1]]
+
+    def select_orders(self, created_at_min=None, created_at_max=None, updated_at_min=None, customer_id=None):
+        """Positions des commandes correspondant aux filtres REST (timestamps en secondes)."""
+        if customer_id is not None:
+            position = self.customer_index(customer_id)
+            positions = self.customer_orders(position) if position is not None else np.empty(0, np.int64)
+        else:
+            start = np.searchsorted(self.order_created, created_at_min) if created_at_min is not None else 0
+            end = (np.searchsorted(self.order_created, created_at_max, side='right')
+                   if created_at_max is not None else len(self.order_created))
+            positions = np.arange(start, end)
+        if customer_id is not None and created_at_min is not None:
+            positions = positions[self.order_created[positions] >= created_at_min]
+        if customer_id is not None and created_at_max is not None:
+            positions = positions[self.order_created[positions] <= created_at_max]
+        if updated_at_min is not None:
+            positions = positions[self.order_updated[positions] >= updated_at_min]
+        return positions
+
+    @property
+    def line_item_count(self):
+        return len(self.line_item_products)
+
+
+def generate_shop(**overrides):
+    """Raccourci : generate_shop(orders=1_000_000, customers=200_000)."""
+    return SyntheticShop(ShopSpec(**overrides))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Génère une boutique synthétique et affiche ses volumes.")
+    parser.add_argument('--orders', type=int, default=ShopSpec.orders)
+    parser.add_argument('--customers', type=int, default=ShopSpec.customers)
+    parser.add_argument('--products', type=int, default=ShopSpec.products)
+    parser.add_argument('--collections', type=int, default=ShopSpec.collections)
+    parser.add_argument('--seed', type=int, default=ShopSpec.seed)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    shop = generate_shop(orders=args.orders, customers=args.customers, products=args.products,
+                         collections=args.collections, seed=args.seed)
+    print(f"{len(shop.order_ids)} commandes, {shop.line_item_count} lignes, {len(shop.customer_ids)} clients, "
+          f"{len(shop.product_ids)} produits en {time.perf_counter() - started:.1f}s")
+    for cid, members in shop.collections.items():
+        print(f"  Collection {cid}: {len(members)} produits")
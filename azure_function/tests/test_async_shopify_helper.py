@@ -0,0 +1,135 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import asyncio
+import threading
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from core.async_shopify_helper import AsyncShopifyHelper
+from core.campaigns import Campaign, CampaignEngine
+from core.recommendation_writer import parse_product_ids
+from core.throttle import ShopifyThrottle
+
+
+def test_reads_match_the_sync_helper(shop, api, make_helper):
+    customer_ids = [int(cid) for cid in shop.customer_ids[:12]]
+    collection_id = int(shop.collection_ids[0])
+
+    async def read(api):
+        async with AsyncShopifyHelper(api.store_url, access_token="t", base_url=api.base_url,
+                                      max_concurrency=4) as helper:
+            products = await asyncio.gather(*(helper.get_collection_products(cid) for cid in shop.collection_ids))
+            eligible = await helper.get_eligible_customers(30, 300, collection_id)
+            histories = await helper.get_customers_purchase_histories(customer_ids)
+            return products, eligible, histories
+
+    products, eligible, histories = asyncio.run(read(api))
+    with make_helper(api) as helper:
+        assert products[0] == helper.get_collection_products(collection_id)
+        assert eligible == helper.get_eligible_customers(30, 300, collection_id)
+        assert histories == {cid: helper.get_customer_purchase_history(cid) for cid in customer_ids}
+    assert [set(p) for p in products] == [set(shop.collections[int(cid)]) for cid in shop.collection_ids]
+
+
+def test_campaigns_and_writes_with_a_shared_throttle(shop, api, make_helper):
+    campaigns = [Campaign('a', int(shop.collection_ids[0]), delay_start=30, delay_end=300),
+                 Campaign('b', int(shop.collection_ids[1]), delay_start=100, delay_end=700)]
+    throttle = ShopifyThrottle()
+
+    async def scan(api):
+        async with AsyncShopifyHelper(api.store_url, access_token="t", base_url=api.base_url,
+                                      throttle=throttle) as helper:
+            results = await helper.run_campaigns(campaigns, ranking='collection')
+            recommendations = {}
+            for result in results:
+                recommendations.update(result.recommendations)
+            batches = []
+            report = await helper.update_customers_recommendations(recommendations, on_batch=batches.append)
+            return results, recommendations, report, batches
+
+    with make_helper(api, throttle=throttle) as helper:
+        expected = helper.run_campaigns(campaigns, ranking='collection')
+    results, recommendations, report, batches = asyncio.run(scan(api))
+
+    for sync_result, async_result in zip(expected, results):
+        assert async_result.eligible_count == sync_result.eligible_count > 0
+        assert async_result.recommendations == sync_result.recommendations
+    assert report.failed == [] and len(report.results) == len(recommendations)
+    # Par lot : metafieldsSet puis tagsAdd
+    assert 2 * len(batches) == report.requests > 2
+    for customer_id, product_ids in recommendations.items():
+        assert 'trigger_reco' in shop.tags[customer_id]
+        value = shop.metafields[customer_id]['cross_sell.next_recommendations']
+        assert parse_product_ids(value) == list(product_ids)
+
+
+def test_campaign_engine_runs_off_the_event_loop(shop, api):
+    campaigns = [Campaign('a', int(shop.collection_ids[0]), delay_start=30, delay_end=300)]
+    threads = {}
+
+    def recorded(name, method):
+        def wrapper(*args, **kwargs):
+            threads.setdefault(name, set()).add(threading.current_thread())
+            return method(*args, **kwargs)
+        return wrapper
+
+    async def scan():
+        async with AsyncShopifyHelper(api.store_url, access_token="t", base_url=api.base_url) as helper:
+            return await helper.run_campaigns(campaigns, history_days=400, ranking='affinity')
+
+    with mock.patch.object(CampaignEngine, 'add_orders', recorded('add_orders', CampaignEngine.add_orders)), \
+            mock.patch.object(CampaignEngine, 'results', recorded('results', CampaignEngine.results)):
+        results = asyncio.run(scan())
+    assert results[0].eligible_count > 0
+    # Pages de commandes et classement (SciPy) : jamais sur le thread de la boucle d'événements
+    assert set(threads) == {'add_orders', 'results'}
+    assert threading.main_thread() not in threads['add_orders'] | threads['results']
+
+
+def test_zero_history_days_is_not_the_whole_history():
+    async def start(history_days):
+        helper = AsyncShopifyHelper('tb.myshopify.com', access_token='t')
+        starts = []
+
+        async def iter_order_pages(page_size=250, **filters):
+            starts.append(filters.get('created_at_min'))
+            return
+            yield
+
+        with mock.patch.object(helper, 'iter_order_pages', iter_order_pages):
+            async for _ in helper.iter_purchases(history_days):
+                pass
+        await helper.aclose()
+        return starts[0]
+
+    assert asyncio.run(start(None)) is None
+    assert asyncio.run(start(0)) == f"{datetime.now():%Y-%m-%d}T00:00:00Z"
+
+
+def test_graphql_renews_a_revoked_token_once():
+    provider = mock.Mock()
+    provider.get_token.side_effect = ['shpat_1', 'shpat_2']
+    sent = []
+
+    async def post(url, json=None):
+        sent.append(helper.http.headers['X-Shopify-Access-Token'])
+        if len(sent) == 1:
+            return mock.Mock(status_code=401, headers={}, content=b'{}')
+        return mock.Mock(status_code=200, headers={}, content=b'{"data": {"shop": {"name": "TB"}}}')
+
+    async def run():
+        with mock.patch.object(helper.http, 'post', side_effect=post):
+            return await helper.graphql('{ shop { name } }')
+
+    helper = AsyncShopifyHelper('tb.myshopify.com', client_id='id', client_secret='secret', token_provider=provider)
+    assert asyncio.run(run()) == {'shop': {'name': 'TB'}}
+    assert sent == ['shpat_1', 'shpat_2']
+    assert provider.get_token.call_args.kwargs == {'rejected': 'shpat_1'}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,42 @@
+"""Budgets de performance du pipeline (appels API, temps, pic RSS), contre la fake Admin API.
+
+Par défaut seule la taille "small" tourne ; BENCH_SIZES=small,medium pour aller plus loin.
+Les budgets sont dans benchmark_budgets.json : un dépassement fait échouer le build. Les temps
+(max_seconds) ne sont vérifiés qu'avec BENCH_CHECK_TIME=1, sur une machine dédiée.
+"""
+import sys
+import os
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from tests.pipeline_benchmark import check_budgets, check_time_enabled, format_report, load_budgets, run_size
+
+BENCH_SIZES = [size for size in os.environ.get("BENCH_SIZES", "small").split(",") if size]
+
+
+@pytest.mark.parametrize("size", BENCH_SIZES)
+def test_pipeline_within_budgets(size):
+    results = run_size(size)
+    print(format_report(results))
+    assert [r.phase for r in results] == [
+        'collection_products', 'eligible_customers', 'history_rest', 'history_bulk', 'ranking', 'write']
+    assert check_budgets(results, load_budgets(), check_time=check_time_enabled()) == []
+
+
+def test_check_budgets_reports_regressions():
+    from tests.pipeline_benchmark import PhaseResult
+    results = [PhaseResult('small', 'write', 2.5, 40, 0, None, 10)]
+    budgets = {'small': {'write': {'max_api_calls': 15, 'max_seconds': 1, 'max_peak_rss_mb': 20}}}
+    # Temps ignoré sauf demande explicite ; pic RSS non mesurable (None) ignoré
+    assert check_budgets(results, budgets) == ["small/write: api_calls = 40.00 > 15"]
+    assert check_budgets(results, budgets, check_time=True) == ["small/write: api_calls = 40.00 > 15",
+                                                                "small/write: seconds = 2.50 > 1"]
+
+
+if __name__ == "__main__":
+    for size in BENCH_SIZES:
+        test_pipeline_within_budgets(size)
+    test_check_budgets_reports_regressions()
+    print("OK")
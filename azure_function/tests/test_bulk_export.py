@@ -0,0 +1,156 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import requests
+
+from core.bulk_export import BulkOrderExport, BulkOperationError
+from core.purchase_index import CustomerInfo
+
+# Fichier JSONL tel que le produit Shopify : chaque commande précède ses lignes
+CANNED_JSONL = [
+    {"id": "gid://shopify/Order/1", "createdAt": "2025-01-02T10:00:00Z", "customer": {"id": "gid://shopify/Customer/10"}},
+    {"product": {"id": "gid://shopify/Product/100"}, "__parentId": "gid://shopify/Order/1"},
+    {"product": {"id": "gid://shopify/Product/101"}, "__parentId": "gid://shopify/Order/1"},
+    {"id": "gid://shopify/Order/2", "createdAt": "2025-02-03T10:00:00Z", "customer": None},
+    {"product": {"id": "gid://shopify/Product/100"}, "__parentId": "gid://shopify/Order/2"},
+    {"id": "gid://shopify/Order/3", "createdAt": "2025-03-04T10:00:00Z", "customer": {"id": "gid://shopify/Customer/11"}},
+    {"product": None, "__parentId": "gid://shopify/Order/3"},
+    {"product": {"id": "gid://shopify/Product/102"}, "__parentId": "gid://shopify/Order/3"},
+    {"product": {"id": "gid://shopify/Product/103"}, "__parentId": "gid://shopify/Order/1"},
+]
+
+
+class FakeGraphQLHelper:
+    """Remplace ShopifyHelper.graphql : lance l'opération puis la termine au 2e sondage."""
+
+    def __init__(self, url, final_status='COMPLETED'):
+        self.url = url
+        self.final_status = final_status
+        self.polls = 0
+        self.queries = []
+        self.http = requests.Session()
+
+    def graphql(self, query, variables=None):
+        self.queries.append((query, variables))
+        if 'bulkOperationRunQuery' in query:
+            return {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'},
+                'userErrors': []
+            }}
+        self.polls += 1
+        status = 'RUNNING' if self.polls < 2 else self.final_status
+        return {'node': {'id': variables['id'], 'status': status, 'errorCode': None,
+                         'objectCount': str(len(CANNED_JSONL)), 'url': self.url}}
+
+
+def serve_directory(directory):
+    """Démarre un serveur HTTP local qui sert le fichier JSONL (stand-in du stockage Shopify)."""
+    handler = partial(SimpleHTTPRequestHandler, directory=str(directory))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_bulk_export_builds_purchase_index(tmp_path):
+    (tmp_path / 'orders.jsonl').write_text('\n'.join(json.dumps(r) for r in CANNED_JSONL) + '\n')
+    server = serve_directory(tmp_path)
+    try:
+        helper = FakeGraphQLHelper(f"http://127.0.0.1:{server.server_port}/orders.jsonl")
+        index = BulkOrderExport(helper, poll_interval=0).run(created_at_min='2025-01-01')
+    finally:
+        server.shutdown()
+
+    assert index.history(10) == {100, 101, 103}
+    assert index.history(11) == {102}
+    assert len(index) == 2
+    assert helper.polls == 2
+    assert 'created_at:>=2025-01-01' in helper.queries[0][1]['query']
+
+
+def test_bulk_export_groups_line_items_by_order(tmp_path):
+    (tmp_path / 'orders.jsonl').write_text('\n'.join(json.dumps(r) for r in CANNED_JSONL))
+    server = serve_directory(tmp_path)
+    try:
+        export = BulkOrderExport(FakeGraphQLHelper(None))
+        orders = list(export.iter_orders(f"http://127.0.0.1:{server.server_port}/orders.jsonl"))
+    finally:
+        server.shutdown()
+
+    customer = CustomerInfo(10, None, None, None)
+    # Ligne arrivée hors de son groupe rattachée à sa commande ; chaque commande renvoyée une seule fois
+    assert orders == [(1, customer, '2025-01-02T10:00:00Z', [100, 101, 103]),
+                      (2, None, '2025-02-03T10:00:00Z', [100]),
+                      (3, CustomerInfo(11, None, None, None), '2025-03-04T10:00:00Z', [102])]
+
+    # Fenêtre d'une commande : les commandes sorties passent sur disque, la ligne tardive y est rattachée
+    export = BulkOrderExport(FakeGraphQLHelper(None), order_window=1)
+    server = serve_directory(tmp_path)
+    try:
+        assert list(export.iter_orders(f"http://127.0.0.1:{server.server_port}/orders.jsonl")) == orders
+    finally:
+        server.shutdown()
+
+
+def test_line_without_parent_order_is_an_error(tmp_path):
+    orphan = {"product": {"id": "gid://shopify/Product/104"}, "__parentId": "gid://shopify/Order/9"}
+    (tmp_path / 'orders.jsonl').write_text('\n'.join(json.dumps(r) for r in CANNED_JSONL + [orphan]))
+    server = serve_directory(tmp_path)
+    try:
+        list(BulkOrderExport(FakeGraphQLHelper(None)).iter_orders(f"http://127.0.0.1:{server.server_port}/orders.jsonl"))
+    except BulkOperationError as e:
+        assert "1 ligne(s)" in str(e)
+    else:
+        raise AssertionError("Une ligne sans commande parente doit lever BulkOperationError")
+    finally:
+        server.shutdown()
+
+
+def test_bulk_download_reports_its_status(tmp_path):
+    class Telemetry:
+        def record_request(self, kind, status, seconds, size=0):
+            self.status = status
+
+    server = serve_directory(tmp_path)
+    helper = FakeGraphQLHelper(None)
+    helper.telemetry = Telemetry()
+    try:
+        try:
+            list(BulkOrderExport(helper).iter_lines(f"http://127.0.0.1:{server.server_port}/absent.jsonl"))
+        except requests.HTTPError:
+            pass
+        else:
+            raise AssertionError("Un fichier absent doit lever HTTPError")
+    finally:
+        server.shutdown()
+    assert helper.telemetry.status == 404
+
+
+def test_bulk_export_failed_operation():
+    helper = FakeGraphQLHelper(None, final_status='FAILED')
+    try:
+        BulkOrderExport(helper, poll_interval=0).run()
+    except BulkOperationError:
+        pass
+    else:
+        raise AssertionError("Une opération FAILED doit lever BulkOperationError")
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_bulk_export_builds_purchase_index(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_bulk_export_groups_line_items_by_order(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_line_without_parent_order_is_an_error(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_bulk_download_reports_its_status(Path(tmp))
+    test_bulk_export_failed_operation()
+    print("✓ Export bulk OK")
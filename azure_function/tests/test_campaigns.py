@@ -0,0 +1,103 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+from datetime import datetime
+
+import pytest
+
+from core.campaigns import Campaign, CampaignEngine, load_campaigns, merge_recommendations
+from core.purchase_index import CustomerInfo
+
+TODAY = datetime(2026, 10, 18)
+LOUIS = Campaign('Louis', 1, delay_start=365, delay_end=548)
+FORGES = Campaign('Forgés', 2, delay_start=0, delay_end=30)
+COLLECTIONS = {1: [10, 11, 12, 13], 2: [20, 21, 10]}
+
+
+def customer(customer_id):
+    return CustomerInfo(customer_id, None, None, None)
+
+
+PURCHASES = [
+    # Achat Louis il y a ~14 mois : éligible Louis
+    (customer(100), '2025-08-01T10:00:00+02:00', [10, 99]),
+    # Achat Louis trop récent pour Louis, mais produit 10 aussi dans Forgés : éligible Forgés
+    (customer(101), '2026-10-10T10:00:00+02:00', [10]),
+    # Achat hors collections
+    (customer(102), '2025-08-01T10:00:00+02:00', [99]),
+    # Client éligible aux deux campagnes
+    (customer(103), '2025-08-02T10:00:00+02:00', [11]),
+    (customer(103), '2026-10-01T10:00:00+02:00', [20, 12]),
+    (None, '2025-08-01T10:00:00+02:00', [10]),
+]
+
+
+def test_single_pass_matches_all_campaigns():
+    louis, forges = CampaignEngine([LOUIS, FORGES], COLLECTIONS, today=TODAY, ranking="collection").run(PURCHASES)
+
+    assert louis.eligible_count == 2
+    assert louis.recommendations == {100: [11, 12, 13], 103: [10, 13]}
+    assert forges.eligible_count == 2
+    assert forges.recommendations == {101: [20, 21], 103: [21, 10]}
+
+
+def test_first_campaign_wins_when_merging():
+    results = CampaignEngine([LOUIS, FORGES], COLLECTIONS, today=TODAY, ranking="collection").run(PURCHASES)
+    recommendations, origins = merge_recommendations(results)
+    assert recommendations[103] == [10, 13]
+    assert origins == {100: 'Louis', 103: 'Louis', 101: 'Forgés'}
+
+
+def test_customer_owning_whole_collection_is_counted():
+    purchases = [(customer(1), '2026-10-01T10:00:00Z', [20, 21, 10])]
+    (result,) = CampaignEngine([FORGES], COLLECTIONS, today=TODAY).run(purchases)
+    assert result.recommendations == {}
+    assert result.complete_count == 1
+
+
+def test_previous_recommendations_are_not_repeated():
+    loaded = []
+
+    def load_previous(customer_ids):
+        loaded.append(set(customer_ids))
+        return {100: (11, 12), 101: (20, 21)}
+
+    for ranking in ("collection", "affinity"):
+        louis, forges = CampaignEngine([LOUIS, FORGES], COLLECTIONS, today=TODAY,
+                                       ranking=ranking).run(PURCHASES, load_previous=load_previous)
+        assert louis.recommendations[100] == [13]
+        assert louis.previous == {100: (11, 12)}
+        # Toute la collection Forgés déjà possédée ou recommandée
+        assert 101 not in forges.recommendations
+        assert forges.complete_count == 1
+    assert loaded[0] == {100, 101, 103}
+
+
+def test_load_campaigns_from_inline_json_and_file(tmp_path, monkeypatch):
+    inline = json.dumps([{'name': 'Louis', 'collection_id': '299133665432', 'delay_start': 365}])
+    assert load_campaigns(inline) == [Campaign('Louis', 299133665432, 365, 548)]
+
+    monkeypatch.delenv("CROSS_SELL_CAMPAIGNS", raising=False)
+    monkeypatch.setenv("TARGET_COLLECTION_ID", "298781474968")
+    monkeypatch.setenv("ORDER_DELAY_DAYS_START", "180")
+    assert load_campaigns() == [Campaign('default', 298781474968, 180, 548)]
+
+    # Ni CROSS_SELL_CAMPAIGNS ni TARGET_COLLECTION_ID : pas de campagne implicite
+    monkeypatch.delenv("TARGET_COLLECTION_ID")
+    with pytest.raises(ValueError):
+        load_campaigns()
+
+    path = tmp_path / 'campaigns.json'
+    path.write_text(json.dumps([{'collection_id': 5, 'max_recommendations': 2}]))
+    monkeypatch.setenv("CROSS_SELL_CAMPAIGNS", str(path))
+    assert load_campaigns() == [Campaign('5', 5, max_recommendations=2)]
+
+
+if __name__ == "__main__":
+    test_single_pass_matches_all_campaigns()
+    test_first_campaign_wins_when_merging()
+    test_customer_owning_whole_collection_is_counted()
+    test_previous_recommendations_are_not_repeated()
+    print("✓ CampaignEngine OK")
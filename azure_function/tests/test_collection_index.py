@@ -0,0 +1,103 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import threading
+from unittest import mock
+
+from core.collection_index import CollectionIndex
+
+
+class FakeCollectionsHelper:
+    """Sert une collection de 600 produits en pages de 250, comme collection.products."""
+
+    def __init__(self, product_count=600, page_size=250):
+        self.product_ids = list(range(1000, 1000 + product_count))
+        self.page_size = page_size
+        self.calls = []
+
+    def graphql(self, query, variables=None, cost=10):
+        self.calls.append(variables)
+        if variables['id'] != "gid://shopify/Collection/42":
+            return {'collection': None}
+        start = int(variables['cursor'] or 0)
+        page = self.product_ids[start:start + self.page_size]
+        end = start + len(page)
+        return {'collection': {'products': {
+            'pageInfo': {'hasNextPage': end < len(self.product_ids), 'endCursor': str(end)},
+            'nodes': [{'id': f"gid://shopify/Product/{pid}"} for pid in page],
+        }}}
+
+
+def test_pages_through_all_products_once():
+    helper = FakeCollectionsHelper()
+    index = CollectionIndex(helper)
+
+    product_ids = index.product_ids(42)
+    assert product_ids == tuple(helper.product_ids)
+    assert [call['cursor'] for call in helper.calls] == [None, '250', '500']
+
+    assert isinstance(index.members('42'), frozenset)
+    assert 1599 in index.members(42)
+    assert len(helper.calls) == 3
+    assert index.fetch_count == 1
+
+
+def test_ttl_expiry_and_invalidate():
+    helper = FakeCollectionsHelper(product_count=10)
+    index = CollectionIndex(helper, ttl=60)
+    with mock.patch('core.collection_index.time.monotonic', return_value=0.0):
+        index.get(42)
+    with mock.patch('core.collection_index.time.monotonic', return_value=59.0):
+        index.get(42)
+    assert index.fetch_count == 1
+    with mock.patch('core.collection_index.time.monotonic', return_value=61.0):
+        index.get(42)
+    assert index.fetch_count == 2
+
+    index.invalidate(42)
+    index.get(42)
+    assert index.fetch_count == 3
+
+
+def test_unknown_collection_is_empty():
+    index = CollectionIndex(FakeCollectionsHelper())
+    assert index.product_ids(7) == ()
+    assert index.members(7) == frozenset()
+
+
+def test_slow_collection_does_not_block_the_others():
+    helper = FakeCollectionsHelper(product_count=10)
+    fetching, release = threading.Event(), threading.Event()
+    graphql = helper.graphql
+
+    def slow_graphql(query, variables=None, cost=10):
+        if variables['id'].endswith('/42'):
+            fetching.set()
+            release.wait(5)
+        return graphql(query, variables, cost)
+
+    helper.graphql = slow_graphql
+    index = CollectionIndex(helper)
+    readers = [threading.Thread(target=index.get, args=(42,)) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    assert fetching.wait(5)
+    # 42 est en cours de lecture : une autre collection est servie sans attendre
+    other = threading.Thread(target=index.get, args=(7,))
+    other.start()
+    other.join(1)
+    blocked = other.is_alive()
+    release.set()
+    for reader in readers + [other]:
+        reader.join()
+    assert not blocked
+    assert index.product_ids(42) == tuple(helper.product_ids)
+    assert index.fetch_count == 2
+
+if __name__ == "__main__":
+    test_pages_through_all_products_once()
+    test_ttl_expiry_and_invalidate()
+    test_unknown_collection_is_empty()
+    test_slow_collection_does_not_block_the_others()
+    print("✓ CollectionIndex OK")
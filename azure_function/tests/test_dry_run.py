@@ -0,0 +1,84 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import csv
+import json
+from unittest import mock
+
+from core.shopify_helper import ShopifyHelper
+
+
+class ReadOnlyShop:
+    """Répond aux lectures nodes(ids:) ; toute mutation fait échouer le test."""
+
+    def __init__(self, current):
+        self.current = current
+        self.queries = 0
+
+    def graphql(self, query, variables=None, cost=10):
+        assert 'mutation' not in query, "écriture envoyée pendant un run à blanc"
+        self.queries += 1
+        nodes = []
+        for gid in variables['ids']:
+            customer_id = int(gid.rsplit('/', 1)[-1])
+            value = self.current.get(customer_id)
+            nodes.append({'id': gid, 'current': {'value': value} if value else None, 'history': None})
+        return {'nodes': nodes}
+
+
+def test_dry_run_writes_jsonl_artifact_and_skips_matching_values(tmp_path):
+    path = tmp_path / "plan.jsonl"
+    helper = ShopifyHelper("test.myshopify.com", access_token="x", dry_run=True, dry_run_path=str(path))
+    shop = ReadOnlyShop({1: "10,11", 2: "99"})
+    recommendations = {cid: [cid * 10, cid * 10 + 1] for cid in range(1, 251)}
+
+    with mock.patch.object(helper, 'graphql', side_effect=shop.graphql):
+        report = helper.update_customers_recommendations(recommendations, history={2: (5,)}, origins={1: 'Louis'})
+
+    assert report.artifact == str(path)
+    # Lectures par lots de 100 clients
+    assert shop.queries == 3
+    assert len(report.succeeded) == 250 and not report.failed
+    assert [r.customer_id for r in report.skipped] == [1]
+
+    rows = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert len(rows) == 250
+    assert rows[0]['action'] == 'unchanged' and rows[0]['campaign'] == 'Louis' and rows[0]['tag'] is None
+    assert rows[1] == {
+        'customer_id': 2, 'campaign': None, 'action': 'update', 'metafield': 'cross_sell.next_recommendations',
+        'current_value': '99', 'planned_value': '20,21', 'planned_history': '[5, 20, 21]', 'tag': 'trigger_reco',
+    }
+
+
+def test_dry_run_csv_artifact(tmp_path):
+    path = tmp_path / "plan.csv"
+    helper = ShopifyHelper("test.myshopify.com", access_token="x", dry_run=True, dry_run_path=str(path))
+    with mock.patch.object(helper, 'graphql', side_effect=ReadOnlyShop({}).graphql):
+        helper.update_customers_recommendations({7: [1, 2, 3, 4]})
+    with open(path, encoding='utf-8') as f:
+        (row,) = list(csv.DictReader(f))
+    assert row['planned_value'] == "1,2,3" and row['action'] == 'update'
+
+
+
+def test_single_customer_updates_accumulate_in_the_artifact(tmp_path):
+    path = tmp_path / "plan.jsonl"
+    helper = ShopifyHelper("test.myshopify.com", access_token="x", dry_run=True, dry_run_path=str(path))
+    shop = ReadOnlyShop({8: "3,4"})
+    with mock.patch.object(helper, 'graphql', side_effect=shop.graphql), \
+            mock.patch.object(helper, '_request', side_effect=AssertionError("appel REST en run à blanc")):
+        assert helper.update_customer_recommendations(7, [1, 2])
+        assert helper.update_customer_recommendations(8, [3, 4])
+
+    rows = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [(row['customer_id'], row['action'], row['planned_value']) for row in rows] == [
+        (7, 'update', '1,2'), (8, 'unchanged', '3,4')]
+
+if __name__ == "__main__":
+    import tempfile
+    for test in (test_dry_run_writes_jsonl_artifact_and_skips_matching_values,
+                 test_dry_run_csv_artifact, test_single_customer_updates_accumulate_in_the_artifact):
+        with tempfile.TemporaryDirectory() as directory:
+            test(Path(directory))
+    print("✓ Run à blanc OK")
@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+import pytest
+
+from core.throttle import ShopifyThrottle
+from tests.fake_admin_api import FakeAdminAPI
+from tests.synthetic_shop import generate_shop
+
+# 3000 commandes : 12 pages REST de 250
+SHOP_SPEC = dict(orders=3000, customers=600, products=120, collections=4, seed=7)
+
+
+def test_synthetic_shop_is_deterministic_and_skewed(shop):
+    other = generate_shop(**SHOP_SPEC)
+    assert (other.line_item_products == shop.line_item_products).all()
+    # 10 % des produits concentrent une grande partie des ventes
+    _, counts = np.unique(shop.line_item_products, return_counts=True)
+    assert np.sort(counts)[-12:].sum() > 0.3 * counts.sum()
+
+
+def test_rest_pagination_follows_link_headers(shop, api, make_helper):
+    with make_helper(api) as helper:
+        orders = list(helper.iter_orders())
+    assert [o.id for o in orders] == [int(i) for i in shop.order_ids]
+    assert api.calls['rest:orders'] == 12  # 3000 commandes / 250
+
+
+def test_collection_products_through_graphql(shop, api, make_helper):
+    collection_id = int(shop.collection_ids[0])
+    with make_helper(api) as helper:
+        assert helper.get_collection_products(collection_id) == tuple(int(p) for p in shop.collections[collection_id])
+        helper.get_collection_products(collection_id)
+    assert api.calls['graphql:collection'] == 1
+
+
+def test_rest_and_bulk_build_the_same_index(shop, api, make_helper):
+    collection_id = int(shop.collection_ids[1])
+    with make_helper(api) as helper:
+        rest = helper.build_purchase_index(days_start=0, days_end=365, collection_id=collection_id)
+        bulk = helper.build_purchase_index_bulk(days_start=0, days_end=365, collection_id=collection_id)
+    assert rest.order_count == bulk.order_count > 0
+    assert [c.id for c in rest.eligible_customers()] == [c.id for c in bulk.eligible_customers()]
+    customer_id = rest.eligible_customers()[0].id
+    assert rest.history(customer_id) == bulk.history(customer_id)
+    assert api.calls['bulk:download'] == 1
+
+
+def test_writes_then_reads_back_recommendations(shop, api, make_helper):
+    customers = [int(c) for c in shop.customer_ids[:30]]
+    with make_helper(api) as helper:
+        report = helper.update_customers_recommendations({cid: [1, 2, 3] for cid in customers},
+                                                         history={customers[0]: (9,)})
+        previous = helper.get_previous_recommendations(customers)
+    assert len(report.succeeded) == 30
+    assert api.calls['graphql:metafieldsSet'] == 2
+    assert previous[customers[0]] == (9, 1, 2, 3)
+    assert previous[customers[1]] == (1, 2, 3)
+    assert 'trigger_reco' in shop.tags[customers[1]]
+
+
+def test_rest_call_limit_and_429_are_honoured(shop, make_helper):
+    with FakeAdminAPI(shop, rest_bucket_size=4, rest_leak_rate=40) as api:
+        throttle = ShopifyThrottle(rest_leak_rate=40, base_delay=0.01)
+        with make_helper(api, throttle=throttle) as helper:
+            orders = list(helper.iter_order_pages(page_size=100))
+            assert throttle.rest_bucket_size == 4
+
+            # Seau plein côté serveur (autre client) : 429 + Retry-After, puis reprise
+            api.rest_bucket.fill()
+            assert helper._request('GET', 'products.json').status_code == 200
+    assert sum(len(page) for page in orders) == 3000
+    assert api.calls['rest:orders'] == 30
+    assert api.calls['rest:429'] == 1 and throttle.throttled_count == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
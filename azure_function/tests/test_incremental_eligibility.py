@@ -0,0 +1,101 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from datetime import datetime, timedelta
+
+from core.campaigns import Campaign, CampaignEngine
+from core.order_cache import OrderCache
+from core.purchase_index import CustomerInfo
+from core.run_journal import RunJournal
+
+TODAY = datetime(2026, 10, 18)
+LOUIS = Campaign('louis', 10, delay_start=365, delay_end=548)
+COLLECTIONS = {10: [1, 2, 3]}
+
+
+def day(days_ago, today=TODAY):
+    return (today - timedelta(days=days_ago)).strftime('%Y-%m-%d')
+
+
+def purchases():
+    """Un client par jour d'achat du produit 1, de 360 à 560 jours avant TODAY."""
+    return [(CustomerInfo(days, None, None, None), f"{day(days)}T10:00:00+02:00", [1]) for days in range(360, 561)]
+
+
+def eligible(today, since=None, campaign=LOUIS):
+    since = {campaign.name: since} if since else None
+    engine = CampaignEngine([campaign], COLLECTIONS, today=today, ranking='collection', since=since)
+    result, = engine.run(purchases())
+    return set(result.recommendations)
+
+
+def test_window_slice():
+    assert LOUIS.window(TODAY) == (day(548), day(365))
+    # Run réussi la veille : seul le jour entré dans la fenêtre
+    assert LOUIS.window(TODAY, since=day(1)) == (day(365), day(365))
+    # Trois runs manqués : les quatre jours entrés depuis le dernier run réussi
+    assert LOUIS.window(TODAY, since=day(4)) == (day(368), day(365))
+    # Dernier run plus ancien que la fenêtre : fenêtre complète
+    assert LOUIS.window(TODAY, since=day(400)) == (day(548), day(365))
+    # Déjà traité aujourd'hui : tranche vide
+    start, end = LOUIS.window(TODAY, since=day(0))
+    assert start > end
+
+
+def test_each_customer_is_processed_once_across_nights():
+    full = eligible(TODAY - timedelta(days=10))
+    processed = [full]
+    for night in range(9, -1, -1):
+        today = TODAY - timedelta(days=night)
+        processed.append(eligible(today, since=day(night + 1)))
+
+    assert all(len(customers) == 1 for customers in processed[1:])
+    seen = set()
+    for customers in processed:
+        assert not seen & customers
+        seen |= customers
+    # Tous les clients entrés dans la fenêtre pendant ces nuits, une seule fois chacun
+    assert seen == full | set(range(365, 375))
+
+
+def test_missed_runs_are_backfilled():
+    nightly = set()
+    for night in range(3, -1, -1):
+        nightly |= eligible(TODAY - timedelta(days=night), since=day(night + 1))
+    # Trois nuits manquées : le run du jour rattrape exactement les mêmes clients
+    assert eligible(TODAY, since=day(4)) == nightly == set(range(365, 369))
+
+
+def test_watermarks_advance_per_campaign(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.sqlite"))
+    assert journal.eligibility_watermarks() == {}
+    run = journal.begin(day(1))
+    journal.advance_eligibility(run, ['louis', 'marie'], day(1))
+    run = journal.begin(day(0))
+    journal.advance_eligibility(run, ['louis'], day(0))
+    assert journal.eligibility_watermarks() == {'louis': day(0), 'marie': day(1)}
+    journal.close()
+
+
+def test_due_recommendations_since(tmp_path):
+    cache = OrderCache(str(tmp_path / "cache.sqlite"))
+    cache.replace_due(7, [('louis', day(10), day(-100), [2, 3])])
+    cache.replace_due(8, [('louis', day(0), day(-180), [3])])
+    today = day(0)
+    assert cache.due_recommendations(today) == {'louis': {7: [2, 3], 8: [3]}}
+    assert cache.due_recommendations(today, since={'louis': day(1)}) == {'louis': {8: [3]}}
+    # Campagne sans dernier jour traité : tous les clients dus
+    assert cache.due_recommendations(today, since={'marie': day(1)}) == {'louis': {7: [2, 3], 8: [3]}}
+    cache.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_window_slice()
+    test_each_customer_is_processed_once_across_nights()
+    test_missed_runs_are_backfilled()
+    with tempfile.TemporaryDirectory() as directory:
+        test_watermarks_advance_per_campaign(Path(directory))
+        test_due_recommendations_since(Path(directory))
+    print("OK")
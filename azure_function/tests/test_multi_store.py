@@ -0,0 +1,109 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+
+import pytest
+
+from core.run_journal import RunJournal, default_journal_path
+from core.scanner import ScanOptions, scan_stores, store_dry_run_path
+from core.stores import StoreConfig, find_store, load_store_configs
+from core.write_queue import decode_message, iter_messages, message_store
+from tests.fake_admin_api import FakeAdminAPI
+from tests.synthetic_shop import generate_shop
+
+
+def store_config(name, api, shop):
+    campaigns = [{'name': f'{name}-a', 'collection_id': int(shop.collection_ids[0]), 'delay_start': 60,
+                  'delay_end': 400}]
+    return StoreConfig(name, api.store_url, access_token="t", base_url=api.base_url,
+                       campaigns_source=json.dumps(campaigns))
+
+
+def test_store_configs_from_env():
+    environ = {
+        "CROSS_SELL_STORES": "tb-outdoor, tb1648",
+        "TB_OUTDOOR_SHOPIFY_STORE_URL": "tb-outdoor.myshopify.com",
+        "TB_OUTDOOR_SHOPIFY_ACCESS_TOKEN": "shpat_1",
+        "TB1648_SHOPIFY_STORE_URL": "tb1648.myshopify.com",
+        "TB1648_SHOPIFY_CLIENT_ID": "id",
+        "TB1648_SHOPIFY_CLIENT_SECRET": "secret",
+        "TB1648_SHOPIFY_WEBHOOK_SECRET": "hook",
+        "TB_OUTDOOR_CROSS_SELL_CAMPAIGNS": "outdoor.json",
+        "TB1648_CROSS_SELL_CAMPAIGNS": "tb1648.json",
+    }
+    outdoor, tb1648 = load_store_configs(environ)
+    assert (outdoor.name, outdoor.store_url, outdoor.access_token) == ("tb-outdoor", "tb-outdoor.myshopify.com", "shpat_1")
+    assert tb1648.has_credentials() and tb1648.webhook_secret == "hook" and tb1648.access_token is None
+    assert (outdoor.campaigns_source, tb1648.campaigns_source) == ("outdoor.json", "tb1648.json")
+    assert find_store([outdoor, tb1648], store_url="tb1648.myshopify.com") is tb1648
+
+    # Multi-boutiques : une boutique sans ses propres campagnes n'hérite pas des campagnes globales
+    del environ["TB1648_CROSS_SELL_CAMPAIGNS"]
+    environ["TARGET_COLLECTION_ID"] = "42"
+    with pytest.raises(ValueError, match="tb1648"):
+        load_store_configs(environ)
+
+    # Sans CROSS_SELL_STORES : la boutique unique des variables historiques
+    default, = load_store_configs({"SHOPIFY_STORE_URL": "shop.myshopify.com", "SHOPIFY_ACCESS_TOKEN": "x"})
+    assert default.name == "default" and default.has_credentials()
+
+
+def test_queue_messages_carry_their_store():
+    _, body = next(iter_messages({1: [10]}, origins={1: 'a'}, store='tb1648'))
+    assert message_store(body) == 'tb1648'
+    assert decode_message(body) == ({1: [10]}, None, {1: 'a'})
+    # Messages déposés avant le multi-boutiques : pas d'enveloppe
+    _, body = next(iter_messages({1: [10]}))
+    assert message_store(body) is None and decode_message(body)[0] == {1: [10]}
+
+
+def test_dry_run_artifact_per_store():
+    assert store_dry_run_path("/tmp/plan.jsonl", "tb1648", 2) == "/tmp/plan-tb1648.jsonl"
+    assert store_dry_run_path("/tmp/plan.jsonl", "default", 1) == "/tmp/plan.jsonl"
+    assert store_dry_run_path(None, "tb1648", 2) is None
+
+
+def test_stores_are_scanned_in_parallel_into_one_report(tmp_path, monkeypatch):
+    monkeypatch.setenv("CROSS_SELL_CACHE_DIR", str(tmp_path))
+    outdoor_shop = generate_shop(orders=800, customers=150, products=40, collections=2, seed=21)
+    tb1648_shop = generate_shop(orders=600, customers=120, products=30, collections=2, seed=22)
+    options = ScanOptions(ranking='collection', eligibility_mode='incremental', write_workers=2)
+
+    with FakeAdminAPI(outdoor_shop, store_url='tb-outdoor.myshopify.com') as outdoor_api, \
+            FakeAdminAPI(tb1648_shop, store_url='tb1648.myshopify.com') as tb1648_api:
+        stores = [store_config('tb-outdoor', outdoor_api, outdoor_shop),
+                  store_config('tb1648', tb1648_api, tb1648_shop),
+                  StoreConfig('sans-token', 'missing.myshopify.com')]
+        report = scan_stores(stores, options)
+        outdoor_writes = outdoor_api.calls['graphql:metafieldsSet']
+        tb1648_writes = tb1648_api.calls['graphql:metafieldsSet']
+
+    outdoor, tb1648, missing = report.stores
+    assert [r.store for r in report.stores] == ['tb-outdoor', 'tb1648', 'sans-token']
+    for store_report, shop, writes in ((outdoor, outdoor_shop, outdoor_writes), (tb1648, tb1648_shop, tb1648_writes)):
+        assert store_report.error is None and store_report.remaining == 0
+        assert store_report.written == store_report.planned > 0 and writes > 0
+        tagged = [customer_id for customer_id, tags in shop.tags.items() if 'trigger_reco' in tags]
+        assert len(tagged) == store_report.planned
+    # Une boutique mal configurée n'empêche pas les autres
+    assert missing.error and report.failed_stores == [missing]
+    assert report.total('written') == outdoor.written + tb1648.written
+    assert "3 boutique(s)" in report.summary()
+
+    # Journal et watermark d'éligibilité propres à chaque boutique
+    for store in stores[:2]:
+        journal = RunJournal(default_journal_path(store.store_url))
+        assert set(journal.eligibility_watermarks()) == {f'{store.name}-a'}
+        journal.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_store_configs_from_env()
+    test_queue_messages_carry_their_store()
+    test_dry_run_artifact_per_store()
+    with tempfile.TemporaryDirectory() as directory, pytest.MonkeyPatch.context() as monkeypatch:
+        test_stores_are_scanned_in_parallel_into_one_report(Path(directory), monkeypatch)
+    print("OK")
@@ -0,0 +1,204 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import inspect
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from core import orchestration
+from core.campaigns import Campaign, merge_recommendations
+from core.recommendation_writer import WriteReport, WriteResult, parse_product_ids
+from core.shopify_helper import ShopifyHelper
+
+
+class FakeDurableContext:
+    """Contexte d'orchestration minimal : les activités sont exécutées en séquence, entrées et sorties passées par JSON.
+
+    call_activity_with_retry rejoue une activité qui lève, jusqu'au nombre de tentatives de ses RetryOptions.
+    """
+
+    def __init__(self, settings, helper_factory, store_factory):
+        self.settings = settings
+        self.helper_factory = helper_factory
+        self.store_factory = store_factory
+        self.instance_id = 'instance-1'
+        self.current_utc_datetime = datetime.now(timezone.utc)
+        self.is_replaying = False
+        self.outputs = {}
+        self.attempts = {}
+
+    def get_input(self):
+        return json.loads(json.dumps(self.settings))
+
+    def call_activity(self, name, payload):
+        return ('activity', name, json.dumps(payload), 1)
+
+    def call_activity_with_retry(self, name, retry_options, payload):
+        return ('activity', name, json.dumps(payload), retry_options.max_number_of_attempts)
+
+    def task_all(self, tasks):
+        return ('all', tasks)
+
+    def execute(self, task):
+        if task[0] == 'all':
+            return [self.execute(t) for t in task[1]]
+        _, name, payload, attempts = task
+        activity = getattr(orchestration, name)
+        # Chaque activité ne reçoit que les fabriques qu'elle déclare
+        factories = {key: value for key, value in (('helper_factory', self.helper_factory),
+                                                   ('store_factory', self.store_factory))
+                     if key in inspect.signature(activity).parameters}
+        for attempt in range(1, attempts + 1):
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            try:
+                result = activity(json.loads(payload), **factories)
+                break
+            except Exception:
+                if attempt == attempts:
+                    raise
+        self.outputs.setdefault(name, []).append(result)
+        return json.loads(json.dumps(result))
+
+
+def drive(context):
+    """Déroule l'orchestrateur ; l'échec d'une activité est renvoyé dans le générateur, comme le fait Durable."""
+    generator = orchestration.orchestrate(context)
+    result, error = None, None
+    try:
+        while True:
+            task = generator.throw(error) if error is not None else generator.send(result)
+            try:
+                result, error = context.execute(task), None
+            except Exception as e:
+                result, error = None, e
+    except StopIteration as stop:
+        return stop.value
+
+
+@pytest.fixture
+def campaigns(shop):
+    return [
+        Campaign('a', int(shop.collection_ids[0]), delay_start=30, delay_end=200),
+        Campaign('b', int(shop.collection_ids[1]), delay_start=100, delay_end=400, max_recommendations=2),
+    ]
+
+
+def test_date_shards_are_contiguous():
+    shards = orchestration.date_shards('2026-10-18', 4, 10, open_start=False)
+    assert shards == [['2026-10-08', '2026-10-09'], ['2026-10-10', '2026-10-12'],
+                      ['2026-10-13', '2026-10-15'], ['2026-10-16', '2026-10-18']]
+    assert orchestration.date_shards('2026-10-18', 3, 548)[0][0] is None
+    assert len(orchestration.date_shards('2026-10-18', 10, 2)) == 3
+
+
+def test_sharded_orchestration_matches_serial_scan(shop, api, campaigns, tmp_path):
+    def helper_factory(settings):
+        return ShopifyHelper(api.store_url, access_token="test", base_url=api.base_url,
+                             dry_run=settings['dry_run'],
+                             dry_run_path=orchestration.chunk_dry_run_path(settings['dry_run_path'],
+                                                                           settings.get('chunk_index')))
+
+    with helper_factory({'dry_run': True, 'dry_run_path': None}) as helper:
+        serial, _ = merge_recommendations(helper.run_campaigns(campaigns))
+
+    settings = orchestration.orchestration_settings(campaigns, shard_count=5, write_chunk_size=100, dry_run=True,
+                                                    dry_run_path=str(tmp_path / "plan.jsonl"))
+    settings['today'] = datetime.now().strftime('%Y-%m-%d')
+    payloads = orchestration.FilePayloadStore(str(tmp_path / "payloads"))
+    context = FakeDurableContext(settings, helper_factory, lambda settings: payloads)
+    report = drive(context)
+
+    planned = {}
+    for artifact in tmp_path.glob("plan-*.jsonl"):
+        for line in artifact.read_text(encoding='utf-8').splitlines():
+            row = json.loads(line)
+            planned[row['customer_id']] = parse_product_ids(row['planned_value'])
+    assert planned == serial
+    assert len(context.outputs['scan_order_shard']) == report['shards'] == 5
+    assert report['orders'] == sum(1 for customer in shop.order_customer if customer >= 0)
+    assert report['write_chunks'] == -(-len(serial) // 100)
+    assert report['succeeded'] == len(serial) and report['failed'] == []
+    # Un artefact par activité d'écriture, aucune écriture réelle
+    assert len(report['artifacts']) == report['write_chunks'] == len(list(tmp_path.glob("plan-*.jsonl")))
+    assert api.calls['graphql:metafieldsSet'] == 0
+
+
+def test_histories_and_plan_go_through_the_payload_store(api, campaigns, tmp_path):
+    shares = []
+
+    def helper_factory(settings):
+        if 'shard' in settings:
+            shares.append(settings['rest_share'])
+        return ShopifyHelper(api.store_url, access_token="test", base_url=api.base_url, dry_run=True,
+                             dry_run_path=str(tmp_path / f"plan-{settings.get('chunk_index')}.jsonl"))
+
+    settings = orchestration.orchestration_settings(campaigns, shard_count=4, write_chunk_size=50, dry_run=True,
+                                                    store='tb1648')
+    settings['today'] = datetime.now().strftime('%Y-%m-%d')
+    payloads = orchestration.FilePayloadStore(str(tmp_path / "payloads"))
+    stored = []
+    put = payloads.put
+    payloads.put = lambda name, payload: stored.append(len(json.dumps(payload))) or put(name, payload)
+    context = FakeDurableContext(settings, helper_factory, lambda settings: payloads)
+    report = drive(context)
+
+    assert report['store'] == 'tb1648' and report['succeeded'] > 0
+    # Sorties des tranches et du classement : des références, pas les historiques ni le plan
+    returned = [len(json.dumps(result)) for name in ('scan_order_shard', 'rank_campaigns')
+                for result in context.outputs[name]]
+    assert sum(stored) > 20 * sum(returned)
+    assert context.outputs['scan_order_shard'][0]['partial'] == 'instance-1/partial-000.json'
+    # Tranches supprimées après fusion, morceaux après écriture
+    assert not list((tmp_path / "payloads").rglob("*.json"))
+    # Tranches en parallèle sur la même boutique : le seau REST est partagé entre elles
+    assert shares == [1 / 4] * 4
+
+
+def test_failed_activity_is_retried_then_run_payloads_are_deleted(api, campaigns, tmp_path):
+    def helper_factory(settings):
+        if 'chunk' in settings:
+            raise ConnectionError("Shopify injoignable")
+        return ShopifyHelper(api.store_url, access_token="test", base_url=api.base_url, dry_run=True,
+                             dry_run_path=str(tmp_path / "plan.jsonl"))
+
+    settings = orchestration.orchestration_settings(campaigns, shard_count=3, write_chunk_size=50, dry_run=True,
+                                                    activity_attempts=2)
+    settings['today'] = datetime.now().strftime('%Y-%m-%d')
+    payloads = orchestration.FilePayloadStore(str(tmp_path / "payloads"))
+    context = FakeDurableContext(settings, helper_factory, lambda settings: payloads)
+    with pytest.raises(ConnectionError):
+        drive(context)
+
+    assert context.attempts['write_recommendation_chunk'] == 2
+    assert context.outputs['rank_campaigns'][0]['chunks']
+    # Morceaux du plan restés après l'échec : supprimés avec le run
+    assert context.outputs['delete_run_payloads'] == ['instance-1']
+    assert not list((tmp_path / "payloads").rglob("*.json"))
+
+
+def test_written_chunk_is_deleted_even_with_failed_customers(tmp_path):
+    class FailingHelper:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+        def update_customers_recommendations(self, recommendations, **kwargs):
+            report = WriteReport()
+            report.results = [WriteResult(customer_id, False, error="refusé") for customer_id in recommendations]
+            return report
+
+    payloads = orchestration.FilePayloadStore(str(tmp_path))
+    chunk = payloads.put('run/chunk-000.json', {'recommendations': [[1, [10]]], 'origins': [[1, 'a']], 'history': []})
+    report = orchestration.write_recommendation_chunk({'chunk': chunk}, helper_factory=lambda settings: FailingHelper(),
+                                                      store_factory=lambda settings: payloads)
+    assert report['failed'] == [[1, 'a', "refusé"]]
+    assert not (tmp_path / 'run' / 'chunk-000.json').exists()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
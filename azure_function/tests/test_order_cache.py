@@ -0,0 +1,102 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.order_cache import OrderCache
+from core.purchase_index import CustomerInfo, PurchaseIndex
+
+ALICE = CustomerInfo(1, 'Alice', 'Martin', 'alice@example.com')
+BOB = CustomerInfo(2, 'Bob', 'Durand', 'bob@example.com')
+
+ORDERS = [
+    # (order_id, client, created_at, updated_at, produits)
+    (10, ALICE, '2024-03-01T10:00:00+01:00', '2024-03-01T10:00:00+01:00', [100, 200]),
+    (11, BOB, '2024-03-02T10:00:00+01:00', '2024-03-05T10:00:00+01:00', [300]),
+    (12, None, '2024-03-03T10:00:00+01:00', '2024-03-03T10:00:00+01:00', [100]),
+]
+
+
+class FakeShop:
+    """Source de commandes : renvoie celles modifiées depuis updated_at_min (inclus), comme l'API."""
+
+    def __init__(self, orders):
+        self.orders = list(orders)
+        self.calls = []
+
+    def fetch_orders(self, updated_at_min):
+        self.calls.append(updated_at_min)
+        return [o for o in self.orders if updated_at_min is None or o[3] >= updated_at_min]
+
+
+def test_incremental_sync_uses_watermark(tmp_path):
+    shop = FakeShop(ORDERS)
+    cache = OrderCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.sync(shop.fetch_orders) == 3
+    assert cache.watermark == '2024-03-05T10:00:00+01:00'
+
+    # Une commande modifiée (remboursement partiel, ajout d'article...) après le watermark
+    shop.orders.append((10, ALICE, '2024-03-01T10:00:00+01:00', '2024-03-06T10:00:00+01:00', [100, 400]))
+    assert cache.sync(shop.fetch_orders) == 2
+    assert shop.calls == [None, '2024-03-05T10:00:00+01:00']
+    assert cache.get_customer_purchase_history(1) == {100, 400}
+    cache.close()
+
+
+def test_watermark_survives_reopen(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = OrderCache(path)
+    cache.sync(FakeShop(ORDERS).fetch_orders, batch_size=1)
+    cache.close()
+
+    shop = FakeShop(ORDERS)
+    reopened = OrderCache(path)
+    reopened.sync(shop.fetch_orders)
+    assert shop.calls == ['2024-03-05T10:00:00+01:00']
+    reopened.close()
+
+
+def test_interrupted_sync_loses_no_order(tmp_path):
+    # Commandes renvoyées les plus récentes d'abord (ordre par défaut de l'API)
+    orders = [(100 + i, ALICE, f'2024-04-{i + 1:02d}T10:00:00+01:00', f'2024-04-{i + 1:02d}T10:00:00+01:00', [i])
+              for i in range(20)][::-1]
+
+    def crashing_fetch(updated_at_min):
+        for position, order in enumerate(FakeShop(orders).fetch_orders(updated_at_min)):
+            if position == 7:
+                raise ConnectionError("coupure réseau")
+            yield order
+
+    cache = OrderCache(str(tmp_path / 'cache.sqlite'))
+    try:
+        cache.sync(crashing_fetch, batch_size=5)
+    except ConnectionError:
+        pass
+    # Premier lot écrit, mais watermark inchangé : la reprise relit tout
+    assert cache.watermark is None
+    assert cache.sync(FakeShop(orders).fetch_orders, batch_size=5) == 20
+    assert cache.get_customer_purchase_history(1) == set(range(20))
+    assert cache.watermark == '2024-04-20T10:00:00+01:00'
+    cache.close()
+
+
+def test_eligibility_and_index_from_cache(tmp_path):
+    cache = OrderCache(str(tmp_path / 'cache.sqlite'))
+    cache.sync(FakeShop(ORDERS).fetch_orders)
+
+    assert cache.get_eligible_customers('2024-03-01', '2024-03-02') == [ALICE, BOB]
+    assert cache.get_eligible_customers('2024-03-01', '2024-03-31', target_product_ids=[300]) == [BOB]
+    assert cache.get_eligible_customers('2024-03-02', '2024-03-02', target_product_ids=[100]) == []
+
+    index = cache.build_purchase_index(PurchaseIndex('2024-03-01', '2024-03-31', [200]))
+    assert index.eligible_customers() == [ALICE]
+    assert index.history(2) == {300}
+    cache.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    for test in (test_incremental_sync_uses_watermark, test_watermark_survives_reopen, test_interrupted_sync_loses_no_order,
+                 test_eligibility_and_index_from_cache):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("✓ OrderCache OK")
@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from core.campaigns import Campaign
+from core.order_snapshot import OrderSnapshot, OrderSnapshotWriter, customers_path
+from core.purchase_index import CustomerInfo, PurchaseIndex
+from tests.fake_admin_api import FakeAdminAPI
+
+
+@pytest.fixture(scope="module")
+def purchases(shop, make_helper):
+    with FakeAdminAPI(shop) as api, make_helper(api) as helper:
+        return list(helper.iter_purchases())
+
+
+def test_vectorized_eligibility_matches_the_purchase_index(shop, tmp_path, purchases):
+    collection = [int(pid) for pid in shop.collections[int(shop.collection_ids[0])]]
+    days = sorted(created_at[:10] for _, created_at, _ in purchases)
+    date_start, date_end = days[len(days) // 4], days[len(days) // 2]
+
+    expected = PurchaseIndex(date_start, date_end, collection)
+    for customer, created_at, product_ids in purchases:
+        expected.add_order(customer.id, created_at, product_ids, customer=customer)
+
+    # Petits record batches : l'éligibilité est évaluée batch par batch puis dédoublonnée
+    with OrderSnapshot.write(str(tmp_path / "orders.arrow"), purchases, batch_size=1000) as snapshot:
+        assert len(snapshot.lines.to_batches()) > 1
+        assert snapshot.order_count == len(purchases)
+        assert snapshot.eligible_customers(date_start, date_end, collection) == expected.eligible_customers()
+        assert len(snapshot.eligible_customer_ids()) == len(expected)
+
+        index = snapshot.purchase_index()
+        customer = purchases[0][0]
+        assert index.history(customer.id) == expected.history(customer.id) == snapshot.purchase_history(customer.id)
+        assert sorted(index.customer_ids()) == sorted(expected.customer_ids())
+    assert Path(customers_path(str(tmp_path / "orders.arrow"))).exists()
+
+
+def test_orders_without_created_at_are_skipped_and_counted(tmp_path):
+    alice = CustomerInfo(1, 'Alice', 'Martin', 'alice@example.com')
+    writer = OrderSnapshotWriter(str(tmp_path / "orders.arrow"))
+    writer.add(alice, '2024-03-01T10:00:00+01:00', [100])
+    writer.add(alice, '', [200])
+    writer.add(alice, None, [300])
+    with writer.close() as snapshot:
+        assert writer.undated_count == 2
+        assert snapshot.order_count == 1
+        assert snapshot.purchase_history(1) == {100}
+
+
+@pytest.mark.parametrize("ranking", ["collection", "affinity"])
+def test_campaigns_on_the_snapshot_match_the_streaming_pass(shop, api, make_helper, tmp_path, ranking):
+    campaigns = [Campaign('a', int(shop.collection_ids[0]), delay_start=30, delay_end=300),
+                 Campaign('b', int(shop.collection_ids[1]), delay_start=100, delay_end=700)]
+    with make_helper(api) as helper:
+        expected = helper.run_campaigns(campaigns, ranking=ranking, exclude_previous=False)
+        results = helper.run_campaigns(campaigns, ranking=ranking, exclude_previous=False,
+                                       snapshot_path=str(tmp_path / "orders.arrow"))
+    for streamed, vectorized in zip(expected, results):
+        assert vectorized.eligible_count == streamed.eligible_count > 0
+        assert vectorized.recommendations == streamed.recommendations
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,89 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import base64
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.campaigns import Campaign
+from core.order_cache import OrderCache
+from core.order_webhook import due_campaign_results, handle_order_created, verify_webhook
+
+TODAY = datetime(2026, 10, 18)
+LOUIS = Campaign('louis', 10, delay_start=365, delay_end=548)
+
+
+def days_ago(days):
+    return (TODAY - timedelta(days=days)).strftime('%Y-%m-%dT10:00:00+02:00')
+
+
+def order(order_id, days, product_ids, customer_id=7):
+    return {
+        'id': order_id,
+        'created_at': days_ago(days),
+        'customer': {'id': customer_id, 'first_name': 'Léa', 'last_name': 'Martin', 'email': 'lea@example.com'},
+        'line_items': [{'product_id': pid} for pid in product_ids],
+    }
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = OrderCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_hmac_signature():
+    body = b'{"id": 1}'
+    signature = base64.b64encode(hmac.new(b"secret", body, hashlib.sha256).digest()).decode()
+    assert verify_webhook(body, signature, "secret")
+    assert not verify_webhook(body + b" ", signature, "secret")
+    assert not verify_webhook(body, signature, "autre")
+    assert not verify_webhook(body, None, "secret")
+
+
+def test_each_order_updates_the_customer_pending_recommendations(cache):
+    collections = {10: [1, 2, 3, 4]}
+    today = TODAY.strftime('%Y-%m-%d')
+
+    rows = handle_order_created(cache, order(100, 400, [1, 99]), [LOUIS], collections)
+    assert rows == [('louis', (TODAY - timedelta(days=35)).strftime('%Y-%m-%d'),
+                     (TODAY + timedelta(days=148)).strftime('%Y-%m-%d'), [2, 3, 4])]
+    result, = due_campaign_results(cache, [LOUIS], collections, today, ranking='collection')
+    assert result.recommendations == {7: [2, 3, 4]} and result.eligible_count == 1
+
+    # Nouvelle commande : le produit 2 sort des recommandations dès son achat
+    handle_order_created(cache, order(101, 0, [2]), [LOUIS], collections)
+    result, = due_campaign_results(cache, [LOUIS], collections, today, ranking='collection', previous={7: [3]})
+    assert result.recommendations == {7: [4]}
+
+    # Pas encore dû : commande trop récente pour la campagne
+    handle_order_created(cache, order(102, 10, [1], customer_id=8), [LOUIS], collections)
+    assert 8 not in due_campaign_results(cache, [LOUIS], collections, today, ranking='collection')[0].recommendations
+    # Commande anonyme : ignorée
+    assert handle_order_created(cache, {**order(103, 400, [1]), 'customer': None}, [LOUIS], collections) == []
+
+
+@pytest.mark.parametrize("ranking", ["collection", "affinity"])
+def test_due_customers_match_a_full_scan(shop, api, make_helper, tmp_path, ranking):
+    campaigns = [Campaign('a', int(shop.collection_ids[0]), delay_start=60, delay_end=240),
+                 Campaign('b', int(shop.collection_ids[1]), delay_start=200, delay_end=500)]
+    with make_helper(api) as helper:
+        expected = helper.run_campaigns(campaigns, ranking=ranking, exclude_previous=False)
+    cache = OrderCache(str(tmp_path / f"{ranking}.sqlite"))
+    with make_helper(api, cache=cache) as helper:
+        # Premier passage : tout le cache est synchronisé et chaque client recalculé
+        due = helper.run_due_campaigns(campaigns, ranking=ranking, exclude_previous=False)
+    cache.close()
+
+    for full, incremental in zip(expected, due):
+        assert incremental.eligible_count == full.eligible_count > 0
+        assert incremental.recommendations == full.recommendations
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
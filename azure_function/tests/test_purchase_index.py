@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.purchase_index import PurchaseIndex, CustomerInfo
+
+ORDERS = [
+    # (client, date, produits)
+    (1, '2024-01-10T09:00:00+01:00', [100, 200]),
+    (2, '2024-06-01T09:00:00+01:00', [300]),
+    (1, '2025-03-05T09:00:00+01:00', [200, 400]),
+    (3, '2024-06-15T09:00:00+01:00', [100]),
+    (None, '2024-06-15T09:00:00+01:00', [100]),
+]
+
+
+def build_index():
+    index = PurchaseIndex('2024-01-01', '2024-12-31', target_product_ids=[100, 101])
+    for customer_id, created_at, product_ids in ORDERS:
+        index.add_order(customer_id, created_at, product_ids)
+    return index.freeze()
+
+
+def test_history_is_answered_from_single_pass():
+    index = build_index()
+    assert index.history(1) == {100, 200, 400}
+    assert index.history(2) == {300}
+    assert index.history(42) == set()
+    assert index.has_purchased(1, 400)
+    assert not index.has_purchased(2, 100)
+    assert index.order_count == 4
+    assert len(index) == 3
+
+
+def test_eligibility_uses_window_and_target_products():
+    index = build_index()
+    # Le client 2 a commandé dans la fenêtre mais hors collection cible
+    assert [c.id for c in index.eligible_customers()] == [1, 3]
+
+
+def test_eligible_customer_keeps_given_info():
+    index = PurchaseIndex('2024-01-01', '2024-12-31')
+    index.add_order(7, '2024-02-01T00:00:00Z', [1], customer=CustomerInfo(7, 'Jean', 'Dupont', 'jean@example.com'))
+    assert index.freeze().eligible_customers()[0].email == 'jean@example.com'
+
+
+def test_frozen_index_is_read_only():
+    index = build_index()
+    try:
+        index.add_order(9, '2024-02-01T00:00:00Z', [1])
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("Un index figé ne doit plus accepter de commandes")
+
+
+if __name__ == "__main__":
+    test_history_is_answered_from_single_pass()
+    test_eligibility_uses_window_and_target_products()
+    test_eligible_customer_keeps_given_info()
+    test_frozen_index_is_read_only()
+    print("✓ PurchaseIndex OK")
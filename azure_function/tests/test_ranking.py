@@ -0,0 +1,84 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import random
+import time
+from datetime import datetime
+
+from core.campaigns import Campaign, CampaignEngine
+from core.purchase_index import CustomerInfo, PurchaseIndex
+from core.ranking import CoPurchaseRanker
+
+
+def build_index(histories):
+    index = PurchaseIndex()
+    for customer_id, product_ids in histories.items():
+        index.add_order(customer_id, '2025-01-01T00:00:00Z', product_ids)
+    return index.freeze()
+
+
+def test_missing_products_ranked_by_co_purchase():
+    index = build_index({
+        # 1 (couteau) est souvent acheté avec 3 (fusil), jamais avec 2
+        1: [1, 3], 2: [1, 3], 3: [1, 3, 4], 4: [2, 5], 5: [2, 5], 6: [2, 5],
+        # Clients à scorer
+        10: [1], 11: [2], 12: [1, 2, 3, 4, 5], 13: [99],
+    })
+    ranker = CoPurchaseRanker(index)
+    recommendations = ranker.rank([10, 11, 12, 13, 404], [2, 3, 4, 5], limit=2)
+
+    assert recommendations[10] == [3, 4]
+    assert recommendations[11] == [5, 3]
+    # Possède déjà toute la collection, ou inconnu
+    assert 12 not in recommendations and 404 not in recommendations
+    # Aucune affinité : popularité, puis ordre de la collection
+    assert recommendations[13] == [2, 3]
+
+
+def test_never_purchased_candidates_come_last_in_collection_order():
+    index = build_index({1: [1, 2], 2: [1]})
+    recommendations = CoPurchaseRanker(index).rank([2], [7, 2, 8], limit=3)
+    assert recommendations == {2: [2, 7, 8]}
+
+
+def test_chunks_give_same_result():
+    rng = random.Random(3)
+    histories = {cid: rng.sample(range(40), 4) for cid in range(500)}
+    index = build_index(histories)
+    candidates = list(range(0, 40, 2))
+    expected = CoPurchaseRanker(index).rank(list(histories), candidates, limit=3)
+    assert CoPurchaseRanker(index, chunk_size=37).rank(list(histories), candidates, limit=3) == expected
+
+
+def test_engine_uses_affinity_by_default():
+    today = datetime(2026, 10, 18)
+    campaign = Campaign('Louis', 1, delay_start=0, delay_end=30)
+    purchases = [
+        (CustomerInfo(cid, None, None, None), '2025-01-01T00:00:00Z', [10, 13]) for cid in range(1, 4)
+    ] + [(CustomerInfo(9, None, None, None), '2026-10-10T00:00:00Z', [10])]
+    (result,) = CampaignEngine([campaign], {1: [10, 11, 12, 13]}, today=today).run(purchases)
+    assert result.recommendations == {9: [13, 11, 12]}
+
+
+def test_scores_tens_of_thousands_of_customers_quickly():
+    rng = random.Random(1)
+    histories = {cid: rng.sample(range(2000), rng.randint(1, 6)) for cid in range(30000)}
+    index = build_index(histories)
+    candidates = list(range(0, 2000, 10))
+
+    started = time.perf_counter()
+    recommendations = CoPurchaseRanker(index).rank(list(histories), candidates, limit=3)
+    elapsed = time.perf_counter() - started
+
+    assert len(recommendations) == 30000
+    assert elapsed < 10
+
+
+if __name__ == "__main__":
+    test_missing_products_ranked_by_co_purchase()
+    test_never_purchased_candidates_come_last_in_collection_order()
+    test_chunks_give_same_result()
+    test_engine_uses_affinity_by_default()
+    test_scores_tens_of_thousands_of_customers_quickly()
+    print("✓ CoPurchaseRanker OK")
@@ -28,13 +28,16 @@ def test_recent_forges():
         print(f"✗ Erreur: {e}")
         return
 
-    # Chercher les clients sur 30 jours
+    # Chercher les clients sur 30 jours : seules les commandes de la fenêtre sont lues (history_days),
+    # pas tout l'historique de la boutique
     try:
-        customers = helper.get_eligible_customers(
+        index = helper.build_purchase_index(
             days_start=0,
-            days_end=30, 
-            collection_id=collection_id
+            days_end=30,
+            collection_id=collection_id,
+            history_days=30
         )
+        customers = index.eligible_customers()
         print(f"✓ {len(customers)} clients trouvés (30 jours)\n")
         
         if customers:
@@ -43,7 +46,7 @@ def test_recent_forges():
             print("=" * 80)
             
             for i, c in enumerate(customers, 1):
-                history = helper.get_customer_purchase_history(c.id)
+                history = index.history(c.id)
                 bought = len([p for p in history if p in product_ids])
                 name = f"{c.first_name or ''} {c.last_name or ''}".strip()
                 print(f"{i:<4} {c.email:<40} {name:<30} {bought:<15}")
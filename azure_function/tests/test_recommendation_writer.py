@@ -0,0 +1,142 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+import threading
+
+from core.recommendation_writer import (RecommendationWriter, append_history, build_batch_mutation,
+                                        build_tags_mutation, parse_product_ids)
+
+
+class FakeGraphQLHelper:
+    """metafieldsSet atomique comme chez Shopify : une userError et aucun metafield du lot n'est écrit.
+
+    failing_customer : valeur refusée pour ce client ; batch_error : erreur sans metafield désigné.
+    """
+
+    def __init__(self, failing_customer=None, raise_for=None, batch_error=False):
+        self.failing_customer = failing_customer
+        self.raise_for = raise_for
+        self.batch_error = batch_error
+        self.calls = []
+        self.written = set()
+        self.tagged = []
+        self.lock = threading.Lock()
+
+    def graphql(self, query, variables=None, cost=10):
+        if 'metafields' not in variables:
+            customer_ids = [int(value.rsplit('/', 1)[-1]) for name, value in variables.items() if name.startswith('id')]
+            with self.lock:
+                self.tagged.extend(customer_ids)
+            return {f"t{i}": {'userErrors': []} for i in range(len(customer_ids))}
+
+        with self.lock:
+            self.calls.append(variables)
+        owners = [m['ownerId'] for m in variables['metafields']]
+        if self.raise_for and f"gid://shopify/Customer/{self.raise_for}" in owners:
+            raise RuntimeError("HTTP 502")
+        errors = []
+        if self.batch_error:
+            errors.append({'field': None, 'message': 'Trop de metafields', 'code': 'INVALID'})
+        for i, owner in enumerate(owners):
+            if owner == f"gid://shopify/Customer/{self.failing_customer}":
+                errors.append({'field': ['metafields', str(i), 'value'], 'message': 'Valeur invalide', 'code': 'INVALID'})
+        if not errors:
+            with self.lock:
+                self.written.update(int(owner.rsplit('/', 1)[-1]) for owner in owners)
+        return {'metafieldsSet': {'userErrors': errors}}
+
+
+def test_batches_of_25_with_per_customer_report():
+    helper = FakeGraphQLHelper(failing_customer=7)
+    recommendations = {cid: [cid * 10, cid * 10 + 1, cid * 10 + 2, cid * 10 + 3] for cid in range(1, 61)}
+    report = RecommendationWriter(helper, max_workers=3).write(recommendations)
+
+    # Lot de 7 rejeté en entier, puis renvoyé sans 7 : 4 envois de metafields, 3 de tags
+    assert sorted(len(call['metafields']) for call in helper.calls) == [10, 24, 25, 25]
+    assert report.requests == 7
+    assert len(report.succeeded) == 59
+    assert [(r.customer_id, r.error) for r in report.failed] == [(7, 'Valeur invalide')]
+    # Tag (déclencheur du Flow) uniquement pour les clients dont les metafields sont écrits
+    assert sorted(helper.tagged) == sorted(helper.written) == [cid for cid in range(1, 61) if cid != 7]
+    # 3 recommandations maximum dans le metafield
+    assert next(r for r in report.results if r.customer_id == 2).recommendations == "20,21,22"
+
+
+def test_rejected_batch_fails_every_customer_and_adds_no_tag():
+    helper = FakeGraphQLHelper(batch_error=True)
+    report = RecommendationWriter(helper).write({cid: [1] for cid in range(1, 31)})
+
+    # Erreur qui ne désigne aucun client : rien à renvoyer, tout le lot est en échec
+    assert len(report.failed) == 30 and report.succeeded == []
+    assert all(r.error == "lot rejeté : Trop de metafields" for r in report.failed)
+    assert helper.tagged == [] and report.requests == 2
+
+
+def test_request_failure_marks_whole_batch():
+    helper = FakeGraphQLHelper(raise_for=30)
+    report = RecommendationWriter(helper, batch_size=25).write({cid: [1] for cid in range(1, 51)})
+    assert {r.customer_id for r in report.failed} == set(range(26, 51))
+    assert all(r.error == "HTTP 502" for r in report.failed)
+    assert sorted(helper.tagged) == list(range(1, 26))
+
+
+def test_mutations_set_metafields_then_tag_each_customer():
+    assert build_batch_mutation().count('metafieldsSet(') == 1
+    assert build_batch_mutation(with_history=True).count('metafieldsSet(') == 2
+    assert 'tagsAdd' not in build_batch_mutation(with_history=True)
+    mutation = build_tags_mutation([1, 2, 3])
+    assert mutation.count('tagsAdd(') == 3
+    assert '$id2: ID!' in mutation
+
+
+class FakeMetafieldsHelper:
+    """Sert les metafields cross_sell via nodes(ids:) ; 1 : ancien format seul, 2 : historique JSON."""
+
+    metafields = {
+        "gid://shopify/Customer/1": {'current': {'value': "11,12"}, 'history': None},
+        "gid://shopify/Customer/2": {'current': {'value': "22"}, 'history': {'value': "[20, 21, 22]"}},
+        "gid://shopify/Customer/3": {'current': None, 'history': None},
+    }
+
+    def __init__(self):
+        self.calls = []
+
+    def graphql(self, query, variables=None, cost=10):
+        self.calls.append((variables, cost))
+        return {'nodes': [
+            dict(id=gid, **self.metafields[gid]) if gid in self.metafields else None for gid in variables['ids']
+        ]}
+
+
+def test_read_previous_in_batches_of_100():
+    helper = FakeMetafieldsHelper()
+    previous = RecommendationWriter(helper).read_previous(range(1, 251))
+
+    assert previous == {1: (11, 12), 2: (20, 21, 22)}
+    assert sorted(len(variables['ids']) for variables, _ in helper.calls) == [50, 100, 100]
+
+
+def test_history_is_appended_and_bounded():
+    assert parse_product_ids("1,2") == [1, 2]
+    assert parse_product_ids("[3, 4]") == [3, 4]
+    assert append_history([1, 2, 3], [3, 4]) == [1, 2, 3, 4]
+    assert append_history(range(30), [100]) == list(range(1, 30)) + [100]
+
+    helper = FakeGraphQLHelper()
+    report = RecommendationWriter(helper).write({5: [7, 8], 6: [9]}, history={5: (1, 2)})
+    assert len(report.succeeded) == 2
+    (variables,) = helper.calls
+    assert [json.loads(m['value']) for m in variables['history']] == [[1, 2, 7, 8], [9]]
+    assert {m['key'] for m in variables['history']} == {'recommendation_history'}
+
+
+if __name__ == "__main__":
+    test_batches_of_25_with_per_customer_report()
+    test_rejected_batch_fails_every_customer_and_adds_no_tag()
+    test_request_failure_marks_whole_batch()
+    test_mutations_set_metafields_then_tag_each_customer()
+    test_read_previous_in_batches_of_100()
+    test_history_is_appended_and_bounded()
+    print("✓ RecommendationWriter OK")
@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+
+import pytest
+
+from core.order_cache import OrderCache
+from core.purchase_index import CustomerInfo
+from core.records import OrderRecord, decode_orders, order_record
+
+
+def test_order_record_keeps_only_what_the_scanner_uses(shop):
+    order = shop.order_dict(0)
+    order['billing_address'] = {'city': 'Lyon'}
+    order['line_items'].append({'id': 1, 'product_id': None})
+    record, = decode_orders(json.dumps({'orders': [order]}).encode())
+
+    assert isinstance(record, OrderRecord) and not hasattr(record, '__dict__')
+    assert record.id == order['id'] and record.created_at == order['created_at']
+    assert record.customer == CustomerInfo(order['customer']['id'], order['customer']['first_name'],
+                                           order['customer']['last_name'], order['customer']['email'])
+    # Produit supprimé (product_id null) ignoré
+    assert record.product_ids == tuple(item['product_id'] for item in order['line_items'][:-1])
+    assert order_record({'id': 1, 'created_at': '2026-01-01T00:00:00Z', 'customer': None}).customer is None
+
+
+def test_orders_are_requested_with_fields_and_decoded_as_records(shop, api, make_helper):
+    with make_helper(api) as helper:
+        orders = list(helper.iter_orders())
+        projected = api.bytes_sent
+        api.reset_counters()
+        # Même lecture sans projection : charge utile complète
+        list(helper.iter_order_pages(fields=None, status='any'))
+        full = api.bytes_sent
+    assert [order.id for order in orders] == [int(i) for i in shop.order_ids]
+    assert all(isinstance(order, OrderRecord) for order in orders)
+    assert projected < full
+
+
+def test_records_feed_the_order_cache(shop, api, make_helper, tmp_path):
+    customer_id = int(shop.customer_ids[0])
+    cache = OrderCache(str(tmp_path / "cache.sqlite"))
+    with make_helper(api) as helper:
+        history = helper.get_customer_purchase_history(customer_id)
+    with make_helper(api, cache=cache) as helper:
+        assert helper.sync_cache() == len(shop.order_ids)
+    assert history and cache.get_customer_purchase_history(customer_id) == history
+    cache.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
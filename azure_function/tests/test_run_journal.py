@@ -0,0 +1,123 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import re
+
+from core.recommendation_writer import RecommendationWriter, WriteResult
+from core.run_journal import RunJournal, STATUS_ABANDONED, STATUS_DONE
+
+
+class CountingHelper:
+    """Accepte toutes les mutations ; s'arrête (comme un timeout) après fail_after lots."""
+
+    def __init__(self, fail_after=None, reject=None):
+        self.fail_after = fail_after
+        # Client dont la valeur est refusée : metafieldsSet atomique, tout son lot est rejeté
+        self.reject = reject
+        self.written = []
+
+    def graphql(self, query, variables=None, cost=10):
+        if 'metafields' not in variables:
+            return {name: {'userErrors': []} for name in re.findall(r'(t\d+): tagsAdd', query)}
+        if self.fail_after is not None and len(self.written) >= self.fail_after:
+            raise KeyboardInterrupt("timeout")
+        owners = [int(m['ownerId'].rsplit('/', 1)[-1]) for m in variables['metafields']]
+        if self.reject in owners:
+            field = ['metafields', str(owners.index(self.reject)), 'value']
+            return {'metafieldsSet': {'userErrors': [{'field': field, 'message': 'Valeur invalide', 'code': 'INVALID'}]}}
+        self.written.append(owners)
+        return {'metafieldsSet': {'userErrors': []}}
+
+
+def write_pending(journal, run, helper):
+    pending = journal.pending(run)
+    writer = RecommendationWriter(helper, batch_size=10, max_workers=1)
+    writer.write(pending.recommendations, history=pending.history,
+                 on_batch=lambda results: journal.record(run, results))
+    return pending
+
+
+def test_interrupted_run_resumes_without_rewriting(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    recommendations = {cid: [cid, cid + 1] for cid in range(1, 36)}
+
+    journal = RunJournal(path)
+    run = journal.begin('2026-10-18')
+    journal.save_plan(run, recommendations, history={1: (9,)}, origins={1: 'Louis'})
+    helper = CountingHelper(fail_after=2)
+    try:
+        write_pending(journal, run, helper)
+    except KeyboardInterrupt:
+        pass
+    journal.close()
+
+    journal = RunJournal(path)
+    resumed = journal.begin('2026-10-18')
+    assert resumed.resumed and resumed.id == run.id
+    helper = CountingHelper()
+    pending = write_pending(journal, resumed, helper)
+    assert pending.already_done == 20
+    assert sorted(cid for batch in helper.written for cid in batch) == list(range(21, 36))
+    assert journal.finish(resumed) == 0
+    assert resumed.status == STATUS_DONE
+
+
+def test_rejected_batch_is_rewritten_by_the_next_run(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.sqlite"))
+    recommendations = {cid: [cid, cid + 1] for cid in range(1, 31)}
+    run = journal.begin('2026-10-17')
+    journal.save_plan(run, recommendations)
+    # Lot 11-20 rejeté par metafieldsSet à cause de 15, puis renvoyé sans lui
+    helper = CountingHelper(reject=15)
+    write_pending(journal, run, helper)
+    written = {cid for batch in helper.written for cid in batch}
+    assert written == set(range(1, 31)) - {15}
+    assert journal.finish(run) == 1
+
+    run = journal.begin('2026-10-18')
+    journal.save_plan(run, recommendations)
+    helper = CountingHelper()
+    pending = write_pending(journal, run, helper)
+    # Seuls les clients réellement écrits sont inchangés : 15 est réécrit
+    assert pending.unchanged == 29
+    assert helper.written == [[15]]
+    assert journal.finish(run) == 0
+
+
+def test_unchanged_customers_are_skipped_next_day(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.sqlite"))
+    run = journal.begin('2026-10-17')
+    journal.save_plan(run, {1: [10, 11], 2: [20]})
+    journal.record(run, [WriteResult(1, True), WriteResult(2, True)])
+    journal.finish(run)
+
+    run = journal.begin('2026-10-18')
+    assert not run.resumed
+    journal.save_plan(run, {1: [10, 11], 2: [21], 3: [30]})
+    pending = journal.pending(run)
+    assert pending.unchanged == 1
+    assert pending.recommendations == {2: [21], 3: [30]}
+    # Un échec d'écriture laisse le client à refaire
+    journal.record(run, [WriteResult(2, True), WriteResult(3, False, error='x')])
+    assert journal.finish(run) == 1
+
+
+def test_stale_unfinished_run_is_abandoned(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.sqlite"))
+    stale = journal.begin('2026-10-17')
+    journal.save_plan(stale, {1: [10]})
+    fresh = journal.begin('2026-10-18')
+    assert fresh.id != stale.id and not fresh.resumed
+    status = journal.conn.execute("SELECT status FROM runs WHERE id = ?", (stale.id,)).fetchone()[0]
+    assert status == STATUS_ABANDONED
+
+
+if __name__ == "__main__":
+    import tempfile
+    for test in (test_interrupted_run_resumes_without_rewriting, test_rejected_batch_is_rewritten_by_the_next_run,
+                 test_unchanged_customers_are_skipped_next_day,
+                 test_stale_unfinished_run_is_abandoned):
+        with tempfile.TemporaryDirectory() as directory:
+            test(Path(directory))
+    print("✓ RunJournal OK")
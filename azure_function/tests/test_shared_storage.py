@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from unittest import mock
+
+import pytest
+
+from core import shared_storage
+from core.order_cache import OrderCache
+from core.run_journal import RunJournal
+from core.shared_storage import connect, filesystem_type, is_network_path, require_shared_cache_dir
+
+MOUNTS = """\
+overlay / overlay rw,relatime 0 0
+tmpfs /tmp tmpfs rw,nosuid,nodev 0 0
+//tbstorage.file.core.windows.net/cross-sell /mounts/cross\\040sell cifs rw,vers=3.1.1 0 0
+"""
+
+
+def write_mounts(tmp_path):
+    mounts = tmp_path / 'mounts'
+    mounts.write_text(MOUNTS)
+    return str(mounts)
+
+
+def test_filesystem_type_uses_the_longest_mount_point(tmp_path):
+    mounts = write_mounts(tmp_path)
+    assert filesystem_type('/mounts/cross sell/journal', mounts) == 'cifs'
+    assert filesystem_type('/tmp/cache', mounts) == 'tmpfs'
+    assert filesystem_type('/mounts/cross', mounts) == 'overlay'
+    assert is_network_path('/mounts/cross sell', mounts)
+    assert not is_network_path('/tmp', mounts)
+    # Sans /proc/mounts : rien ne permet de dire que le dossier est distant
+    assert filesystem_type('/tmp', str(tmp_path / 'absent')) is None
+
+
+def test_journal_leaves_wal_on_a_network_share(tmp_path):
+    journal = RunJournal(str(tmp_path / 'local.sqlite'))
+    assert journal.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    journal.close()
+
+    with mock.patch.object(shared_storage, 'is_network_path', return_value=True):
+        journal = RunJournal(str(tmp_path / 'share.sqlite'))
+    assert journal.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    journal.close()
+    conn = connect(str(tmp_path / 'share.sqlite'))
+    # Rouverte sur disque local, la même base repasse en WAL
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    conn.close()
+
+
+def test_order_cache_uses_delete_journal_on_a_network_share(tmp_path):
+    with mock.patch.object(shared_storage, 'is_network_path', return_value=True):
+        cache = OrderCache(str(tmp_path / 'share.sqlite'))
+    assert cache.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    cache.close()
+
+
+def test_queue_mode_requires_a_shared_cache_dir(tmp_path):
+    mounts = write_mounts(tmp_path)
+    with pytest.raises(RuntimeError, match="CROSS_SELL_CACHE_DIR"):
+        require_shared_cache_dir("WRITE_MODE=queue", environ={}, mounts_path=mounts)
+    # En local (pas de WEBSITE_INSTANCE_ID) : un dossier explicite suffit
+    assert require_shared_cache_dir("WRITE_MODE=queue", environ={'CROSS_SELL_CACHE_DIR': '/tmp/cache'},
+                                    mounts_path=mounts) == '/tmp/cache'
+    azure = {'WEBSITE_INSTANCE_ID': 'abc', 'CROSS_SELL_CACHE_DIR': '/tmp/cache'}
+    with pytest.raises(RuntimeError, match="partage monté"):
+        require_shared_cache_dir("WRITE_MODE=queue", environ=azure, mounts_path=mounts)
+    azure['CROSS_SELL_CACHE_DIR'] = '/mounts/cross sell'
+    assert require_shared_cache_dir("WRITE_MODE=queue", environ=azure, mounts_path=mounts) == '/mounts/cross sell'
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -3,6 +3,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from core.shopify_helper import ShopifyHelper
+from core.campaigns import load_campaigns, merge_recommendations
 import os
 from dotenv import load_dotenv
 
@@ -19,10 +20,12 @@ def test_simulation():
         print("Erreur: Variables .env manquantes (token ou duo ID/Secret requis).")
         return
 
-    helper = ShopifyHelper(store_url, access_token=access_token, client_id=client_id, client_secret=client_secret)
+    # Run à blanc : le pipeline complet tourne, aucune écriture n'est envoyée à Shopify
+    helper = ShopifyHelper(store_url, access_token=access_token, client_id=client_id, client_secret=client_secret,
+                           dry_run=True, dry_run_path=os.getenv("DRY_RUN_OUTPUT") or None)
+
+    print(f"--- Simulation Scanner pour {store_url} (run à blanc) ---")
 
-    print(f"--- Simulation Scanner pour {store_url} ---")
-    
     # 1. Test récupération collection
     try:
         pids = helper.get_collection_products(collection_id)
@@ -31,19 +34,23 @@ def test_simulation():
         print(f"Erreur API (Collection): {e}")
         return
 
-    # 2. Test recherche clients (30 derniers jours pour validation technique)
-    days_start = 0
-    days_end = 30
+    # 2. Campagnes, classement et écritures prévues, exactement comme le scanner
     try:
-        customers = helper.get_eligible_customers(days_start=days_start, days_end=days_end, collection_id=None)
-        print(f"DEBUG: {len(customers)} clients trouvés pour la période J-{days_start} à J-{days_end} (SANS filtre collection)")
-        
-        for customer in customers:
-            print(f"Traitement client {customer.id} ({customer.email})")
-            history = helper.get_customer_purchase_history(customer.id)
-            recos = [pid for pid in pids if pid not in history][:3]
-            print(f"  -> Recommandations calculées: {recos}")
-            
+        campaigns = load_campaigns()
+        history_days = int(os.getenv("ORDER_HISTORY_DAYS")) if os.getenv("ORDER_HISTORY_DAYS") else None
+        results = helper.run_campaigns(campaigns, history_days=history_days)
+        for result in results:
+            print(f"DEBUG: Campagne {result.campaign.name}: {result.eligible_count} éligible(s), "
+                  f"{len(result.recommendations)} avec recommandations")
+
+        recommendations, origins = merge_recommendations(results)
+        history = {}
+        for result in results:
+            history.update(result.previous)
+        report = helper.update_customers_recommendations(recommendations, history=history, origins=origins)
+        print(f"DEBUG: {report.summary()}")
+        print(f"DEBUG: Écritures prévues : {report.artifact}")
+
     except Exception as e:
         print(f"Erreur API (Clients): {e}")
 
@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from core.telemetry import ScanTelemetry
+from core.throttle import ShopifyThrottle
+from tests.fake_admin_api import FakeAdminAPI
+
+
+def test_requests_bytes_and_phases_are_counted(shop, api, make_helper):
+    collection_id = int(shop.collection_ids[0])
+    with make_helper(api) as helper:
+        customers = helper.get_eligible_customers(days_start=0, days_end=365, collection_id=collection_id)
+        helper.get_collection_products(collection_id)
+        summary = helper.telemetry.summary()
+
+    assert summary['requests']['rest'] == api.calls['rest:orders']
+    assert summary['requests']['graphql'] == api.calls['graphql:collection'] == 1
+    assert summary['bytes_received'] == api.bytes_sent
+    # Collection lue une fois puis servie par le CollectionIndex
+    assert summary['cache_hit_rate']['collections'] == 0.5
+    assert summary['cache_hit_rate']['orders'] == 0.0
+    eligible = summary['phases']['shopify.get_eligible_customers']
+    assert eligible['calls'] == 1 and eligible['items'] == len(customers) > 0
+    assert eligible['items_per_second'] > 0
+    assert 'shopify.get_eligible_customers' in helper.telemetry.format_summary()
+
+
+def test_throttle_wait_is_recorded(shop, make_helper):
+    throttle = ShopifyThrottle(rest_bucket_size=3, rest_leak_rate=20)
+    # Seau REST de 3 appels côté boutique : le limiteur doit espacer les pages
+    with FakeAdminAPI(shop, rest_bucket_size=3, rest_leak_rate=20) as api, make_helper(api, throttle=throttle) as helper:
+        list(helper.iter_orders())
+    assert helper.telemetry.throttle_wait > 0
+    assert helper.telemetry.throttle_wait == pytest.approx(throttle.wait_time)
+
+
+def test_spans_are_nested_per_helper_method(shop, api, make_helper):
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    telemetry = ScanTelemetry(api.store_url)
+    telemetry.tracer = provider.get_tracer("test")
+
+    with make_helper(api, telemetry=telemetry) as helper:
+        with telemetry.phase("scanner.scan"):
+            helper.build_purchase_index(days_start=0, days_end=365, collection_id=int(shop.collection_ids[0]))
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert spans['shopify.build_purchase_index'].parent.span_id == spans['scanner.scan'].context.span_id
+    assert spans['scanner.scan'].attributes['store'] == api.store_url
+
+
+def test_summary_without_activity():
+    summary = ScanTelemetry().summary()
+    assert summary['requests'] == {} and summary['mean_request_seconds'] is None
+    assert ScanTelemetry("boutique.myshopify.com").format_summary().endswith("0.0s d'attente du limiteur")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,148 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import json
+from unittest import mock
+
+from core.throttle import ShopifyThrottle, ThrottledError
+from core.shopify_helper import ShopifyHelper
+
+
+class FakeClock:
+    """Horloge simulée : time.sleep avance time.monotonic sans attendre."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def patched_clock():
+    clock = FakeClock()
+    return clock, mock.patch.multiple('core.throttle.time', monotonic=clock.monotonic, sleep=clock.sleep)
+
+
+def test_rest_bucket_paces_before_overflow():
+    clock, patch = patched_clock()
+    with patch:
+        throttle = ShopifyThrottle(rest_bucket_size=40, rest_leak_rate=2)
+        throttle.record_rest({'x-shopify-shop-api-call-limit': '38/40'})
+        throttle.wait_rest()
+        assert clock.sleeps == []
+        # 39 + 1 dépasse la marge de 39 places : une demi-seconde pour libérer une place
+        throttle.wait_rest()
+    assert clock.sleeps[-1] == 0.5
+    assert throttle.wait_time == 0.5
+
+
+def test_graphql_cost_waits_for_restore():
+    clock, patch = patched_clock()
+    with patch:
+        throttle = ShopifyThrottle()
+        throttle.record_graphql({'throttleStatus': {'maximumAvailable': 2000, 'currentlyAvailable': 100, 'restoreRate': 100}})
+        throttle.wait_graphql(100)
+        throttle.wait_graphql(300)
+    assert clock.sleeps == [3.0]
+
+
+def test_stale_server_levels_never_loosen_the_local_bucket():
+    clock, patch = patched_clock()
+    with patch:
+        throttle = ShopifyThrottle(rest_bucket_size=40, rest_leak_rate=2)
+        for _ in range(30):
+            throttle.reserve_rest()
+        # Réponse partie avant les 30 réservations : son niveau est en retard sur le nôtre
+        throttle.record_rest({'X-Shopify-Shop-Api-Call-Limit': '5/40'})
+        assert throttle._rest_level(clock.now) == 30
+        throttle.record_rest({'X-Shopify-Shop-Api-Call-Limit': '35/40'})
+        assert throttle._rest_level(clock.now) == 35
+
+        throttle.reserve_graphql(600)
+        throttle.record_graphql({'throttleStatus': {'maximumAvailable': 1000, 'currentlyAvailable': 1000, 'restoreRate': 50}})
+        assert throttle._graphql_level(clock.now) == 400
+        throttle.record_graphql({'throttleStatus': {'maximumAvailable': 1000, 'currentlyAvailable': 100, 'restoreRate': 50}})
+        assert throttle._graphql_level(clock.now) == 100
+
+
+def test_rest_share_splits_the_store_bucket():
+    clock, patch = patched_clock()
+    with patch:
+        # Quatre activités sur la même boutique : chacune un quart des 40 appels et du débit
+        throttles = [ShopifyThrottle(rest_bucket_size=40, rest_leak_rate=2, rest_share=0.25) for _ in range(4)]
+        free = sum(1 for throttle in throttles for _ in range(12) if throttle.reserve_rest() == 0)
+        assert free <= 40 - 4
+        assert throttles[0].rest_leak_rate == 0.5
+
+        # L'en-tête compte les appels de toutes les activités : ramené à la part du limiteur
+        throttle = ShopifyThrottle(rest_share=0.25)
+        throttle.record_rest({'X-Shopify-Shop-Api-Call-Limit': '20/40'})
+        assert throttle.rest_bucket_size == 10
+        assert throttle._rest_level(clock.now) == 5
+
+
+def test_backoff_honours_retry_after_then_gives_up():
+    clock, patch = patched_clock()
+    with patch:
+        throttle = ShopifyThrottle(max_retries=2, base_delay=0)
+        throttle.backoff(0, retry_after='2.0')
+        throttle.backoff(1)
+        try:
+            throttle.backoff(2)
+        except ThrottledError:
+            pass
+        else:
+            raise AssertionError("La 3e tentative refusée doit lever ThrottledError")
+    assert clock.sleeps[0] == 2.0
+    assert throttle.throttled_count == 3
+
+
+def graphql_response(status_code, payload, headers=None):
+    response = mock.Mock(status_code=status_code, headers=headers or {}, content=json.dumps(payload).encode())
+    response.json.return_value = payload
+    return response
+
+
+def test_helper_graphql_retries_429_and_throttled():
+    ok = {'data': {'shop': {'name': 'TB'}}, 'extensions': {'cost': {'throttleStatus': {
+        'maximumAvailable': 1000, 'currentlyAvailable': 990, 'restoreRate': 50}}}}
+    throttled = {'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}]}
+    responses = [graphql_response(429, {}, {'Retry-After': '0'}), graphql_response(200, throttled), graphql_response(200, ok)]
+
+    helper = ShopifyHelper('tb.myshopify.com', access_token='token', throttle=ShopifyThrottle(base_delay=0))
+    with mock.patch.object(helper.http, 'post', side_effect=responses) as post, \
+            mock.patch('core.throttle.time.sleep'):
+        assert helper.graphql('{ shop { name } }') == {'shop': {'name': 'TB'}}
+    assert post.call_count == 3
+    assert helper.throttle.throttled_count == 2
+
+
+def test_helper_rest_retries_429_and_records_call_limit():
+    ok = graphql_response(200, {'orders': []}, {'X-Shopify-Shop-Api-Call-Limit': '12/40'})
+    responses = [graphql_response(429, {}, {'Retry-After': '0'}), ok]
+
+    helper = ShopifyHelper('tb.myshopify.com', access_token='token', throttle=ShopifyThrottle(base_delay=0))
+    with mock.patch.object(helper.http, 'request', side_effect=responses) as request, \
+            mock.patch('core.throttle.time.sleep'):
+        assert helper._request('GET', 'orders.json', params={'status': 'any'}) is ok
+    assert request.call_count == 2
+    assert request.call_args[0] == ('GET', 'https://tb.myshopify.com/admin/api/2025-01/orders.json')
+    assert helper.throttle.throttled_count == 1
+    assert helper.throttle.rest_bucket_size == 40
+
+
+if __name__ == "__main__":
+    test_rest_bucket_paces_before_overflow()
+    test_graphql_cost_waits_for_restore()
+    test_stale_server_levels_never_loosen_the_local_bucket()
+    test_rest_share_splits_the_store_bucket()
+    test_backoff_honours_retry_after_then_gives_up()
+    test_helper_graphql_retries_429_and_throttled()
+    test_helper_rest_retries_429_and_records_call_limit()
+    print("✓ ShopifyThrottle OK")
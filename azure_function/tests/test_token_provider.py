@@ -0,0 +1,126 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import threading
+import time
+from unittest import mock
+
+from core.shopify_helper import ShopifyHelper
+from core.token_provider import TokenProvider
+
+STORE = 'tb.myshopify.com'
+
+
+class FakeTokenEndpoint:
+    """Stand-in de /admin/oauth/access_token : chaque échange renvoie un nouveau jeton."""
+
+    def __init__(self, expires_in=86399, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+            token = f"shpat_{self.calls}"
+        response = mock.Mock(status_code=200, headers={})
+        response.json.return_value = {'access_token': token, 'expires_in': self.expires_in}
+        return response
+
+
+def test_token_is_cached_in_memory():
+    endpoint = FakeTokenEndpoint()
+    provider = TokenProvider(http=endpoint)
+    assert provider.get_token(STORE, 'id', 'secret') == 'shpat_1'
+    assert provider.get_token(STORE, 'id', 'secret') == 'shpat_1'
+    assert endpoint.calls == 1
+
+
+def test_token_is_refreshed_ahead_of_expiry():
+    endpoint = FakeTokenEndpoint(expires_in=200)
+    provider = TokenProvider(http=endpoint, refresh_margin=300)
+    # Expire dans moins que la marge : chaque appel renouvelle
+    assert provider.get_token(STORE, 'id', 'secret') == 'shpat_1'
+    assert provider.get_token(STORE, 'id', 'secret') == 'shpat_2'
+
+
+def test_disk_cache_is_shared_between_providers(tmp_path):
+    cache_path = str(tmp_path / 'tokens.json')
+    endpoint = FakeTokenEndpoint()
+    TokenProvider(cache_path=cache_path, http=endpoint).get_token(STORE, 'id', 'secret')
+    assert TokenProvider(cache_path=cache_path, http=endpoint).get_token(STORE, 'id', 'secret') == 'shpat_1'
+    assert endpoint.calls == 1
+
+
+def test_concurrent_callers_share_one_exchange():
+    endpoint = FakeTokenEndpoint(delay=0.05)
+    provider = TokenProvider(http=endpoint)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(provider.get_token(STORE, 'id', 'secret')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert endpoint.calls == 1
+    assert set(tokens) == {'shpat_1'}
+
+
+def test_concurrent_401s_share_one_renewal():
+    endpoint = FakeTokenEndpoint(delay=0.05)
+    provider = TokenProvider(http=endpoint)
+    revoked = provider.get_token(STORE, 'id', 'secret')
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(provider.get_token(STORE, 'id', 'secret', rejected=revoked)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert endpoint.calls == 2
+    assert set(tokens) == {'shpat_2'}
+
+
+def test_helper_renews_a_revoked_token_once():
+    endpoint = FakeTokenEndpoint()
+    provider = TokenProvider(http=endpoint)
+    helper = ShopifyHelper(STORE, client_id='id', client_secret='secret', token_provider=provider)
+    assert helper.access_token == 'shpat_1'
+
+    sent = []
+
+    def request(method, url, **kwargs):
+        sent.append(helper.http.headers['X-Shopify-Access-Token'])
+        return mock.Mock(status_code=401 if len(sent) == 1 else 200, headers={}, content=b'{}')
+
+    with mock.patch.object(helper.http, 'request', side_effect=request):
+        assert helper._request('GET', 'shop.json').status_code == 200
+    assert sent == ['shpat_1', 'shpat_2']
+    assert provider.get_token(STORE, 'id', 'secret') == 'shpat_2'
+
+    # Un second 401 d'affilée n'est pas rejoué en boucle
+    response = mock.Mock(status_code=401, headers={}, content=b'{}')
+    response.raise_for_status.side_effect = RuntimeError('401')
+    with mock.patch.object(helper.http, 'request', return_value=response) as request:
+        try:
+            helper._request('GET', 'shop.json')
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Un 401 persistant doit remonter")
+    assert request.call_count == 2
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_token_is_cached_in_memory()
+    test_token_is_refreshed_ahead_of_expiry()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_disk_cache_is_shared_between_providers(Path(tmp))
+    test_concurrent_callers_share_one_exchange()
+    test_concurrent_401s_share_one_renewal()
+    test_helper_renews_a_revoked_token_once()
+    print("✓ TokenProvider OK")
@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import os
+
+import pytest
+
+from core.recommendation_writer import WriteReport, WriteResult
+from core.run_journal import RunJournal
+from core.write_queue import (RecommendationQueue, WriteFailedError, decode_message, iter_messages, message_run,
+                              process_message)
+
+
+class MemoryQueueClient:
+    """Équivalent en mémoire de QueueClient.send_message."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, body):
+        self.messages.append(body)
+
+
+def test_plan_is_split_into_compact_messages():
+    recommendations = {customer_id: [1, 2, 3] for customer_id in range(60)}
+    recommendations[99] = []
+    messages = list(iter_messages(recommendations, history={0: (7,)}, origins={0: 'louis'}, batch_size=25))
+    assert [len(entries) for entries, _ in messages] == [25, 25, 10]
+
+    decoded, history, origins = decode_message(messages[0][1])
+    assert decoded[0] == [1, 2, 3] and len(decoded) == 25
+    assert history[0] == (7,) and history[1] == ()
+    assert origins == {0: 'louis'}
+    # Sans historique, le message ne demande pas d'écrire le metafield d'historique
+    _, body = next(iter_messages({5: [1]}))
+    assert decode_message(body) == ({5: [1]}, None, {})
+
+
+def test_enqueue_reports_handed_off_customers():
+    client = MemoryQueueClient()
+    handed_off = []
+    sent = RecommendationQueue(client).enqueue({1: [10, 11], 2: [12]}, batch_size=1,
+                                               on_batch=lambda results: handed_off.extend(results))
+    assert sent == len(client.messages) == 2
+    assert [(r.customer_id, r.success, r.recommendations) for r in handed_off] == [(1, True, "10,11"), (2, True, "12")]
+
+
+def test_process_message_writes_through_helper(shop, api, make_helper):
+    customer_id = int(shop.customer_ids[0])
+    _, body = next(iter_messages({customer_id: [int(shop.product_ids[0])]}, history={}, origins={customer_id: 'a'}))
+    with make_helper(api) as helper:
+        report = process_message(helper, body)
+        assert api.calls['graphql:metafieldsSet'] == 1
+    assert [r.customer_id for r in report.succeeded] == [customer_id]
+    assert 'trigger_reco' in shop.tags[customer_id]
+
+
+def test_failed_customers_make_the_message_retry():
+    class FailingHelper:
+        def update_customers_recommendations(self, recommendations, **kwargs):
+            return WriteReport(results=[WriteResult(customer_id, False, error="boom") for customer_id in recommendations])
+
+    _, body = next(iter_messages({42: [1]}))
+    with pytest.raises(WriteFailedError, match="42"):
+        process_message(FailingHelper(), body)
+
+
+def test_journal_waits_for_the_queue_to_confirm_writes(shop, api, make_helper):
+    class FailingHelper:
+        def update_customers_recommendations(self, recommendations, on_batch=None, **kwargs):
+            results = [WriteResult(customer_id, False, error="boom") for customer_id in recommendations]
+            on_batch(results)
+            return WriteReport(results=results)
+
+    customer_ids = [int(cid) for cid in shop.customer_ids[:2]]
+    journal = RunJournal(":memory:")
+    run = journal.begin('2026-10-18')
+    journal.save_plan(run, {cid: [int(shop.product_ids[0])] for cid in customer_ids}, campaigns=['a'])
+    client = MemoryQueueClient()
+    RecommendationQueue(client).enqueue(journal.pending(run).recommendations, batch_size=1, store='s', run=run.id)
+    assert message_run(client.messages[0]) == run.id
+    # Dépôt en file : rien n'est encore journalisé, le watermark n'avance pas
+    assert journal.finish(run) == 2 and journal.eligibility_watermarks() == {}
+
+    confirm = lambda results: journal.confirm(run.id, results)
+    with make_helper(api) as helper:
+        process_message(helper, client.messages[0], on_batch=confirm)
+        # Message en échec (puis en file poison) : son client reste à écrire, le run reste ouvert
+        with pytest.raises(WriteFailedError):
+            process_message(FailingHelper(), client.messages[1], on_batch=confirm)
+        assert journal.finish(run) == 1 and journal.eligibility_watermarks() == {}
+
+        process_message(helper, client.messages[1], on_batch=confirm)
+    assert journal.eligibility_watermarks() == {'a': '2026-10-18'}
+    assert journal.finish(run) == 0
+
+    # Confirmation tardive d'un run plus ancien : le watermark ne recule pas
+    journal.advance_eligibility(run, ['a'], '2026-10-01')
+    assert journal.eligibility_watermarks() == {'a': '2026-10-18'}
+    journal.close()
+
+
+@pytest.mark.skipif(not os.environ.get("AZURITE_CONNECTION_STRING"),
+                    reason="Azurite non lancé (AZURITE_CONNECTION_STRING=UseDevelopmentStorage=true)")
+def test_roundtrip_through_azurite():
+    queue = RecommendationQueue.from_connection_string(os.environ["AZURITE_CONNECTION_STRING"], "cross-sell-writes-test")
+    queue.queue_client.clear_messages()
+    queue.enqueue({1: [10]}, origins={1: 'a'})
+    message = next(iter(queue.queue_client.receive_messages()))
+    assert decode_message(message.content) == ({1: [10]}, None, {1: 'a'})
+    queue.queue_client.delete_queue()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))